@@ -0,0 +1,189 @@
+"""Benchmark cases of the framework hot paths.
+
+Each case is a generator function decorated with :func:`benchmark`. The code before the ``yield`` is the setup, the
+yielded callable is the measured operation and the code after the ``yield`` is the teardown.
+"""
+import os
+import random
+import shutil
+import tempfile
+import threading
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from halborn_ctf.state import State
+from halborn_ctf.templates import GenericChallenge, FlagType
+from halborn_ctf.network import find_free_port
+from halborn_ctf import shell
+from halborn_ctf.functions import periodic
+from halborn_ctf._archive import _archive_chunks, _resolve_entries, _CompressedFileCache
+
+CASES = {}
+
+
+def benchmark(name, number, repeat=5):
+    """Registers a benchmark case.
+
+    Args:
+        name (str): Unique name of the case.
+        number (int): Amount of times the operation is executed on each measure.
+        repeat (int, optional): Amount of measures. Defaults to 5.
+    """
+    def decorator(function):
+        CASES[name] = (function, number, repeat)
+        return function
+    return decorator
+
+
+class _Challenge(GenericChallenge):
+    FLAG_TYPE = FlagType.STATIC
+
+    def run(self):
+        pass
+
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid waiting for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _echo_server():
+    server = ThreadingHTTPServer(('127.0.0.1', find_free_port()), _EchoHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_RPC_CALL = {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_blockNumber', 'params': []}
+
+
+@benchmark('state_getattr', number=100000)
+def state_getattr():
+    state = State({'value': 1, 'nested': {'deeper': {'value': 2}}})
+    yield lambda: state.nested.deeper.value
+
+
+@benchmark('state_merge', number=2000)
+def state_merge():
+    data = {'key{}'.format(i): {'value': i, 'nested': {'items': list(range(10))}} for i in range(50)}
+    state = State(json.loads(json.dumps(data)))
+    yield lambda: state._merge(data)
+
+
+@benchmark('info_handler', number=5000)
+def info_handler():
+    challenge = _Challenge()
+    challenge.PATH_MAPPING = {'/{}'.format(i): {'port': 8000 + i, 'methods': ['GET', 'POST']} for i in range(10)}
+    challenge.state_public = {'address': '0x' + '00' * 20, 'players': list(range(20))}
+    app = challenge._app
+    with app.test_request_context('/info'):
+        yield lambda: app.json.dumps(challenge._app_info_handler())
+
+
+@benchmark('files_archive_cold', number=5)
+@benchmark('files_archive_cached', number=20)
+def files_archive():
+    folder = tempfile.mkdtemp(prefix='halborn_ctf_bench_')
+    generator = random.Random(0)
+    for i in range(20):
+        with open(os.path.join(folder, 'file{}.sol'.format(i)), 'wb') as f:
+            # Half random (incompressible) and half text
+            f.write(generator.randbytes(32 * 1024) + b'contract Bench {}\n' * 2000)
+    entries = _resolve_entries([os.path.join(folder, '*.sol')])
+    cache = _CompressedFileCache()
+
+    def build(cache):
+        for _ in _archive_chunks(entries, cache):
+            pass
+
+    yield {
+        'files_archive_cold': lambda: build(_CompressedFileCache()),
+        'files_archive_cached': lambda: build(cache),
+    }
+    cache.clear()
+    shutil.rmtree(folder)
+
+
+@benchmark('json_rpc_filter_decision', number=5000)
+def json_rpc_filter_decision():
+    from mitmproxy.test import taddons, tflow
+    from halborn_ctf.network.filters._json_rpc.whitelist_json_rpc_method import WhitelistJSONRPCMethod
+
+    addon = WhitelistJSONRPCMethod()
+    with taddons.context(addon) as context:
+        context.configure(addon, methods=json.dumps(['net_.*', 'eth_.*', 'web3_.*']))
+        flow = tflow.tflow()
+        flow.request.content = json.dumps(dict(_RPC_CALL, method='anvil_setBalance')).encode()
+
+        def decide():
+            flow.response = None
+            addon.request(flow)
+
+        yield decide
+
+
+@benchmark('proxy_direct', number=500)
+@benchmark('proxy_mapping', number=500)
+def proxy():
+    server = _echo_server()
+    port = server.server_address[1]
+
+    challenge = _Challenge()
+    challenge.PATH_MAPPING = {'/rpc': {'port': port, 'methods': ['POST']}}
+    challenge._register_flask_paths()
+    challenge._register_challenge_paths()
+    client = challenge._app.test_client()
+    session = requests.Session()
+
+    yield {
+        'proxy_direct': lambda: session.post('http://127.0.0.1:{}/'.format(port), json=_RPC_CALL).content,
+        'proxy_mapping': lambda: client.post('/rpc', json=_RPC_CALL).data,
+    }
+    session.close()
+    server.shutdown()
+    server.server_close()
+
+
+@benchmark('shell_run_capture', number=5)
+@benchmark('shell_run_logged', number=5)
+def shell_run():
+    yield {
+        'shell_run_capture': lambda: shell.run('seq 1 50000', capture_output=True),
+        'shell_run_logged': lambda: shell.run('seq 1 50000'),
+    }
+
+
+@benchmark('periodic_dispatch', number=5)
+def periodic_dispatch():
+    executions = 200
+    done = threading.Event()
+    count = [0]
+
+    @periodic(every=0.0005)
+    def tick():
+        count[0] += 1
+        if count[0] >= executions:
+            done.set()
+
+    def run():
+        count[0] = 0
+        done.clear()
+        tick()
+        done.wait(10)
+        tick.stop()
+
+    yield run
@@ -0,0 +1,131 @@
+"""Runs the framework micro-benchmarks and compares them against the stored baseline.
+
+Every case runs with a fixed configuration (amount of executions and measures, fixed random seeds and the
+garbage collector disabled while measuring) so results are comparable between runs on the same machine.
+
+Example:
+
+    .. code::
+
+        python benchmarks/run.py                    # Runs all the cases and compares them with baseline.json
+        python benchmarks/run.py state_ proxy_      # Only the cases starting with the given prefixes
+        python benchmarks/run.py --save             # Stores the results as the new baseline
+        python benchmarks/run.py --json results.json
+
+The script exits with code ``1`` if any case is slower than the baseline by more than ``--tolerance``.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cases import CASES  # noqa: E402
+
+_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def _measure(name):
+    function, number, repeat = CASES[name]
+    random.seed(0)
+
+    generator = function()
+    operation = next(generator)
+    if isinstance(operation, dict):
+        operation = operation[name]
+
+    try:
+        # Warm up (imports, caches, connections)
+        for _ in range(max(1, number // 10)):
+            operation()
+
+        timings = []
+        for _ in range(repeat):
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for _ in range(number):
+                    operation()
+                timings.append((time.perf_counter() - start) / number)
+            finally:
+                gc.enable()
+    finally:
+        generator.close()
+
+    return {
+        'min_us': round(min(timings) * 1e6, 3),
+        'median_us': round(statistics.median(timings) * 1e6, 3),
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Runs the halborn_ctf micro-benchmarks')
+    parser.add_argument('prefixes', nargs='*', help='Only run the cases starting with any of the prefixes')
+    parser.add_argument('--save', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--baseline', default=_BASELINE, help='Baseline file. Defaults to benchmarks/baseline.json')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown over the baseline median. Defaults to 0.25 (25%%)')
+    parser.add_argument('--json', help='File to write the results to')
+    args = parser.parse_args(args)
+
+    # The cases log on hot paths, only measure the cost of disabled logs
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    except FileNotFoundError:
+        baseline = {}
+
+    results = {}
+    regressions = []
+    for name in CASES:
+        if args.prefixes and not any(name.startswith(prefix) for prefix in args.prefixes):
+            continue
+
+        result = results[name] = _measure(name)
+        line = '{:<28} {:>12.3f} us (min {:.3f} us)'.format(name, result['median_us'], result['min_us'])
+        if name in baseline:
+            ratio = result['median_us'] / baseline[name]['median_us']
+            line += '  {:+.1f}% vs baseline'.format((ratio - 1) * 100)
+            if ratio > 1 + args.tolerance:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save:
+        # Keep the cases that were not executed this time
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(report, results=dict(baseline, **results)), f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline stored on {}'.format(args.baseline))
+        return 0
+
+    if regressions:
+        print('Regressions (> {:.0f}%): {}'.format(args.tolerance * 100, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,16 @@
+import importlib
 import sys
-from . import network
-from . import functions
-from . import shell
+
+# Submodules are imported on first access (``halborn_ctf.network``...) so the CLI does not pay for requests, mitmproxy
+# or flask when they are not used
+_SUBMODULES = ('network', 'functions', 'shell', 'build', 'metrics')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
 
 if sys.version_info[:2] >= (3, 8):
     # TODO: Import directly (no need for conditional) when `python_requires = >= 3.8`
@@ -0,0 +1,519 @@
+"""Internal helpers used to build, cache and stream the challenge ``/files`` archive.
+
+The archive is built once into a temporary file and reused for every download. It is only rebuilt
+when the content of any of the listed files (or :obj:`halborn_ctf.templates.StrFile`) changes.
+
+When the archive can not be cached, it is streamed with :class:`_ZipStream`. Files on disk are
+compressed only once and kept on a temporary file so each stream only has to compress the
+in-memory files.
+"""
+import glob
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+_logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP_FILECOUNT_LIMIT = 0xFFFF
+# Value of the 32-bit fields whose actual value is on the ZIP64 extra field or end record
+_ZIP64_MARKER = 0xFFFFFFFF
+
+# Extensions of formats that are already compressed and will be stored as is
+_STORED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.txz', '.zst', '.7z', '.rar', '.jar', '.whl',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.webm', '.woff', '.woff2', '.pdf',
+}
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_DATA_DESCRIPTOR = struct.Struct('<IIII')
+_DATA_DESCRIPTOR64 = struct.Struct('<IIQQ')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+_END_LOCATOR64 = struct.Struct('<IIQI')
+
+
+def _resolve_entries(files):
+    """Expands the list returned by the challenge ``files`` function.
+
+    Args:
+        files (list): List of glob patterns and/or ``StrFile`` objects.
+
+    Returns:
+        list[tuple]: A list of ``(arcname, source)`` where ``source`` is either a path on disk
+        or the ``StrFile`` object itself.
+    """
+    entries = []
+    for _added in files:
+        if isinstance(_added, str):
+            for result in glob.glob(_added):
+                if os.path.isfile(result):
+                    entries.append((result, result))
+        else:
+            entries.append((_added.filepath, _added))
+    return entries
+
+
+def _dos_datetime(timestamp):
+    _time = time.localtime(timestamp)
+    if _time.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    dosdate = (_time.tm_year - 1980) << 9 | _time.tm_mon << 5 | _time.tm_mday
+    dostime = _time.tm_hour << 11 | _time.tm_min << 5 | (_time.tm_sec // 2)
+    return dosdate, dostime
+
+
+def _method_for(path):
+    return _ZIP_STORED if os.path.splitext(path)[1].lower() in _STORED_EXTENSIONS else _ZIP_DEFLATED
+
+
+class _Compressor():
+    """Incremental compressor for one of the supported zip methods keeping track of the CRC and sizes.
+    """
+    def __init__(self, method) -> None:
+        self.method = method
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if method == _ZIP_DEFLATED else None
+
+    def compress(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.file_size += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        self.compress_size += len(data)
+        return data
+
+    def flush(self):
+        if not self._compressor:
+            return b''
+        data = self._compressor.flush()
+        self.compress_size += len(data)
+        return data
+
+
+class _ZipInfo():
+    """Details of an entry already written needed for the central directory.
+    """
+    def __init__(self, arcname, method, mtime, external_attr) -> None:
+        self.arcname = arcname.encode('utf-8')
+        self.flags = 0x800 if not arcname.isascii() else 0
+        self.method = method
+        self.dosdate, self.dostime = _dos_datetime(mtime)
+        self.external_attr = external_attr
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+        self.offset = 0
+
+
+class _ZipStream():
+    """Zip writer that produces the archive as a sequence of chunks.
+
+    Nothing is buffered besides the list of entries for the central directory, so the archive can
+    be sent while it is being generated. Each ``add_*`` method is a generator producing the bytes
+    of the entry and :obj:`close` produces the central directory.
+
+    Entries larger than 4GB or archives with too many entries use the ``ZIP64`` extensions.
+    """
+    def __init__(self) -> None:
+        self._offset = 0
+        self._infos = []
+
+    def _emit(self, data):
+        self._offset += len(data)
+        return data
+
+    def _local_header(self, info, zip64):
+        extra = b''
+        crc, compress_size, file_size = info.crc, info.compress_size, info.file_size
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+            compress_size = file_size = _ZIP64_MARKER
+        elif info.flags & 0x08:
+            crc = compress_size = file_size = 0
+
+        return _LOCAL_HEADER.pack(
+            0x04034b50, 45 if zip64 else 20, info.flags, info.method, info.dostime, info.dosdate,
+            crc, compress_size, file_size, len(info.arcname), len(extra)
+        ) + info.arcname + extra
+
+    def add_compressed(self, arcname, method, crc, compress_size, file_size, chunks, *, mtime=None, mode=0o644):
+        """Adds an entry from data that is already compressed with ``method``.
+
+        Args:
+            arcname (str): Name of the file inside the archive
+            method (int): The zip compression method used (stored or deflated)
+            crc (int): The CRC-32 of the uncompressed data
+            compress_size (int): The size of the compressed data
+            file_size (int): The size of the uncompressed data
+            chunks (Iterable[bytes]): The compressed data
+            mtime (float, optional): Modification time of the file. Defaults to now.
+            mode (int, optional): Unix permissions of the file. Defaults to 0o644.
+        """
+        info = _ZipInfo(arcname, method, time.time() if mtime is None else mtime, (0o100000 | mode) << 16)
+        info.crc, info.compress_size, info.file_size = crc, compress_size, file_size
+        info.offset = self._offset
+        self._infos.append(info)
+
+        zip64 = file_size >= _ZIP64_LIMIT or compress_size >= _ZIP64_LIMIT
+        yield self._emit(self._local_header(info, zip64))
+        for chunk in chunks:
+            yield self._emit(chunk)
+
+    def add_bytes(self, arcname, data, *, method=_ZIP_DEFLATED, mtime=None, mode=0o644):
+        """Adds an entry from in-memory data.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        compressor = _Compressor(method)
+        compressed = compressor.compress(data) + compressor.flush()
+        yield from self.add_compressed(arcname, method, compressor.crc, compressor.compress_size,
+                                       compressor.file_size, [compressed], mtime=mtime, mode=mode)
+
+    def add_stream(self, arcname, chunks, *, method=_ZIP_DEFLATED, mtime=None, mode=0o644, size_hint=0, sink=None):
+        """Adds an entry whose size is unknown, compressing the data as it is produced.
+
+        The sizes and CRC are written on a data descriptor after the data.
+
+        Args:
+            arcname (str): Name of the file inside the archive
+            chunks (Iterable[bytes]): The uncompressed data
+            method (int, optional): The zip compression method. Defaults to deflated.
+            mtime (float, optional): Modification time of the file. Defaults to now.
+            mode (int, optional): Unix permissions of the file. Defaults to 0o644.
+            size_hint (int, optional): Expected size of the data used to decide if ``ZIP64`` is required. Defaults to 0.
+            sink (Callable, optional): Called with every compressed chunk. Defaults to None.
+
+        Returns:
+            _Compressor: As the generator return value, the compressor with the final CRC and sizes.
+        """
+        info = _ZipInfo(arcname, method, time.time() if mtime is None else mtime, (0o100000 | mode) << 16)
+        info.flags |= 0x08
+        info.offset = self._offset
+        self._infos.append(info)
+
+        # Leave some margin as deflate can slightly increase the size of the data
+        zip64 = size_hint >= _ZIP64_LIMIT - (1 << 20)
+        yield self._emit(self._local_header(info, zip64))
+
+        compressor = _Compressor(method)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                if sink:
+                    sink(data)
+                yield self._emit(data)
+        data = compressor.flush()
+        if data:
+            if sink:
+                sink(data)
+            yield self._emit(data)
+
+        info.crc, info.compress_size, info.file_size = compressor.crc, compressor.compress_size, compressor.file_size
+        if zip64:
+            yield self._emit(_DATA_DESCRIPTOR64.pack(0x08074b50, info.crc, info.compress_size, info.file_size))
+        else:
+            if info.compress_size >= _ZIP64_LIMIT or info.file_size >= _ZIP64_LIMIT:
+                raise OverflowError('File "{}" exceeds the ZIP64 limit without size_hint'.format(arcname))
+            yield self._emit(_DATA_DESCRIPTOR.pack(0x08074b50, info.crc, info.compress_size, info.file_size))
+
+        return compressor
+
+    def close(self):
+        """Produces the central directory and the end records.
+        """
+        start = self._offset
+        for info in self._infos:
+            extra = b''
+            file_size, compress_size, offset = info.file_size, info.compress_size, info.offset
+            if file_size >= _ZIP64_LIMIT:
+                extra += struct.pack('<Q', file_size)
+                file_size = _ZIP64_MARKER
+            if compress_size >= _ZIP64_LIMIT:
+                extra += struct.pack('<Q', compress_size)
+                compress_size = _ZIP64_MARKER
+            if offset >= _ZIP64_LIMIT:
+                extra += struct.pack('<Q', offset)
+                offset = _ZIP64_MARKER
+            if extra:
+                extra = struct.pack('<HH', 1, len(extra)) + extra
+            version = 45 if extra else 20
+
+            yield self._emit(_CENTRAL_HEADER.pack(
+                0x02014b50, (3 << 8) | version, version, info.flags, info.method, info.dostime, info.dosdate,
+                info.crc, compress_size, file_size, len(info.arcname), len(extra), 0, 0, 0,
+                info.external_attr, offset
+            ) + info.arcname + extra)
+
+        count = len(self._infos)
+        size = self._offset - start
+        if count >= _ZIP_FILECOUNT_LIMIT or size >= _ZIP64_LIMIT or start >= _ZIP64_LIMIT:
+            end64 = self._offset
+            yield self._emit(_END_RECORD64.pack(0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+            yield self._emit(_END_LOCATOR64.pack(0x07064b50, 0, end64, 1))
+            count = min(count, _ZIP_FILECOUNT_LIMIT)
+            size = min(size, _ZIP64_MARKER)
+            start = min(start, _ZIP64_MARKER)
+
+        yield self._emit(_END_RECORD.pack(0x06054b50, 0, 0, count, count, size, start, 0))
+
+
+class _CompressedFile():
+    """A file from disk compressed once and stored on a temporary file.
+    """
+    def __init__(self, path, stat, compressor, data_path) -> None:
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.mtime = stat.st_mtime
+        self.mode = stat.st_mode & 0o777
+        self.method = compressor.method
+        self.crc = compressor.crc
+        self.compress_size = compressor.compress_size
+        self.file_size = compressor.file_size
+        self.data_path = data_path
+
+    def is_valid(self, stat):
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def remove(self):
+        try:
+            os.unlink(self.data_path)
+        except OSError:
+            pass
+
+
+def _file_chunks(file_):
+    for chunk in iter(lambda: file_.read(_CHUNK_SIZE), b''):
+        yield chunk
+
+
+def _read_chunks(path):
+    with open(path, 'rb') as file_:
+        yield from _file_chunks(file_)
+
+
+class _CompressedFileCache():
+    """Cache of files from disk already compressed for the zip archive.
+
+    A file is compressed the first time it is added to an archive while it is being streamed. Later
+    archives copy the compressed data as is, as long as the file size and modification time did not change.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def add_to(self, stream, arcname, path):
+        """Adds the file on ``path`` to the ``stream``.
+
+        Args:
+            stream (_ZipStream): The zip stream to add the file to.
+            arcname (str): Name of the file inside the archive
+            path (str): Path of the file on disk
+        """
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached and cached.is_valid(stat):
+            try:
+                # Opened before the entry header is produced: a concurrent recompression of the file removes the
+                # compressed data from disk, the open file can still be read
+                data_file = open(cached.data_path, 'rb')
+            except FileNotFoundError:
+                pass
+            else:
+                with data_file:
+                    yield from stream.add_compressed(arcname, cached.method, cached.crc, cached.compress_size,
+                                                     cached.file_size, _file_chunks(data_file), mtime=cached.mtime,
+                                                     mode=cached.mode)
+                return
+
+        fd, data_path = tempfile.mkstemp(prefix='halborn_ctf_')
+        completed = False
+        try:
+            with os.fdopen(fd, 'wb') as data_file:
+                compressor = yield from stream.add_stream(arcname, _read_chunks(path), method=_method_for(path),
+                                                          mtime=stat.st_mtime, mode=stat.st_mode & 0o777,
+                                                          size_hint=stat.st_size, sink=data_file.write)
+            # The file could have been modified while reading it
+            if not os.stat(path).st_mtime_ns == stat.st_mtime_ns:
+                return
+
+            compressed = _CompressedFile(path, stat, compressor, data_path)
+            with self._lock:
+                previous = self._files.get(path)
+                self._files[path] = compressed
+            if previous:
+                previous.remove()
+            completed = True
+        finally:
+            if not completed:
+                os.unlink(data_path)
+
+    def clear(self):
+        with self._lock:
+            for compressed in self._files.values():
+                compressed.remove()
+            self._files = {}
+
+
+def _archive_chunks(entries, cache):
+    """Generates the zip archive with all the ``entries``.
+    """
+    stream = _ZipStream()
+    for arcname, source in entries:
+        if isinstance(source, str):
+            try:
+                yield from cache.add_to(stream, arcname, source)
+            except FileNotFoundError:
+                _logger.warning('File "{}" removed while building the archive'.format(source))
+        else:
+            yield from stream.add_bytes(arcname, source.content)
+    yield from stream.close()
+
+
+def _fingerprint(entries):
+    """Cheap content fingerprint of the archive entries.
+
+    Files on disk are identified by their size and modification time while in memory
+    files are hashed as they have no metadata.
+    """
+    digest = hashlib.sha256()
+    for arcname, source in entries:
+        digest.update(arcname.encode('utf-8'))
+        if isinstance(source, str):
+            try:
+                stat = os.stat(source)
+            except OSError:
+                continue
+            digest.update('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+        else:
+            content = source.content
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+class _CachedArchive():
+    """A built zip archive stored on a temporary file.
+
+    Attributes:
+        path (str): Location of the archive on disk.
+        etag (str): SHA-256 hash of the archive content.
+        size (int): Size of the archive in bytes.
+        mtime (float): Time when the archive was built.
+    """
+    def __init__(self, path, etag, size) -> None:
+        self.path = path
+        self.etag = etag
+        self.size = size
+        self.mtime = time.time()
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class _FilesArchive():
+    """Lazily built and cached zip archive of the challenge files. The archive can also be streamed
+    (:obj:`stream`) when its content changes on each request.
+
+    Args:
+        files (Callable): Function returning the list of files to add to the archive.
+        check_interval (float, optional): Minimum amount of seconds between checks for changes on
+            the listed files. Defaults to 2.0.
+    """
+    def __init__(self, files, check_interval=2.0) -> None:
+        self._files = files
+        self._check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._compressed = _CompressedFileCache()
+        self._archive = None
+        self._retired = None
+        self._fingerprint = None
+        self._checked_at = 0
+
+    def _build(self, entries):
+        fd, path = tempfile.mkstemp(prefix='halborn_ctf_', suffix='.zip')
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as file_:
+            for chunk in _archive_chunks(entries, self._compressed):
+                digest.update(chunk)
+                file_.write(chunk)
+                size += len(chunk)
+
+        return _CachedArchive(path, digest.hexdigest(), size)
+
+    def get(self, force=False):
+        """Returns the cached archive, rebuilding it if any of the files changed.
+
+        Args:
+            force (bool, optional): Check for changes even if :obj:`check_interval` did not elapse. Defaults to False.
+
+        Returns:
+            _CachedArchive: The archive ready to be served.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._archive and now - self._checked_at < self._check_interval:
+                return self._archive
+
+            entries = _resolve_entries(self._files())
+            fingerprint = _fingerprint(entries)
+            self._checked_at = now
+
+            if self._archive and fingerprint == self._fingerprint:
+                return self._archive
+
+            start = time.perf_counter()
+            archive = self._build(entries)
+            _logger.info('Built files archive ({} entries, {} bytes) in {:.3f}s'.format(
+                len(entries), archive.size, time.perf_counter() - start))
+
+            # The previous archive is kept for one more generation so downloads in progress
+            # that already resolved its path can still open it
+            if self._retired:
+                self._retired.remove()
+            self._retired = self._archive
+            self._archive = archive
+            self._fingerprint = fingerprint
+
+            return self._archive
+
+    def stream(self):
+        """Generates the archive without caching it. Files on disk are only compressed the first time.
+
+        Returns:
+            Iterator[bytes]: The chunks of the archive.
+        """
+        return _archive_chunks(_resolve_entries(self._files()), self._compressed)
+
+    def close(self):
+        """Removes any archive stored on disk.
+        """
+        self._compressed.clear()
+        with self._lock:
+            for archive in (self._archive, self._retired):
+                if archive:
+                    archive.remove()
+            self._archive = None
+            self._retired = None
+            self._fingerprint = None
@@ -0,0 +1,166 @@
+"""Internal helper watching a chain for new blocks, logs and storage changes.
+
+A single thread uses ``eth_newBlockFilter``/``eth_newFilter`` and ``eth_getFilterChanges`` so each poll
+is a cheap call returning only what changed since the previous one. Solve conditions are only evaluated
+when something relevant to them changed.
+"""
+import logging
+import threading
+
+import requests
+
+from .network import json_rpc, JSONRPCError
+
+_logger = logging.getLogger(__name__)
+
+
+class _Subscription():
+    def __init__(self, condition, logs=None, storage=None, msg=None) -> None:
+        self.condition = condition
+        self.logs = logs
+        self.storage = list(storage or [])
+        self.msg = msg
+        self.filter_id = None
+        self.values = {}
+
+
+class _ChainWatcher():
+    """Evaluates solve conditions when the chain changes.
+
+    Args:
+        rpc_url (str): The JSON-RPC endpoint of the chain.
+        on_solved (Callable): Called with the solved message (or ``None``) once any condition is met.
+        interval (float, optional): Seconds between checks for changes. Defaults to 0.5.
+    """
+    def __init__(self, rpc_url, on_solved, interval=0.5) -> None:
+        self._rpc_url = rpc_url
+        self._on_solved = on_solved
+        self._interval = interval
+
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._block_filter = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_error = None
+
+    def _rpc(self, method, params=None):
+        return json_rpc(self._rpc_url, method, params, session=self._session)
+
+    def _create_filter(self, subscription):
+        """Creates the log filter of ``subscription`` so logs emitted from now on are not missed. If the node is not
+        reachable it is created on the next poll.
+        """
+        if subscription.logs is None:
+            return
+        try:
+            subscription.filter_id = self._rpc('eth_newFilter', [dict({'fromBlock': 'latest'}, **subscription.logs)])
+        except (JSONRPCError, requests.RequestException) as e:
+            self._log_error(e)
+
+    def add(self, subscription):
+        self._create_filter(subscription)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='chain-watcher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def reset(self):
+        """Evaluates the conditions again from the current chain (once reverted), restarting the thread if a condition
+        was already met.
+        """
+        with self._lock:
+            thread = self._thread
+        if self._stopped.is_set() and thread is not None:
+            thread.join()
+
+        self._reset_filters()
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            self._create_filter(subscription)
+
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.values = {}
+            if self._stopped.is_set() and self._subscriptions:
+                self._stopped = threading.Event()
+                self._thread = threading.Thread(target=self._loop, name='chain-watcher', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                self._poll()
+                self._last_error = None
+            except JSONRPCError as e:
+                # Filters expire or disappear if the node restarts/reverts, recreate them
+                self._reset_filters()
+                self._log_error(e)
+            except requests.RequestException as e:
+                self._log_error(e)
+            self._stopped.wait(self._interval)
+
+    def _log_error(self, e):
+        # Only log once while the error persists (for example the node is not running yet)
+        if str(e) != self._last_error:
+            self._last_error = str(e)
+            _logger.warning('Chain watcher error: {}'.format(e))
+
+    def _reset_filters(self):
+        self._block_filter = None
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.filter_id = None
+
+    def _poll(self):
+        if self._block_filter is None:
+            self._block_filter = self._rpc('eth_newBlockFilter')
+            # Conditions are evaluated once against the current block when (re)starting
+            blocks = [self._rpc('eth_getBlockByNumber', ['latest', False])['hash']]
+        else:
+            blocks = self._rpc('eth_getFilterChanges', [self._block_filter])
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            if self._stopped.is_set():
+                return
+
+            if subscription.logs is not None:
+                if subscription.filter_id is None:
+                    subscription.filter_id = self._rpc('eth_newFilter', [dict({'fromBlock': 'latest'}, **subscription.logs)])
+                    continue
+                events = self._rpc('eth_getFilterChanges', [subscription.filter_id])
+                if events:
+                    self._evaluate(subscription, events)
+            elif blocks:
+                if subscription.storage:
+                    changed = False
+                    for address, slot in subscription.storage:
+                        value = self._rpc('eth_getStorageAt', [address, hex(slot) if isinstance(slot, int) else slot, 'latest'])
+                        if subscription.values.get((address, slot)) != value:
+                            subscription.values[(address, slot)] = value
+                            changed = True
+                    if changed:
+                        # The condition gets every watched slot, not only the changed ones
+                        self._evaluate(subscription, dict(subscription.values))
+                else:
+                    self._evaluate(subscription, blocks)
+
+    def _evaluate(self, subscription, event):
+        try:
+            result = subscription.condition(event)
+        except Exception as e:
+            _logger.exception(e)
+            return
+
+        if result:
+            self.stop()
+            self._on_solved(result if isinstance(result, str) else subscription.msg)
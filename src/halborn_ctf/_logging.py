@@ -0,0 +1,128 @@
+"""Internal logging pipeline used by the CLI.
+
+Records are put on a queue by the thread logging them and formatted and written by a single background
+thread, so slow terminals or log collectors do not slow down the request handlers or the output pumps.
+Access logs and child process output can be sampled or rate limited before being queued.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+
+ACCESS_LOGGER = 'halborn_ctf.access'
+OUTPUT_LOGGER = 'halborn_ctf.shell.output'
+
+_listener = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues the records with their message and exception already rendered (they can reference objects that
+    change before the background thread writes them), leaving the final format to the background thread.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a single JSON line.
+    """
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random ``rate`` fraction of the records. Warnings and errors are always kept.
+
+    Args:
+        rate (float): Fraction (``0`` to ``1``) of the records to keep.
+    """
+    def __init__(self, rate) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """Keeps up to ``rate`` records per second (with bursts of up to ``rate`` records). The amount of dropped records is
+    added to the next record kept.
+
+    Args:
+        rate (float): Records per second to keep.
+    """
+    def __init__(self, rate) -> None:
+        super().__init__()
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._dropped = 0
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens < 1:
+                self._dropped += 1
+                return False
+
+            self._tokens -= 1
+            dropped, self._dropped = self._dropped, 0
+
+        if dropped:
+            record.msg = '({} lines suppressed) {}'.format(dropped, record.msg)
+        return True
+
+
+def setup(level, formatter, access_sample=1.0, output_rate=None):
+    """Configures the root logger to write through a queue to ``stderr`` on a background thread.
+
+    Args:
+        level (int): Minimum level of the records.
+        formatter (logging.Formatter): Formatter of the records.
+        access_sample (float, optional): Fraction of the access logs to keep. Defaults to 1.0.
+        output_rate (float, optional): Maximum lines per second of child process output to log. Defaults to None (no limit).
+    """
+    global _listener
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.setFormatter(formatter)
+    logging.basicConfig(level=level, handlers=[queue_handler], force=True)
+
+    if access_sample < 1.0:
+        logging.getLogger(ACCESS_LOGGER).addFilter(SamplingFilter(access_sample))
+    if output_rate:
+        logging.getLogger(OUTPUT_LOGGER).addFilter(RateLimitFilter(output_rate))
@@ -0,0 +1,86 @@
+"""Internal helpers of the token guarded ``/_debug`` routes of the challenge server (enabled with the ``DEBUG_TOKEN``
+environment variable).
+"""
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict
+
+_MAX_PROFILES = 20
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def sample(duration, interval=0.005):
+    """Samples the stacks of all the threads (except the calling one) every ``interval`` seconds during ``duration`` seconds.
+
+    Returns:
+        str: The profile in the collapsed stacks format (``thread;frame;frame count`` per line) that can be rendered
+        with ``flamegraph.pl`` or speedscope.
+    """
+    me = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_name(frame))
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            stacks[';'.join(reversed(frames))] += 1
+        time.sleep(interval)
+
+    return ''.join('{} {}\n'.format(stack, count) for stack, count in stacks.most_common())
+
+
+def thread_dump():
+    """Returns the current stack of every thread.
+    """
+    threads = {thread.ident: thread for thread in threading.enumerate()}
+    output = []
+    for ident, frame in sys._current_frames().items():
+        thread = threads.get(ident)
+        output.append('Thread {} ({}{})\n'.format(
+            thread.name if thread else ident, ident, ', daemon' if thread and thread.daemon else ''))
+        output.append(''.join(traceback.format_stack(frame)))
+        output.append('\n')
+    return ''.join(output)
+
+
+class _RequestProfiles():
+    """Stores the ``cProfile`` results of the last profiled requests.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._profiles = OrderedDict()
+
+    def add(self, description, profile):
+        stream = io.StringIO()
+        stream.write('{}\n\n'.format(description))
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(50)
+
+        with self._lock:
+            profile_id = next(self._ids)
+            self._profiles[profile_id] = stream.getvalue()
+            while len(self._profiles) > _MAX_PROFILES:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
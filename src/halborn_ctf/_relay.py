@@ -0,0 +1,179 @@
+"""Internal helper relaying raw TCP connections to an upstream service (see
+:obj:`halborn_ctf.templates.GenericChallenge.TCP_MAPPING`).
+
+All relays share a single thread running an ``asyncio`` event loop. Bytes are forwarded from one transport to the
+other as soon as they are received, without any parsing, and the reading side is paused while the writing side
+has too much data buffered.
+"""
+import asyncio
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='tcp-relay', daemon=True).start()
+        return _loop
+
+
+class _Pipe(asyncio.Protocol):
+    """One side of a relayed connection. Everything received is written to the ``peer`` side.
+    """
+    def __init__(self, relay, direction) -> None:
+        self._relay = relay
+        self._direction = direction
+        self.transport = None
+        self.peer = None
+        self.eof = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._relay._count(self._direction, len(data))
+        self.peer.transport.write(data)
+
+    def eof_received(self):
+        self.eof = True
+        if self.peer.eof:
+            self.peer.transport.close()
+            return False
+        # Half close, the other side can still send data
+        if self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+        return True
+
+    def connection_lost(self, exc):
+        if self.peer and self.peer.transport:
+            self.peer.transport.close()
+
+    # Flow control: stop reading from the peer while this side can not keep up
+    def pause_writing(self):
+        if self.peer:
+            self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.peer:
+            self.peer.transport.resume_reading()
+
+
+class _ClientPipe(_Pipe):
+    def __init__(self, relay, direction) -> None:
+        super().__init__(relay, direction)
+        self._accepted = False
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+
+        if self._relay.active >= self._relay.max_connections:
+            self._relay.rejected += 1
+            transport.abort()
+            return
+
+        self._accepted = True
+        self._relay.active += 1
+        self._relay.connections += 1
+        # Nothing is read from the client until the upstream connection is ready
+        transport.pause_reading()
+        asyncio.ensure_future(self._connect_upstream())
+
+    async def _connect_upstream(self):
+        upstream = _Pipe(self._relay, 'out')
+        upstream.peer = self
+        try:
+            await self._relay._connect(lambda: upstream)
+        except OSError as e:
+            _logger.warning('TCP mapping {}: could not connect with the upstream: {}'.format(self._relay.listen_port, e))
+            self.transport.abort()
+            return
+
+        if self.transport.is_closing():
+            upstream.transport.close()
+            return
+
+        self.peer = upstream
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        if self._accepted:
+            self._relay.active -= 1
+        super().connection_lost(exc)
+
+
+class _TCPRelay():
+    """Relays every connection accepted on ``listen_port`` to the upstream ``host:port`` (or Unix domain ``socket``).
+
+    Args:
+        listen_port (int): Port to accept connections on.
+        port (int, optional): Upstream port. Defaults to None.
+        host (str, optional): Upstream host. Defaults to '127.0.0.1'.
+        socket (str, optional): Upstream Unix domain socket used instead of ``host`` and ``port``. Defaults to None.
+        max_connections (int, optional): Maximum amount of connections relayed at the same time. Defaults to 100.
+        listen_host (str, optional): Interface to listen on. Defaults to '0.0.0.0'.
+    """
+    def __init__(self, listen_port, port=None, host='127.0.0.1', socket=None, max_connections=100, listen_host='0.0.0.0') -> None:
+        self.listen_port = listen_port
+        self.port = port
+        self.host = host
+        self.socket = socket
+        self.max_connections = max_connections
+        self.listen_host = listen_host
+
+        self._server = None
+        self.active = 0
+        self.connections = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _count(self, direction, amount):
+        if direction == 'in':
+            self.bytes_in += amount
+        else:
+            self.bytes_out += amount
+
+    def _connect(self, protocol_factory):
+        loop = asyncio.get_running_loop()
+        if self.socket:
+            return loop.create_unix_connection(protocol_factory, self.socket)
+        return loop.create_connection(protocol_factory, self.host, self.port)
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: _ClientPipe(self, 'in'), self.listen_host, self.listen_port, reuse_address=True)
+
+    def start(self):
+        """Starts listening. It returns once the port accepts connections.
+
+        Raises:
+            OSError: If the port can not be bound.
+        """
+        asyncio.run_coroutine_threadsafe(self._start(), _get_loop()).result()
+        _logger.info('TCP mapping {} -> {}'.format(self.listen_port, self.socket or '{}:{}'.format(self.host, self.port)))
+
+    def stop(self):
+        """Stops accepting new connections.
+        """
+        if self._server:
+            _get_loop().call_soon_threadsafe(self._server.close)
+
+    @property
+    def stats(self):
+        """(dict): ``active``, ``connections`` (total accepted), ``rejected`` (over ``max_connections``), ``bytes_in``
+        (client to upstream) and ``bytes_out`` (upstream to client).
+        """
+        return {
+            'active': self.active,
+            'connections': self.connections,
+            'rejected': self.rejected,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
@@ -0,0 +1,159 @@
+"""Internal hot reload of the challenge used by ``halborn_ctf run --local --watch``.
+
+The challenge file is polled for changes. When only the functions executed on requests changed (``solver``, ``details``,
+``files`` and the :obj:`~halborn_ctf.templates.GenericChallenge.register_path` handlers), the class of the running
+challenge is replaced and its routes registered again. Any other change (``run``, class attributes, module code...)
+deploys the challenge again, keeping the :class:`~halborn_ctf.services.Service` objects declared with the same
+configuration running.
+"""
+import ast
+import importlib
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from . import shell
+from .services import Service, terminate
+
+_logger = logging.getLogger(__name__)
+
+_HOT_METHODS = ('solver', 'details', 'files')
+
+
+def _fingerprint(path, class_name, hot):
+    """Dump of the challenge file AST without the ``hot`` methods of the challenge class (nor line numbers).
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef) and node.name == class_name:
+            node.body = [item for item in node.body
+                         if not (isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name in hot)]
+    return ast.dump(tree)
+
+
+class _Reloader():
+    """Deploys the challenge and deploys it again (or swaps its class) when the challenge file changes.
+
+    Args:
+        path (str): Path of the challenge file.
+        class_name (str): Name of the challenge class.
+        interval (float, optional): Seconds between checks for changes. Defaults to 0.5.
+    """
+    def __init__(self, path, class_name, interval=0.5) -> None:
+        self.path = os.path.abspath(path)
+        self.class_name = class_name
+        self.interval = interval
+        self.module_name = os.path.splitext(os.path.basename(self.path))[0]
+
+        self.challenge = None
+        self.procs = []
+        self._mtime = None
+        self._fingerprint = None
+
+    def _hot(self):
+        names = {handler.__name__ for _, handler, _ in self.challenge._custom_paths} if self.challenge else set()
+        return set(_HOT_METHODS) | names
+
+    def _deploy(self, challenge):
+        """Deploys ``challenge`` tracking the processes it starts. Errors are logged, the reloader keeps waiting for changes.
+        """
+        procs = []
+        try:
+            with shell._track(procs):
+                challenge._deploy()
+        except Exception:
+            _logger.exception('Challenge failed to deploy, waiting for changes')
+        finally:
+            self.procs.extend(procs)
+
+    def _service_procs(self):
+        return {service.proc for service in self.challenge.services._services.values() if isinstance(service, Service)}
+
+    def _redeploy(self, cls):
+        old = self.challenge
+        supervisor = old.services
+
+        challenge = cls()
+        # The services and the served application are kept, the new routes are served once ready
+        challenge.services = supervisor
+        challenge._app_switch = old._app_switch
+
+        # Everything but the services is stopped before deploying again as it may use the same ports. This includes the
+        # periodic methods of the old challenge, which would otherwise keep running next to the ones of the new one
+        old._stop(services=False)
+        services = self._service_procs()
+        terminate([proc for proc in self.procs if proc not in services], group=True)
+        self.procs = [proc for proc in self.procs if proc in services]
+
+        supervisor._begin_reload()
+        try:
+            self.challenge = challenge
+            self._deploy(challenge)
+        finally:
+            supervisor._end_reload()
+
+        if not challenge._ready:
+            challenge._app_switch.app = challenge._boot_app()
+
+    def _swap(self, cls):
+        self.challenge.__class__ = cls
+        self.challenge._rebuild_app()
+
+    def _reload(self):
+        try:
+            fingerprint = _fingerprint(self.path, self.class_name, self._hot())
+            module = importlib.reload(sys.modules[self.module_name])
+            cls = getattr(module, self.class_name)
+        except Exception:
+            _logger.exception('Could not reload "{}"'.format(self.path))
+            return
+
+        start = time.monotonic()
+        if fingerprint == self._fingerprint and self.challenge._ready:
+            self._swap(cls)
+            _logger.warning('Reloaded the challenge routes in {:.2f}s'.format(time.monotonic() - start))
+        else:
+            self._redeploy(cls)
+            _logger.warning('Deployed the challenge again in {:.2f}s'.format(time.monotonic() - start))
+        # The handlers registered by the new deployment are hot too
+        self._fingerprint = _fingerprint(self.path, self.class_name, self._hot())
+
+    def run(self, cls):
+        """Deploys ``cls`` and serves it, reloading it on changes until interrupted.
+        """
+        from .templates import _CleanChildProcesses
+
+        if threading.current_thread() is threading.main_thread():
+            # The tracked processes run on their own sessions, exit through the cleanup on SIGTERM too
+            signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+        self.challenge = cls()
+        self._mtime = os.stat(self.path).st_mtime
+
+        with _CleanChildProcesses(self.challenge.services):
+            try:
+                self.challenge._server()
+                self._deploy(self.challenge)
+                # The fingerprint depends on the registered paths
+                self._fingerprint = _fingerprint(self.path, self.class_name, self._hot())
+                _logger.warning('Watching "{}" for changes'.format(self.path))
+
+                while True:
+                    time.sleep(self.interval)
+                    try:
+                        mtime = os.stat(self.path).st_mtime
+                    except FileNotFoundError:
+                        # Editors may replace the file while saving
+                        continue
+                    if mtime != self._mtime:
+                        self._mtime = mtime
+                        self._reload()
+            finally:
+                # Processes tracked by the reloader are on their own sessions
+                self.challenge.services.stop()
+                terminate(self.procs, group=True)
@@ -0,0 +1,164 @@
+"""Internal helper running the challenge ``solver`` function on a background thread.
+"""
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+
+_logger = logging.getLogger(__name__)
+
+# Process wide cap of solver runs executing at the same time
+_concurrency = threading.BoundedSemaphore(int(os.environ.get('SOLVER_CONCURRENCY', 4)))
+
+_RUNS = metrics.counter('solver_runs_total', 'Amount of solver executions')
+_ERRORS = metrics.counter('solver_errors_total', 'Amount of solver executions raising an exception')
+_TIMEOUTS = metrics.counter('solver_timeouts_total', 'Amount of solver executions exceeding their deadline')
+_DURATION = metrics.histogram('solver_duration_seconds', 'Duration of the solver executions')
+
+
+class _SolverWorker():
+    """Runs a ``solver`` function on a single background thread.
+
+    Refresh requests made while the solver is already running (or queued) are merged into the
+    running one, and a new run is not started until ``min_interval`` seconds passed since the last one
+    finished.
+
+    Each run has a deadline of ``timeout`` seconds. Once it passes, the run is marked as cancelled
+    (see :obj:`cancelled`) and reported as timed out. A new run will not start until the cancelled
+    one returns. Stopping the worker cancels the current run too.
+
+    Args:
+        solver (Callable): The function to execute.
+        min_interval (float, optional): Minimum amount of seconds between solver runs. Defaults to 2.0.
+        timeout (float, optional): Deadline in seconds for each run. Defaults to 10.0.
+    """
+    def __init__(self, solver, min_interval=2.0, timeout=10.0) -> None:
+        self._solver = solver
+        self._min_interval = min_interval
+        self._timeout = timeout
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._requested = False
+        self._running = False
+        self._stopped = False
+        self._finished_at = None
+        self._cancel = threading.Event()
+
+        self.checked_at = None
+        """ (float): Unix time of the last finished solver run.
+        """
+        self.timed_out = False
+        """ (bool): If the last solver run exceeded its deadline.
+        """
+        self.runs = 0
+        """ (int): The amount of times the solver was executed.
+        """
+
+    @property
+    def pending(self):
+        """(bool): If a solver run is queued or running.
+        """
+        with self._condition:
+            return self._requested or self._running
+
+    @property
+    def cancelled(self):
+        """(bool): If the current run exceeded its deadline (or the worker was stopped) and should return as soon as possible.
+        """
+        return self._cancel.is_set()
+
+    def refresh(self):
+        """Requests a solver run unless one is already pending or the last one finished less than
+        ``min_interval`` seconds ago.
+
+        Returns:
+            bool: If a new run was requested.
+        """
+        with self._condition:
+            if self._requested or self._running or self._stopped:
+                return False
+
+            if self._finished_at is not None and time.monotonic() - self._finished_at < self._min_interval:
+                return False
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='solver', daemon=True)
+                self._thread.start()
+
+            self._requested = True
+            self._condition.notify_all()
+            return True
+
+    def wait(self, timeout):
+        """Waits for the pending run (if any) to finish.
+
+        Args:
+            timeout (float): Maximum amount of seconds to wait.
+
+        Returns:
+            bool: If there is no pending run.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not (self._requested or self._running), timeout)
+
+    def stop(self):
+        """Cancels the current run (if any) and stops the background thread once it returns. Refresh requests are
+        ignored afterwards.
+        """
+        with self._condition:
+            self._stopped = True
+            self._requested = False
+            self._cancel.set()
+            self._condition.notify_all()
+
+    def _execute(self, done):
+        start = time.perf_counter()
+        try:
+            self._solver()
+        except Exception as e:
+            _ERRORS.inc()
+            _logger.exception(e)
+        finally:
+            _DURATION.observe(time.perf_counter() - start)
+            done.set()
+
+    def _finish(self, timed_out):
+        with self._condition:
+            self._running = False
+            self._finished_at = time.monotonic()
+            self.checked_at = time.time()
+            self.timed_out = timed_out
+            self.runs += 1
+            self._condition.notify_all()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._requested and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                self._requested = False
+                self._running = True
+                # Cleared with the condition held so a concurrent stop() is not undone
+                self._cancel.clear()
+
+            with _concurrency:
+                _RUNS.inc()
+                done = threading.Event()
+                threading.Thread(target=self._execute, args=(done,), name='solver-run', daemon=True).start()
+
+                if done.wait(self._timeout):
+                    self._finish(timed_out=False)
+                    continue
+
+                _TIMEOUTS.inc()
+                _logger.warning('Solver exceeded its deadline of {}s, cancelling it'.format(self._timeout))
+                self._cancel.set()
+                self._finish(timed_out=True)
+
+                # The cancellation is cooperative, keep the slot until the run actually returns
+                done.wait()
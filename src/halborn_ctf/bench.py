@@ -0,0 +1,290 @@
+"""Load testing helpers used by ``halborn_ctf bench`` to measure how many players a challenge can serve.
+
+The challenge is started locally on a free port and each of its routes (``/info``, ``/solved``, ``/files`` and the
+:obj:`halborn_ctf.templates.GenericChallenge.PATH_MAPPING` paths) is driven with a fixed amount of concurrent
+clients. A stand-in JSON-RPC server (:class:`StubChain`) plays the chain so no node is required.
+
+Example:
+    Benchmarking the ``challenge.py`` on the current folder with 32 concurrent clients for 10 seconds per route::
+
+        halborn_ctf bench -c Challenge --concurrency 32 --duration 10 --output bench.json
+"""
+import itertools
+import json
+import logging
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'StubChain',
+    'percentile',
+    'run_load',
+    'summarize',
+    'targets',
+]
+
+_ZERO_WORD = '0x' + '0' * 64
+
+
+class _StubChainHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid waiting for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._send({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': 'Parse error'}})
+
+        if isinstance(payload, list):
+            return self._send([self.server.chain._handle(call) for call in payload])
+        return self._send(self.server.chain._handle(payload))
+
+    def _send(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubChain():
+    """Minimal in-process JSON-RPC server answering the common ``eth_*``, ``net_*`` and ``evm_*`` methods with
+    deterministic values. Each ``eth_sendTransaction``/``eth_sendRawTransaction`` mines a new block.
+
+    It is meant for load tests and benchmarks, not to execute transactions.
+
+    Example:
+
+        .. code::
+
+            with StubChain(port=8545) as chain:
+                json_rpc(chain.url, 'eth_chainId') # '0x7a69'
+
+    Args:
+        port (int, optional): Port to listen on. Defaults to 8545.
+        host (str, optional): Interface to listen on. Defaults to '127.0.0.1'.
+        chain_id (int, optional): The chain id returned by ``eth_chainId``. Defaults to 31337.
+    """
+    def __init__(self, port: int = 8545, host: str = '127.0.0.1', chain_id: int = 31337) -> None:
+        self.chain_id = chain_id
+        self.block = 0
+        self.calls = 0
+        """ (int): Amount of calls received.
+        """
+
+        self._lock = threading.Lock()
+        self._filters = {}
+        self._ids = itertools.count(1)
+        self._snapshots = itertools.count(1)
+
+        self._server = ThreadingHTTPServer((host, port), _StubChainHandler)
+        self._server.daemon_threads = True
+        self._server.chain = self
+        self._thread = None
+
+        self.url = 'http://{}:{}'.format(host, self._server.server_address[1])
+        """ (str): The URL of the server.
+        """
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-chain', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _mine(self):
+        self.block += 1
+        for changes in self._filters.values():
+            changes.append('0x{:064x}'.format(self.block))
+
+    def _call(self, method, params):
+        if method == 'eth_chainId':
+            return hex(self.chain_id)
+        if method == 'net_version':
+            return str(self.chain_id)
+        if method == 'eth_blockNumber':
+            return hex(self.block)
+        if method in ('eth_gasPrice', 'eth_maxPriorityFeePerGas'):
+            return hex(10 ** 9)
+        if method in ('eth_getBalance', 'eth_getTransactionCount', 'eth_estimateGas'):
+            return hex(21000) if method == 'eth_estimateGas' else '0x0'
+        if method in ('eth_call', 'eth_getCode'):
+            return '0x'
+        if method == 'eth_getStorageAt':
+            return _ZERO_WORD
+        if method in ('eth_getBlockByNumber', 'eth_getBlockByHash'):
+            return {'number': hex(self.block), 'hash': '0x{:064x}'.format(self.block), 'timestamp': hex(int(time.time())), 'transactions': []}
+        if method in ('eth_sendTransaction', 'eth_sendRawTransaction'):
+            self._mine()
+            return '0x{:064x}'.format(self.block)
+        if method in ('eth_newBlockFilter', 'eth_newFilter'):
+            filter_id = hex(next(self._ids))
+            self._filters[filter_id] = []
+            return filter_id
+        if method == 'eth_getFilterChanges':
+            changes = self._filters.get(params[0] if params else None)
+            if changes is None:
+                raise KeyError('filter not found')
+            # Log filters never receive events on the stub
+            result, changes[:] = list(changes), []
+            return result
+        if method == 'eth_uninstallFilter':
+            return self._filters.pop(params[0] if params else None, None) is not None
+        if method == 'evm_mine':
+            self._mine()
+            return '0x0'
+        if method == 'evm_snapshot':
+            return hex(next(self._snapshots))
+        if method == 'evm_revert':
+            return True
+        raise NotImplementedError(method)
+
+    def _handle(self, call):
+        response = {'jsonrpc': '2.0', 'id': call.get('id')}
+        with self._lock:
+            self.calls += 1
+            try:
+                response['result'] = self._call(call.get('method'), call.get('params') or [])
+            except NotImplementedError as e:
+                response['error'] = {'code': -32601, 'message': 'Method not found: {}'.format(e)}
+            except (KeyError, IndexError, TypeError) as e:
+                response['error'] = {'code': -32602, 'message': 'Invalid params: {}'.format(e)}
+        return response
+
+
+def percentile(values: list, percent: float) -> float:
+    """Returns the ``percent`` (``0`` to ``100``) percentile of the sorted ``values`` (nearest rank).
+    """
+    if not values:
+        return None
+    rank = max(0, math.ceil(percent / 100 * len(values)) - 1)
+    return values[rank]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    """Summary of a load test: ``requests``, ``errors``, ``rps`` and the ``latency`` (``mean``, ``p50``, ``p95``, ``p99``
+    and ``max`` in milliseconds).
+    """
+    latencies = sorted(latencies)
+    total = len(latencies)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': round(total / elapsed, 2) if elapsed else None,
+        'latency': {
+            'mean': ms(sum(latencies) / total) if total else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if total else None,
+        }
+    }
+
+
+def run_load(method: str, url: str, *, concurrency: int = 16, duration: float = 10.0, requests_per_client: int = None, **kwargs) -> dict:
+    """Sends requests to ``url`` from ``concurrency`` clients (each one with its own connection) waiting for each response
+    before sending the next request.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The URL to request.
+        concurrency (int, optional): Amount of concurrent clients. Defaults to 16.
+        duration (float, optional): Seconds to send requests for. Defaults to 10.0.
+        requests_per_client (int, optional): Stop once each client sent this amount of requests (instead of ``duration``). Defaults to None.
+        **kwargs: Extra arguments for :obj:`requests.request` (for example ``json`` or ``headers``).
+
+    Returns:
+        dict: The :obj:`summarize` report. Responses with a status code ``>= 500`` or connection errors count as errors.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def client():
+        local_latencies = []
+        local_errors = 0
+        with requests.Session() as session:
+            for sent in itertools.count():
+                if (requests_per_client is not None and sent >= requests_per_client) or \
+                        (requests_per_client is None and time.perf_counter() >= deadline):
+                    break
+                request_start = time.perf_counter()
+                try:
+                    resp = session.request(method, url, timeout=30, **kwargs)
+                    # Read the full body as a player would
+                    resp.content
+                    if resp.status_code >= 500:
+                        local_errors += 1
+                except requests.RequestException:
+                    local_errors += 1
+                local_latencies.append(time.perf_counter() - request_start)
+
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client, name='bench-{}'.format(i), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def _mapping_target(path, mapping):
+    """Request (method, path, extra arguments) used to benchmark a ``PATH_MAPPING`` entry.
+    """
+    # Fill the flask converters (<id>, <path:path>...) with a fixed value
+    concrete = re.sub(r'<(?:[^:<>]+:)?[^<>]+>', 'bench', path)
+    methods = mapping.get('methods') or ['GET']
+    if 'POST' in methods:
+        # Most of the mappings expose a chain, send a cheap JSON-RPC call
+        return 'POST', concrete, {'json': {'jsonrpc': '2.0', 'id': 1, 'method': 'eth_blockNumber', 'params': []}}
+    return methods[0], concrete, {}
+
+
+def targets(info: dict) -> dict:
+    """Routes to benchmark given the ``/info`` of a challenge.
+
+    Returns:
+        dict: ``name`` to ``(method, path, extra arguments)``.
+    """
+    config = info.get('config', {})
+    result = {'/info': ('GET', '/info', {})}
+    if config.get('HAS_SOLVER'):
+        result['/solved'] = ('GET', '/solved', {})
+    if config.get('HAS_FILES'):
+        result['/files'] = ('GET', '/files', {})
+    for path, mapping in info.get('mapping', {}).items():
+        result['mapping {}'.format(path)] = _mapping_target(path, mapping)
+    return result
@@ -0,0 +1,141 @@
+"""Helpers for the challenge build phase (:obj:`halborn_ctf.templates.GenericChallenge.build`).
+
+Expensive static steps (compiling contracts, installing dependencies, generating data...) can be
+cached across builds by decorating them with :obj:`cached_step`. Each step declares the files it
+depends on (``inputs``) and the files it produces (``outputs``). When the content of the inputs did
+not change since a previous build, the outputs are restored from the cache and the step is skipped.
+
+Example:
+
+    .. code::
+
+        from halborn_ctf.build import cached_step
+
+        class Challenge(Web3Challenge):
+
+            @cached_step(inputs=['src/**', 'foundry.toml'], outputs=['out/**'])
+            def compile(self):
+                shell.run('forge build')
+
+            def build(self):
+                self.compile()
+
+The cache is stored under the ``HALBORN_CTF_BUILD_CACHE`` environment variable directory (defaults to
+``~/.cache/halborn_ctf/build``). The generated ``Dockerfile`` mounts it as a build cache so it is kept
+between ``halborn_ctf build`` executions.
+"""
+import functools
+import glob
+import hashlib
+import inspect
+import logging
+import os
+import tarfile
+import tempfile
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'cached_step'
+]
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _cache_dir():
+    return os.path.expanduser(os.environ.get('HALBORN_CTF_BUILD_CACHE', '~/.cache/halborn_ctf/build'))
+
+
+def _expand(patterns):
+    paths = set()
+    for pattern in patterns:
+        for result in glob.glob(pattern, recursive=True):
+            if os.path.isfile(result):
+                paths.add(os.path.normpath(result))
+    return sorted(paths)
+
+
+def _function_source(function):
+    try:
+        return inspect.getsource(function).encode('utf-8')
+    except (OSError, TypeError):
+        return function.__code__.co_code
+
+
+def _step_hash(function, inputs, outputs, key):
+    digest = hashlib.sha256()
+    digest.update(function.__qualname__.encode('utf-8'))
+    digest.update(_function_source(function))
+    digest.update(repr((sorted(outputs), key)).encode('utf-8'))
+    for path in _expand(inputs):
+        digest.update(path.encode('utf-8'))
+        with open(path, 'rb') as file_:
+            for chunk in iter(lambda: file_.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _restore(archive_path):
+    with tarfile.open(archive_path, 'r') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall('.', filter='data')
+        else:
+            tar.extractall('.')
+
+
+def _store(archive_path, outputs):
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(archive_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file_:
+            with tarfile.open(fileobj=file_, mode='w') as tar:
+                for path in outputs:
+                    tar.add(path)
+        # Atomic so concurrent builds never see a partial archive
+        os.replace(tmp_path, archive_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def cached_step(*, inputs: list = [], outputs: list = [], key: str = None):
+    """Caches the outputs of a build step and skips its execution if none of its inputs changed.
+
+    The cache key is computed from the step source code, the content of all the files matching ``inputs``,
+    the ``outputs`` patterns and the optional ``key``.
+
+    Warning:
+        Only the files matching ``outputs`` are restored. Any other side effect of the step (such as setting
+        the challenge ``state``) will not happen when the step is cached.
+
+    Args:
+        inputs (list, optional): Glob patterns (recursive ``**`` allowed) of the files the step depends on. Defaults to [].
+        outputs (list, optional): Glob patterns (recursive ``**`` allowed) of the files the step produces. Defaults to [].
+        key (str, optional): Any extra value to add to the cache key (for example a tool version). Defaults to None.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            name = function.__qualname__
+            step_hash = _step_hash(function, inputs, outputs, key)
+            archive_path = os.path.join(_cache_dir(), step_hash + '.tar')
+
+            if os.path.exists(archive_path):
+                _logger.warning('Build step "{}" cached ({}), restoring outputs'.format(name, step_hash[:12]))
+                _restore(archive_path)
+                return None
+
+            _logger.warning('Running build step "{}" ({})'.format(name, step_hash[:12]))
+            result = function(*args, **kwargs)
+
+            produced = _expand(outputs)
+            if outputs and not produced:
+                _logger.warning('Build step "{}" did not produce any of the outputs {}'.format(name, outputs))
+            try:
+                _store(archive_path, produced)
+            except OSError as e:
+                _logger.warning('Unable to cache build step "{}": {}'.format(name, e))
+
+            return result
+        return wrapper
+    return decorator
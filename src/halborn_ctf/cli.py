@@ -6,13 +6,18 @@ The entry point for the CLI command is the :obj:`run` function.
 """
 
 import argparse
+import json
 import logging
+import subprocess
 import sys
 import os
-from python_on_whales import docker
+import time
 
 from halborn_ctf import __version__
-from halborn_ctf.generator import generate
+from halborn_ctf._logging import setup as setup_logging, JSONFormatter
+
+# Heavy dependencies (python_on_whales, jinja2, requests...) are only imported by the methods using them. The ``run --local``
+# method is executed when starting every challenge container.
 
 __author__ = "ferran.celades"
 __copyright__ = "ferran.celades"
@@ -40,6 +45,12 @@ def _parse_args(args):
     parent_parser.add_argument("-c", "--class", help="The name of the class in the file to use", default="Challenge", metavar='class')
     parent_parser.add_argument("-f", "--file", help="File path", default="./challenge.py")
     parent_parser.add_argument('--verbose', '-v', action='count', default=0, help="Level of verbosity")
+    parent_parser.add_argument('--profile-startup', action='store_true', help="Reports the import time of the CLI and the challenge file instead of running the method")
+    parent_parser.add_argument('--log-format', choices=['text', 'json'], default=os.environ.get('LOG_FORMAT', 'text'), help="Format of the logs (env: LOG_FORMAT)")
+    parent_parser.add_argument('--access-log-sample', type=float, default=float(os.environ.get('ACCESS_LOG_SAMPLE', 1.0)), metavar='RATE',
+                               help="Fraction of the successful requests to log (env: ACCESS_LOG_SAMPLE)")
+    parent_parser.add_argument('--output-log-rate', type=float, default=float(os.environ.get('OUTPUT_LOG_RATE', 0)) or None, metavar='LINES',
+                               help="Maximum lines per second of the commands output to log (env: OUTPUT_LOG_RATE)")
 
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest='method', help='Methods', required=True)
@@ -48,9 +59,24 @@ def _parse_args(args):
 
     run_parser = subparsers.add_parser('run', help='Runs the challenge', parents=[parent_parser])
     run_parser.add_argument('--local', action='store_true', help="Runs the challenge locally instead of a container")
+    run_parser.add_argument('--watch', action='store_true', help="Reloads the challenge when the challenge file changes")
+    run_parser.add_argument('--instances', type=int, metavar='N', help="Runs N isolated instances of the challenge on the same process managed through the /_instances API (see halborn_ctf.instances)")
+    run_parser.add_argument('--max-instances', type=int, default=100, help="Maximum amount of instances with --instances")
+    run_parser.add_argument('--domain', help="Routes <id>.<domain> to the instance id with --instances")
+    run_parser.add_argument('--pool', type=int, default=0, metavar='K', help="Keeps K instances deployed to be claimed through /_pool/claim with --instances")
+    run_parser.add_argument('--pool-concurrency', type=int, default=2, help="Pool instances deployed at the same time with --pool")
 
     build_parser = subparsers.add_parser('build', help='Builds the challenge', parents=[parent_parser])
     build_parser.add_argument('--no-cache', action='store_true', help='Ignores the docker build cache')
+    build_parser.add_argument('--local', action='store_true', help="Runs the challenge build step locally instead of building the container")
+
+    bench_parser = subparsers.add_parser('bench', help='Load tests the challenge running it locally', parents=[parent_parser])
+    bench_parser.add_argument('--concurrency', type=int, default=16, help="Amount of concurrent clients")
+    bench_parser.add_argument('--duration', type=float, default=5.0, help="Seconds to load each route for")
+    bench_parser.add_argument('--routes', nargs='*', help="Only benchmark the routes containing any of the given values")
+    bench_parser.add_argument('--rpc-port', type=int, default=8545, help="Port of the stand-in JSON-RPC chain")
+    bench_parser.add_argument('--no-stub-chain', action='store_true', help="Do not start the stand-in JSON-RPC chain")
+    bench_parser.add_argument('--output', '-o', help="File to write the JSON report to. Defaults to stdout")
 
     init_parser = subparsers.add_parser('init', help='Allows to use challenge templates', parents=[parent_parser])
     init_parser.add_argument('-t',"--template", help="The name of the template to use", default="generic")
@@ -81,26 +107,172 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + logformat + reset
     }
 
+    def __init__(self):
+        super().__init__()
+        # The formatters are created once instead of on each record
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+        self._default_formatter = logging.Formatter(self.logformat)
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self._formatters.get(record.levelno, self._default_formatter)
         return formatter.format(record)
 
-def _setup_logging(loglevel):
+def _setup_logging(loglevel, log_format='text', access_sample=1.0, output_rate=None):
     """Setup basic logging
 
+    Records are formatted and written on a background thread (see :obj:`halborn_ctf._logging`).
+
     Args:
       loglevel (int): minimum loglevel for emitting messages
+      log_format (str): ``'text'`` or ``'json'`` (one JSON object per line)
+      access_sample (float): fraction of the access logs to keep
+      output_rate (float): maximum lines per second of child process output to log
     """
-    sh = logging.StreamHandler()
-    sh.setFormatter(CustomFormatter())
-
-    logging.basicConfig(
-        level=loglevel, datefmt="%Y-%m-%d %H:%M:%S",
-        handlers=[
-            sh
-        ]
-    )
+    formatter = JSONFormatter() if log_format == 'json' else CustomFormatter()
+
+    setup_logging(loglevel, formatter, access_sample=access_sample, output_rate=output_rate)
+
+def _import_challenge(file, class_name):
+    """Imports the challenge file and returns the challenge class
+
+    Args:
+      file (str): path of the challenge file
+      class_name (str): name of the challenge class
+
+    Returns:
+      type: the challenge class
+    """
+    abs_path = os.path.abspath(file)
+    module_name = os.path.splitext(os.path.basename(abs_path))[0]
+    module_path = os.path.dirname(abs_path)
+
+    sys.path.append(module_path)
+
+    module = __import__(module_name)
+
+    return getattr(module, class_name)
+
+def _load_challenge_class(args):
+    """Imports the challenge file and sets up the logging
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      type: the challenge class
+    """
+    _cls = _import_challenge(args.file, getattr(args, 'class'))
+
+    levels = [
+        (logging.WARNING, 'WARNING'),
+        (logging.INFO, 'INFO'),
+        (logging.DEBUG, 'DEBUG')
+    ]
+
+    _level,_level_name = levels[min(args.verbose, len(levels) - 1)]
+
+    _setup_logging(_level, args.log_format, args.access_log_sample, args.output_log_rate)
+    _logger.warning('============================')
+    _logger.warning('Logging level: {}'.format(_level_name))
+    _logger.warning('============================')
+
+    return _cls
+
+def _load_challenge(args):
+    """Imports the challenge file, sets up the logging and initializes the challenge class
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      :obj:`halborn_ctf.templates.GenericChallenge`: the challenge instance
+    """
+    # Initiation challenge
+    return _load_challenge_class(args)()
+
+def _profile_startup(args, top=30):
+    """Prints the time spent importing the CLI and the challenge file (and all their dependencies) measured by
+    ``python -X importtime`` on a child process
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+      top (int): amount of modules to show
+    """
+    code = 'import halborn_ctf.cli as cli; cli._import_challenge({!r}, {!r})'.format(args.file, getattr(args, 'class'))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            if result.returncode:
+                print(line, file=sys.stderr)
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), int(_self), name.rstrip()))
+
+    # Top level imports (no indentation) add up to the total import time
+    total = sum(cumulative for cumulative, _, name in imports if not name.startswith('  '))
+    print('Startup imports: {:.1f} ms (process: {:.1f} ms)'.format(total / 1000, elapsed * 1000))
+    print('{:>12} {:>12}  module'.format('cumulative', 'self'))
+    for cumulative, _self, name in sorted(imports, reverse=True)[:top]:
+        print('{:>9.1f} ms {:>9.1f} ms  {}'.format(cumulative / 1000, _self / 1000, name.strip()))
+
+def _bench(args):
+    """Runs the challenge on a child process and load tests each of its routes (see :obj:`halborn_ctf.bench`)
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    import requests
+    from halborn_ctf import bench
+    from halborn_ctf.network import find_free_port, wait_ready, Probe
+    from halborn_ctf.services import terminate
+
+    chain = None if args.no_stub_chain else bench.StubChain(port=args.rpc_port).start()
+
+    port = find_free_port()
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    cmd = [sys.executable, '-m', 'halborn_ctf.cli', 'run', '--local', '-f', args.file, '-c', getattr(args, 'class')] + ['-v'] * args.verbose
+    proc = subprocess.Popen(cmd, env=dict(os.environ, PORT=str(port)), start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+
+    def challenge_ready():
+        if proc.poll() is not None:
+            raise RuntimeError('The challenge exited with code {}'.format(proc.returncode))
+        return requests.get(base_url + '/info', timeout=1).json()['ready']
+
+    try:
+        started = time.perf_counter()
+        wait_ready(Probe('challenge', challenge_ready), timeout=120)
+        report = {
+            'halborn_ctf': __version__,
+            'challenge': '{}:{}'.format(args.file, getattr(args, 'class')),
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'startup_seconds': round(time.perf_counter() - started, 3),
+            'results': {}
+        }
+
+        routes = bench.targets(requests.get(base_url + '/info', timeout=5).json())
+        for name, (method, path, kwargs) in routes.items():
+            if args.routes and not any(value in name for value in args.routes):
+                continue
+            result = bench.run_load(method, base_url + path, concurrency=args.concurrency, duration=args.duration, **kwargs)
+            report['results'][name] = result
+            print('{:<30} {:>10.1f} req/s  p50 {:>8} ms  p95 {:>8} ms  p99 {:>8} ms  errors {}'.format(
+                name, result['rps'], result['latency']['p50'], result['latency']['p95'], result['latency']['p99'], result['errors']), file=sys.stderr)
+    finally:
+        terminate([proc], group=True)
+        if chain:
+            chain.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
 
 def main(list_args):
     """Wrapper allowing any method to be called on a given module/class provided via arguments in a CLI fashion
@@ -111,43 +283,42 @@ def main(list_args):
     """
     args = _parse_args(list_args)
 
+    if args.profile_startup:
+        _profile_startup(args)
+        return
+
     if args.method == 'init':
         if os.listdir('.'):
             print('Folder not empty')
         else:
+            from halborn_ctf.generator import generate
             generate(args.template)
 
     IMAGE_NAME = 'ctf-local'
+    CONTAINER_NAME = 'ctf-local'
+
+    if args.method == 'bench':
+        _bench(args)
+        return
 
     if args.method == 'build':
-        docker.build('.', tags=IMAGE_NAME, cache=(not args.no_cache))
-    elif args.method == 'run':
         if args.local:
-            abs_path = os.path.abspath(args.file)
-            module_name = os.path.splitext(os.path.basename(abs_path))[0]
-            module_path = os.path.dirname(abs_path)
-
-            sys.path.append(module_path)
-
-            module = __import__(module_name)
-
-            _cls = getattr(module, getattr(args, 'class'))
-
-            levels = [
-                (logging.WARNING, 'WARNING'),
-                (logging.INFO, 'INFO'),
-                (logging.DEBUG, 'DEBUG')
-            ]
-
-            _level,_level_name = levels[min(args.verbose, len(levels) - 1)]
-
-            _setup_logging(_level)
-            _logger.warning('============================')
-            _logger.warning('Logging level: {}'.format(_level_name))
-            _logger.warning('============================')
-
-            # Initiation challenge
-            c = _cls()
+            c = _load_challenge(args)
+            c._build()
+        else:
+            from python_on_whales import docker
+            docker.build('.', tags=IMAGE_NAME, cache=(not args.no_cache))
+    elif args.method == 'run':
+        if args.local and (args.instances is not None or args.pool):
+            from halborn_ctf.instances import InstanceHost
+            host = InstanceHost(_load_challenge_class(args), max_instances=args.max_instances, domain=args.domain,
+                                token=os.environ.get('INSTANCES_TOKEN'), pool_size=args.pool, pool_concurrency=args.pool_concurrency)
+            host.run(port=int(os.environ.get('PORT', 8080)), instances=args.instances or 0)
+        elif args.local and args.watch:
+            from halborn_ctf._reload import _Reloader
+            _Reloader(args.file, getattr(args, 'class')).run(_load_challenge_class(args))
+        elif args.local:
+            c = _load_challenge(args)
 
             # _method = getattr(c, '_'+args.method)
             _run_method = getattr(c, '_run')
@@ -155,11 +326,21 @@ def main(list_args):
             # Initiation method
             _run_method()
         else:
-            for container in docker.container.list():
-                if container.config.image == IMAGE_NAME:
-                    container.kill()
+            from python_on_whales import docker
+            # A single named container is run, replace the previous one if it is still around
+            if docker.container.exists(CONTAINER_NAME):
+                docker.container.remove(CONTAINER_NAME, force=True)
 
-            docker.run(IMAGE_NAME, publish=[('8080','8080')], detach=False, command=list_args + ['--local'], envs={'FLAG': 'DYNAMIC_FLAG'})
+            command = list_args + ['--local']
+            volumes = []
+            if args.watch:
+                # The image has a copy of the challenge file, watch the local one instead
+                folder, name = os.path.split(os.path.abspath(args.file))
+                volumes.append((folder, '/challenge_src', 'ro'))
+                command += ['-f', '/challenge_src/' + name]
+
+            docker.run(IMAGE_NAME, name=CONTAINER_NAME, remove=True, publish=[('8080','8080')], volumes=volumes, detach=False,
+                       command=command, envs={'FLAG': 'DYNAMIC_FLAG'})
 
 
 def run():
@@ -169,11 +350,21 @@ def run():
 
     The allowed flags are:
 
-        - ``[METHOD]``: The method to execute. Only 'build' and 'run' are allowed. Valids are ``build, run``.
+        - ``[METHOD]``: The method to execute. Valids are ``init, build, run, bench``.
+        - ``--local``: Runs the method on the current machine instead of a container. For ``build`` it executes the
+          challenge ``build`` step (the generated ``Dockerfile`` does it while building the image).
         - ``-f/--file``: The file where the class/function is present. Defaults to ``"./challenge.py"``.
         - ``-c/--class``: The class where the method is found. Defaults to ``"Challenge"``.
         - ``-v``: Verbose (INFO).
         - ``-vv``: Verbose (DEBUG).
+        - ``--watch``: With ``run``, reloads the challenge when the challenge file changes. Changes to ``solver``,
+          ``details``, ``files`` or the :obj:`halborn_ctf.templates.GenericChallenge.register_path` handlers are applied
+          at once. Other changes deploy the challenge again keeping the :obj:`halborn_ctf.services.Service` objects whose
+          configuration did not change. In a container, the challenge folder is mounted to watch the local file.
+        - ``--instances N``: With ``run``, runs ``N`` isolated instances of the challenge on the same process (see
+          :obj:`halborn_ctf.instances`). ``--max-instances`` and ``--domain`` configure the host. ``--pool K`` keeps ``K``
+          instances deployed to be claimed at once (``--pool-concurrency`` of them deployed at the same time).
+        - ``--profile-startup``: Reports the modules taking longer to import when loading the challenge instead of running the method.
 
     Example:
         Executing method ``run`` from the ``challenge.py`` file and the class named ``Challenge`` in debug mode::
@@ -184,6 +375,10 @@ def run():
 
             halborn_ctf build -f file.py -c ChallengeCustom
 
+        Load testing the challenge with 32 concurrent clients and storing the JSON report (see :obj:`halborn_ctf.bench`)::
+
+            halborn_ctf bench --concurrency 32 --duration 10 -o bench.json
+
     """
     main(sys.argv[1:])
 
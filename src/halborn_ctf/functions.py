@@ -1,34 +1,220 @@
 import types
-import functools
+import heapq
+import itertools
+import logging
+import random
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
+_logger = logging.getLogger(__name__)
+
+_MODES = ('rate', 'delay')
+
+
+class _Scheduler():
+    """Single thread scheduler backed by a heap ordered by the next execution time.
+
+    The scheduler thread only dispatches the due tasks, which run on a shared pool of worker threads.
+    """
+    def __init__(self, max_workers=16) -> None:
+        self._condition = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='periodic')
+
+    def schedule(self, task, when):
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._sequence), task))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='periodic-scheduler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self, task):
+        with self._condition:
+            self._heap = [entry for entry in self._heap if entry[2] is not task]
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                when, _, task = self._heap[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+
+            task._dispatch(when)
+
+    def submit(self, function):
+        self._executor.submit(function)
+
+
+_scheduler = _Scheduler()
+
+
+class _PeriodicTask():
+    """A single periodic execution chain of a :class:`_PeriodicFunction`.
+    """
+    def __init__(self, periodic, args, kwargs) -> None:
+        self._periodic = periodic
+        self._args = args
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._running = False
+        self.cancelled = False
+        # Ideal time of the last tick in 'rate' mode, without the jitter
+        self._base = None
+
+    def _next_time(self, base):
+        return base + self._periodic._periodic_time + random.uniform(0, self._periodic._jitter)
+
+    def _dispatch(self, when):
+        if self.cancelled:
+            return
+
+        periodic = self._periodic
+        now = time.monotonic()
+
+        if periodic._mode == 'rate':
+            # Fixed rate: the next run is based on the ideal (un-jittered) schedule so neither the jitter nor late
+            # dispatches accumulate into drift. Ticks already missed (for example a blocked worker pool) are skipped.
+            every = periodic._periodic_time
+            base = self._base + every
+            offset = random.uniform(0, periodic._jitter)
+            if base + offset <= now:
+                missed = int((now - base - offset) // every) + 1
+                periodic._skip(missed)
+                base += missed * every
+            self._base = base
+            _scheduler.schedule(self, base + offset)
+
+        with self._lock:
+            if self._running:
+                periodic._skip(1)
+                return
+            self._running = True
+
+        _scheduler.submit(self._execute)
+
+    def _execute(self):
+        periodic = self._periodic
+        start = time.perf_counter()
+        try:
+            periodic._function(*self._args, **self._kwargs)
+        except Exception as e:
+            _logger.exception(e)
+            periodic._record(time.perf_counter() - start, error=True)
+        else:
+            periodic._record(time.perf_counter() - start)
+        finally:
+            with self._lock:
+                self._running = False
+
+            if periodic._mode == 'delay' and not self.cancelled:
+                _scheduler.schedule(self, self._next_time(time.monotonic()))
+
+
 class _PeriodicFunction():
-    def __init__(self, function, every=0) -> None:
+    def __init__(self, function, every=0, mode='rate', jitter=0.0) -> None:
         self._function = function
         self.stopped = False
 
         if every <= 0:
             raise ValueError('Periodic time > 0')
 
+        if mode not in _MODES:
+            raise ValueError('Periodic mode must be one of {}'.format(_MODES))
+
+        if jitter < 0:
+            raise ValueError('Periodic jitter >= 0')
+
         self._periodic_time = every
+        self._mode = mode
+        self._jitter = jitter
+
+        self._tasks = []
+        self._stats_lock = threading.Lock()
+        self._runs = 0
+        self._skipped = 0
+        self._errors = 0
+        self._total_time = 0.0
+        self._max_time = 0.0
+        self._last_time = None
+
+    def __set_name__(self, owner, name):
+        self._name = name
 
     def __get__(self, obj, objtype):
-        return types.MethodType(self, obj)
+        if obj is None:
+            return self
+        # Each instance gets its own periodic function (tasks, statistics and stop) cached on the instance, which takes
+        # precedence over this non-data descriptor on the next lookups
+        name = getattr(self, '_name', self._function.__name__)
+        bound = _PeriodicFunction(types.MethodType(self._function, obj), every=self._periodic_time, mode=self._mode,
+                                  jitter=self._jitter)
+        obj.__dict__[name] = bound
+        return bound
 
     def __call__(self, *args, **kwargs):
-        if not self.stopped:
-            threading.Timer(self._periodic_time, self, args=args, kwargs=kwargs).start()
-            self._function(*args, **kwargs)
+        self.stopped = False
+        task = _PeriodicTask(self, args, kwargs)
+        self._tasks.append(task)
+        task._base = time.monotonic()
+        _scheduler.schedule(task, task._base)
+
+    def _skip(self, amount):
+        with self._stats_lock:
+            self._skipped += amount
+
+    def _record(self, duration, error=False):
+        with self._stats_lock:
+            self._runs += 1
+            self._errors += error
+            self._total_time += duration
+            self._max_time = max(self._max_time, duration)
+            self._last_time = duration
+
+    @property
+    def stats(self):
+        """(dict): Run-time statistics of the function: ``runs``, ``skipped`` (ticks skipped because the previous
+        execution was still running), ``errors``, ``last``, ``avg`` and ``max`` (durations in seconds).
+        """
+        return {
+            'runs': self._runs,
+            'skipped': self._skipped,
+            'errors': self._errors,
+            'last': self._last_time,
+            'avg': self._total_time / self._runs if self._runs else None,
+            'max': self._max_time,
+        }
 
     def stop(self):
         self.stopped = True
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancelled = True
+            _scheduler.cancel(task)
 
-def periodic(*, every: int):
+def periodic(*, every: float, mode: str = 'rate', jitter: float = 0.0):
     """It allows executing a function as a periodic function in a thread on the background.
 
+    All periodic functions share a single scheduler thread and a pool of worker threads. If the previous
+    execution of the function is still running when the next one is due, the new one is skipped. When used on a method,
+    each instance gets its own executions and statistics: stopping it on one instance does not stop the others.
+
     Args:
-        every (int): The amount of seconds to wait to execute the function again. It should be bigger than 0.
+        every (float): The amount of seconds to wait to execute the function again. It should be bigger than 0.
+        mode (str, optional): ``'rate'`` to start executions every ``every`` seconds without accumulating drift, or ``'delay'``
+            to wait ``every`` seconds after each execution finishes. Defaults to ``'rate'``.
+        jitter (float, optional): Maximum random amount of seconds added to each execution time. Defaults to 0.
 
     Example:
 
@@ -40,11 +226,13 @@ def periodic(*, every: int):
 
             function() # Does start printing "HI" every 1 second
 
+            function.stats # Does return the run-time statistics {'runs': 10, 'skipped': 0, ...}
+
             function.stop() # Does stop the function execution
 
     Raises:
-        ValueError: If the ``every`` parameter is set to 0.
+        ValueError: If the ``every`` parameter is set to 0 or any parameter is invalid.
     """
     def decorator(function):
-        return _PeriodicFunction(function, every=every)
+        return _PeriodicFunction(function, every=every, mode=mode, jitter=jitter)
     return decorator
@@ -0,0 +1,553 @@
+"""Multi-tenant mode: many isolated player instances of a challenge served by a single process.
+
+Each instance is a separate object of the challenge class with its own :obj:`~halborn_ctf.templates.GenericChallenge.state`,
+``solved`` flag, services, child processes and routes. Requests are routed to an instance by its host
+(``<id>.<domain>``) or by the ``/i/<id>/`` path prefix, and the instances are created, reset and destroyed through the
+``/_instances`` API of the host.
+
+Example:
+    Running the ``challenge.py`` with 10 instances reachable under ``<id>.ctf.example.com``::
+
+        halborn_ctf run --local --instances 10 --domain ctf.example.com
+
+    Managing the instances (the token is read from the ``INSTANCES_TOKEN`` environment variable or logged on startup)::
+
+        curl -X POST -H 'X-Instances-Token: ...' localhost:8080/_instances -d '{"id": "player1"}'
+        curl -X POST -H 'X-Instances-Token: ...' localhost:8080/_instances/player1/reset
+        curl -X DELETE -H 'X-Instances-Token: ...' localhost:8080/_instances/player1
+
+    - ``GET /_instances``: Lists the instances.
+    - ``POST /_instances``: Creates an instance. The body can contain its ``id``. It returns before the instance is ready,
+      its ``status`` is ``deploying`` until :obj:`~halborn_ctf.templates.GenericChallenge.run` finishes.
+    - ``GET /_instances/<id>``: Returns the status of an instance.
+    - ``POST /_instances/<id>/reset``: Destroys the instance and deploys it again with the same id.
+    - ``DELETE /_instances/<id>``: Destroys the instance, stopping its services and child processes.
+
+    With a warm pool (``--pool K``), ``K`` instances are kept deployed and handed out at once by the pool API:
+
+    - ``GET /_pool``: Returns the amount of ``available``, ``deploying`` and ``claimed`` pool instances.
+    - ``POST /_pool/claim``: Claims an instance. The body can contain the player ``flag`` (see
+      :obj:`~halborn_ctf.templates.GenericChallenge.flag`). If no instance is available a new one is deployed.
+
+Note:
+    Instances share the network namespace of the process. The challenge must not listen on fixed ports: allocate them
+    on :obj:`~halborn_ctf.templates.GenericChallenge.run` (for example with :obj:`halborn_ctf.network.find_free_port`)
+    and set ``self.PATH_MAPPING`` there. ``TCP_MAPPING`` is not supported as its ports are fixed. In the same way, a
+    :obj:`~halborn_ctf.templates.Web3Challenge` must start its own chain on :obj:`~halborn_ctf.templates.GenericChallenge.run`
+    and set ``self.RPC_URL`` to it, as the snapshots, ``/reset`` and
+    :obj:`~halborn_ctf.templates.Web3Challenge.solve_when` of each instance use its
+    :obj:`~halborn_ctf.templates.Web3Challenge.RPC_URL`.
+"""
+import hmac
+import logging
+import re
+import secrets
+import signal
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import flask
+from flask import Response, request
+from werkzeug.serving import make_server
+
+from . import metrics
+from . import shell
+from .services import terminate
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'Instance',
+    'InstanceHost',
+    'WarmPool',
+]
+
+_PATH_PREFIX = '/i/'
+_ID_PATTERN = re.compile(r'^[a-z0-9][a-z0-9-]{0,62}$')
+_STATUSES = ('deploying', 'ready', 'failed')
+_POOL_INTERVAL = 1.0
+_POOL_MAX_BACKOFF = 30.0
+
+_CLAIMS = metrics.counter('pool_claims_total', 'Instances claimed from the warm pool by result (hit: already deployed)', labelnames=('result',))
+
+
+class Instance():
+    """A player instance of a challenge run by an :class:`InstanceHost`.
+
+    Args:
+        instance_id (str): The id of the instance.
+        challenge (GenericChallenge): The challenge object of the instance.
+    """
+    def __init__(self, instance_id: str, challenge) -> None:
+        self.id = instance_id
+        self.challenge = challenge
+        self.procs = []
+        """ (list[subprocess.Popen]): Processes started by the instance with :obj:`halborn_ctf.shell.run`.
+        """
+        self.status = 'deploying'
+        """ (str): One of ``deploying``, ``ready``, ``failed`` or ``destroyed``.
+        """
+        self.error = None
+        self.created_at = time.time()
+        self.ready_at = None
+        self.pooled = False
+        """ (bool): If the instance is kept on the :class:`WarmPool` waiting to be claimed.
+        """
+        self.claimed_at = None
+        self._future = None
+
+    def info(self, domain=None) -> dict:
+        """Returns the public details of the instance.
+        """
+        return {
+            'id': self.id,
+            'status': self.status,
+            'phase': self.challenge._phase,
+            'error': self.error,
+            'created_at': self.created_at,
+            'ready_at': self.ready_at,
+            'pooled': self.pooled,
+            'claimed_at': self.claimed_at,
+            'processes': sum(1 for proc in self.procs if proc.poll() is None),
+            'path': '{}{}/'.format(_PATH_PREFIX, self.id),
+            'host': '{}.{}'.format(self.id, domain) if domain else None,
+        }
+
+
+class InstanceHost():
+    """Runs many instances of a challenge class on the current process and routes the requests to them.
+
+    Args:
+        challenge_class (type): The :obj:`~halborn_ctf.templates.GenericChallenge` subclass to instantiate.
+        max_instances (int, optional): Maximum amount of instances. Defaults to 100.
+        deploy_workers (int, optional): Amount of instances deployed at the same time. Defaults to 4.
+        domain (str, optional): Routes the requests for ``<id>.<domain>`` to the instance ``id``. Defaults to None (only
+            the path prefix routing).
+        token (str, optional): Token required on the ``X-Instances-Token`` header by the ``/_instances`` API. Defaults to
+            None (a random one is generated and logged).
+        shutdown_timeout (float, optional): Seconds to wait after each shutdown signal sent to the processes of a
+            destroyed instance. Defaults to 5.0.
+        pool_size (int, optional): Instances kept deployed by the :class:`WarmPool`. Defaults to 0 (no pool).
+        pool_concurrency (int, optional): Pool instances deployed at the same time. Defaults to 2.
+
+    Raises:
+        ValueError: If the challenge uses ``TCP_MAPPING``.
+    """
+    def __init__(self, challenge_class, *, max_instances: int = 100, deploy_workers: int = 4, domain: str = None,
+                 token: str = None, shutdown_timeout: float = 5.0, pool_size: int = 0, pool_concurrency: int = 2) -> None:
+        if challenge_class.TCP_MAPPING:
+            raise ValueError('TCP_MAPPING can not be used with multiple instances')
+
+        self.challenge_class = challenge_class
+        self.max_instances = max_instances
+        self.domain = domain.strip('.') if domain else None
+        self.shutdown_timeout = shutdown_timeout
+
+        if token is None:
+            token = secrets.token_urlsafe(24)
+            _logger.warning('Instances API token: {}'.format(token))
+        self._token = token
+
+        self._lock = threading.Lock()
+        self._instances = {}
+        self._executor = ThreadPoolExecutor(max_workers=deploy_workers, thread_name_prefix='deploy')
+        self._app = self._admin_app()
+        self._http_server = None
+
+        self.pool = WarmPool(self, pool_size, concurrency=pool_concurrency) if pool_size else None
+        """ (WarmPool): The warm pool of the host. ``None`` if ``pool_size`` is ``0``.
+        """
+
+        instances = metrics.gauge('instances', 'Challenge instances by status', labelnames=('status',))
+        for status in _STATUSES:
+            instances.labels(status).set_function(lambda status=status: self._count(status))
+
+    def _count(self, status):
+        return sum(1 for instance in list(self._instances.values()) if instance.status == status)
+
+    def __getitem__(self, instance_id) -> Instance:
+        return self._instances[instance_id]
+
+    @property
+    def instances(self):
+        """(list[Instance]): The current instances.
+        """
+        with self._lock:
+            return list(self._instances.values())
+
+    def create(self, instance_id: str = None, *, pooled: bool = False) -> Instance:
+        """Creates an instance and deploys it on the background.
+
+        Args:
+            instance_id (str, optional): Id of the instance (lowercase letters, numbers and dashes). Defaults to None (random).
+            pooled (bool, optional): If the instance is kept on the :class:`WarmPool` until claimed. Defaults to False.
+
+        Raises:
+            ValueError: If the id is not valid or already used.
+            RuntimeError: If there are :attr:`max_instances` already.
+
+        Returns:
+            Instance: The instance being deployed.
+        """
+        instance_id = instance_id or uuid.uuid4().hex[:12]
+        if not _ID_PATTERN.match(instance_id):
+            raise ValueError('Invalid instance id "{}"'.format(instance_id))
+
+        with self._lock:
+            if instance_id in self._instances:
+                raise ValueError('Instance "{}" already exists'.format(instance_id))
+            if len(self._instances) >= self.max_instances:
+                raise RuntimeError('Maximum amount of instances ({}) reached'.format(self.max_instances))
+
+            challenge = self.challenge_class()
+            challenge.instance_id = instance_id
+            challenge.log = logging.getLogger('{}.{}'.format(challenge.CHALLENGE_NAME, instance_id))
+
+            instance = Instance(instance_id, challenge)
+            instance.pooled = pooled
+            self._instances[instance_id] = instance
+
+        instance._future = self._executor.submit(self._deploy, instance)
+        return instance
+
+    def _deploy(self, instance):
+        start = time.monotonic()
+        try:
+            # Every process started by the instance (also from its services and steps) is tracked to be stopped with it
+            with shell._track(instance.procs):
+                instance.challenge._deploy()
+        except Exception as e:
+            _logger.exception('Instance "{}" failed to deploy'.format(instance.id))
+            instance.status = 'failed'
+            instance.error = str(e)
+            self._teardown(instance)
+            return
+
+        instance.status = 'ready'
+        instance.ready_at = time.time()
+        _logger.info('Instance "{}" ready in {:.2f}s'.format(instance.id, time.monotonic() - start))
+
+    def _teardown(self, instance):
+        instance.challenge._stop()
+        terminate(instance.procs, timeout=self.shutdown_timeout, group=True)
+
+    def destroy(self, instance_id: str):
+        """Destroys an instance stopping its services and processes. If the instance is being deployed, it waits for
+        the deployment to finish first.
+
+        Raises:
+            KeyError: If the instance does not exist.
+        """
+        with self._lock:
+            instance = self._instances.pop(instance_id)
+
+        instance._future.result()
+        if instance.status != 'failed':
+            self._teardown(instance)
+        instance.status = 'destroyed'
+        _logger.info('Instance "{}" destroyed'.format(instance_id))
+
+    def reset(self, instance_id: str) -> Instance:
+        """Destroys an instance and deploys a new one with the same id (and flag).
+
+        Raises:
+            KeyError: If the instance does not exist.
+
+        Returns:
+            Instance: The new instance being deployed.
+        """
+        previous = self._instances[instance_id]
+        self.destroy(instance_id)
+
+        instance = self.create(instance_id)
+        instance.challenge.flag = previous.challenge.flag
+        instance.claimed_at = previous.claimed_at
+        return instance
+
+    def stop(self):
+        """Destroys all the instances.
+        """
+        if self.pool:
+            self.pool.stop()
+
+        with self._lock:
+            instance_ids = list(self._instances)
+        for instance_id in instance_ids:
+            try:
+                self.destroy(instance_id)
+            except KeyError:
+                pass
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _route(self, environ):
+        """Returns the instance of a request and the environ to forward to it.
+        """
+        if self.domain:
+            host = environ.get('HTTP_HOST', '').rsplit(':', 1)[0]
+            if host.endswith('.' + self.domain):
+                return self._instances.get(host[:-len(self.domain) - 1]), environ
+
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(_PATH_PREFIX):
+            instance_id, _, rest = path[len(_PATH_PREFIX):].partition('/')
+            environ = dict(environ, SCRIPT_NAME=environ.get('SCRIPT_NAME', '') + _PATH_PREFIX + instance_id, PATH_INFO='/' + rest)
+            return self._instances.get(instance_id), environ
+
+        return None, environ
+
+    def __call__(self, environ, start_response):
+        instance, environ = self._route(environ)
+        if instance is not None:
+            return instance.challenge._app_switch(environ, start_response)
+        return self._app(environ, start_response)
+
+    #######################################
+
+    def _authorized(self):
+        token = request.headers.get('X-Instances-Token') or ''
+        return hmac.compare_digest(token.encode(), self._token.encode())
+
+    def _before_request(self):
+        if request.path.startswith(('/_instances', '/_pool')) and not self._authorized():
+            return Response('Forbidden', 403)
+
+    def _app_list_handler(self):
+        return {
+            'max_instances': self.max_instances,
+            'instances': [instance.info(self.domain) for instance in self.instances],
+        }
+
+    def _app_create_handler(self):
+        data = request.get_json(silent=True) or {}
+        try:
+            instance = self.create(data.get('id'))
+        except ValueError as e:
+            return Response(str(e), 409)
+        except RuntimeError as e:
+            return Response(str(e), 503)
+        return instance.info(self.domain), 202
+
+    def _app_instance_handler(self, instance_id):
+        instance = self._instances.get(instance_id)
+        if instance is None:
+            return Response('Instance not found', 404)
+        return instance.info(self.domain)
+
+    def _app_reset_handler(self, instance_id):
+        try:
+            instance = self.reset(instance_id)
+        except KeyError:
+            return Response('Instance not found', 404)
+        return instance.info(self.domain), 202
+
+    def _app_destroy_handler(self, instance_id):
+        try:
+            self.destroy(instance_id)
+        except KeyError:
+            return Response('Instance not found', 404)
+        return {'id': instance_id, 'status': 'destroyed'}
+
+    def _app_pool_handler(self):
+        if self.pool is None:
+            return Response('Warm pool not enabled', 404)
+        return self.pool.stats
+
+    def _app_claim_handler(self):
+        if self.pool is None:
+            return Response('Warm pool not enabled', 404)
+        data = request.get_json(silent=True) or {}
+        try:
+            instance = self.pool.claim(flag=data.get('flag'))
+        except RuntimeError as e:
+            return Response(str(e), 503)
+        return instance.info(self.domain), 200 if instance.status == 'ready' else 202
+
+    def _app_healthz_handler(self):
+        return Response('ok', mimetype='text/plain')
+
+    def _app_metrics_handler(self):
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def _admin_app(self):
+        app = flask.Flask('InstanceHost')
+        app.before_request(self._before_request)
+
+        app.add_url_rule('/healthz', 'healthz', self._app_healthz_handler, methods=['GET'])
+        app.add_url_rule('/metrics', 'metrics', self._app_metrics_handler, methods=['GET'])
+        app.add_url_rule('/_instances', 'list', self._app_list_handler, methods=['GET'])
+        app.add_url_rule('/_instances', 'create', self._app_create_handler, methods=['POST'])
+        app.add_url_rule('/_instances/<instance_id>', 'instance', self._app_instance_handler, methods=['GET'])
+        app.add_url_rule('/_instances/<instance_id>', 'destroy', self._app_destroy_handler, methods=['DELETE'])
+        app.add_url_rule('/_instances/<instance_id>/reset', 'reset', self._app_reset_handler, methods=['POST'])
+        app.add_url_rule('/_pool', 'pool', self._app_pool_handler, methods=['GET'])
+        app.add_url_rule('/_pool/claim', 'claim', self._app_claim_handler, methods=['POST'])
+        return app
+
+    def run(self, port: int = 8080, instances: int = 0):
+        """Creates ``instances`` instances and serves the requests until interrupted. All the instances are destroyed on exit.
+
+        Args:
+            port (int, optional): Port to listen on. Defaults to 8080.
+            instances (int, optional): Amount of instances to create on startup. Defaults to 0.
+        """
+        if threading.current_thread() is threading.main_thread():
+            # The instances processes run on their own sessions, exit through the cleanup on SIGTERM too
+            signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        _logger.warning('===========================================')
+        _logger.warning('Starting instances host on 0.0.0.0:{}'.format(port))
+        _logger.warning('===========================================')
+        self._http_server = make_server('0.0.0.0', port, self, threaded=True)
+
+        try:
+            for _ in range(instances):
+                self.create()
+            if self.pool:
+                self.pool.start()
+            self._http_server.serve_forever()
+        finally:
+            self._http_server.server_close()
+            self.stop()
+
+
+class WarmPool():
+    """Keeps ``size`` instances of an :class:`InstanceHost` deployed and idle so players get one at once with :obj:`claim`.
+    Claimed instances are replaced on the background.
+
+    Per player values that are only used once deployed, such as the
+    :obj:`~halborn_ctf.templates.GenericChallenge.flag`, are applied when claiming. Values needed by
+    :obj:`~halborn_ctf.templates.GenericChallenge.run` can not be set per player with a pool.
+
+    Args:
+        host (InstanceHost): The host running the instances.
+        size (int): Amount of instances to keep deployed.
+        concurrency (int, optional): Pool instances deployed at the same time. Defaults to 2.
+    """
+    def __init__(self, host: InstanceHost, size: int, concurrency: int = 2) -> None:
+        self.host = host
+        self.size = size
+        self.concurrency = concurrency
+        self.claims = 0
+        """ (int): Amount of claimed instances.
+        """
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Consecutive failed deployments and when to deploy again after them
+        self._failures = 0
+        self._retry_at = 0
+
+    def _pooled(self):
+        return [instance for instance in self.host.instances if instance.pooled]
+
+    @property
+    def stats(self):
+        """(dict): The pool ``size`` and the amount of ``available`` (deployed), ``deploying``, ``failed`` and ``claimed``
+        instances.
+        """
+        pooled = self._pooled()
+        return {
+            'size': self.size,
+            'available': sum(1 for instance in pooled if instance.status == 'ready'),
+            'deploying': sum(1 for instance in pooled if instance.status == 'deploying'),
+            'failed': sum(1 for instance in pooled if instance.status == 'failed'),
+            'claimed': self.claims,
+        }
+
+    def start(self):
+        """Starts filling the pool on a background thread.
+        """
+        self._thread = threading.Thread(target=self._loop, name='warm-pool', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops replenishing the pool. The instances are not destroyed.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+
+    def claim(self, flag: str = None) -> Instance:
+        """Hands out the oldest deployed instance of the pool. If there is none, a new instance is deployed (the
+        returned instance ``status`` is ``deploying``).
+
+        Args:
+            flag (str, optional): The flag of the player. Defaults to None (the ``FLAG`` environment variable).
+
+        Raises:
+            RuntimeError: If the host already has its maximum amount of instances.
+
+        Returns:
+            Instance: The claimed instance.
+        """
+        with self._lock:
+            available = [instance for instance in self._pooled() if instance.status == 'ready']
+            instance = min(available, key=lambda instance: instance.ready_at, default=None)
+            if instance is not None:
+                instance.pooled = False
+
+        if instance is None:
+            _logger.warning('Warm pool empty, deploying a new instance')
+            instance = self.host.create()
+            _CLAIMS.labels('miss').inc()
+        else:
+            _CLAIMS.labels('hit').inc()
+
+        if flag is not None:
+            instance.challenge.flag = flag
+        instance.claimed_at = time.time()
+        self.claims += 1
+
+        self._wakeup.set()
+        return instance
+
+    def _deployed(self, instance):
+        with self._lock:
+            if instance.status == 'ready':
+                self._failures = 0
+                self._retry_at = 0
+            else:
+                # Do not deploy continuously a challenge that fails
+                self._failures += 1
+                delay = min(_POOL_MAX_BACKOFF, 2 ** self._failures)
+                self._retry_at = time.monotonic() + delay
+                _logger.warning('Warm pool instance failed to deploy, retrying in {}s'.format(delay))
+        self._wakeup.set()
+
+    def _replenish(self):
+        pooled = self._pooled()
+
+        for instance in pooled:
+            if instance.status == 'failed':
+                try:
+                    self.host.destroy(instance.id)
+                except KeyError:
+                    pass
+
+        if time.monotonic() < self._retry_at:
+            return
+
+        pooled = [instance for instance in pooled if instance.status != 'failed']
+        deploying = sum(1 for instance in pooled if instance.status == 'deploying')
+        missing = min(self.size - len(pooled), self.concurrency - deploying)
+
+        for _ in range(max(0, missing)):
+            try:
+                instance = self.host.create(pooled=True)
+            except RuntimeError as e:
+                _logger.debug('Warm pool not replenished: {}'.format(e))
+                return
+            instance._future.add_done_callback(lambda future, instance=instance: self._deployed(instance))
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._replenish()
+
+            self._wakeup.wait(_POOL_INTERVAL)
+            self._wakeup.clear()
@@ -0,0 +1,327 @@
+"""Lightweight in-process metrics used by the challenge server.
+
+Metrics are created once (usually at module level) and updated from any thread. Each metric uses its
+own lock only for the few instructions needed to update it, so recording a value costs close to nothing.
+
+All the metrics are exported on the challenge ``/metrics`` endpoint using the Prometheus text format
+(see :obj:`render`).
+
+Example:
+
+    .. code::
+
+        from halborn_ctf import metrics
+
+        DEPLOYS = metrics.counter('deploys_total', 'Amount of deployments')
+        DEPLOY_TIME = metrics.histogram('deploy_seconds', 'Time to deploy')
+        REQUESTS = metrics.counter('api_requests_total', 'Requests to the API', labelnames=('method',))
+
+        DEPLOYS.inc()
+        with DEPLOY_TIME.time():
+            deploy()
+        REQUESTS.labels('GET').inc()
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = [
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'counter',
+    'gauge',
+    'histogram',
+    'render',
+]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+""" (tuple): Default upper bounds (in seconds) of the histogram buckets.
+"""
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+
+class _Metric():
+    """Common handling of the metric names, documentation and labels.
+
+    A metric declared with ``labelnames`` is a family: values are recorded on the children returned by :obj:`labels`.
+    """
+    _type = None
+
+    def __init__(self, name, documentation='', labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        self._function = None
+
+    def _new_child(self):
+        return type(self)(self.name, self.documentation)
+
+    def labels(self, *values, **kwargs):
+        """Returns the child metric for the given label values (by position or by name), creating it if needed.
+
+        Raises:
+            ValueError: If the metric has no labels or the values do not match them.
+        """
+        if not self.labelnames:
+            raise ValueError('Metric "{}" has no labels'.format(self.name))
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError('Metric "{}" expects the labels {}'.format(self.name, self.labelnames))
+
+        key = tuple(str(value) for value in values)
+        # Lookups of existing children do not take the lock
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def set_function(self, function):
+        """Reads the value from ``function`` when the metric is exported instead of recording it. Useful to export values
+        already tracked somewhere else.
+        """
+        self._function = function
+
+    def _samples(self):
+        if not self.labelnames:
+            return [('', self._child_samples())]
+        return [(_format_labels(self.labelnames, key), child._child_samples()) for key, child in list(self._children.items())]
+
+    def _child_samples(self):
+        return [('', self.value)]
+
+
+class Counter(_Metric):
+    """Monotonically increasing value.
+
+    Args:
+        name (str): Name of the metric
+        documentation (str, optional): Description of the metric. Defaults to ''.
+        labelnames (tuple, optional): Names of the labels of the metric. Defaults to ().
+    """
+    _type = 'counter'
+
+    def __init__(self, name, documentation='', labelnames=()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._value = 0
+
+    def inc(self, amount=1):
+        """Increments the counter by ``amount``.
+        """
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        """(float): The current value.
+        """
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down (for example the amount of requests in flight).
+
+    Args:
+        name (str): Name of the metric
+        documentation (str, optional): Description of the metric. Defaults to ''.
+        labelnames (tuple, optional): Names of the labels of the metric. Defaults to ().
+    """
+    _type = 'gauge'
+
+    def __init__(self, name, documentation='', labelnames=()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._value = 0
+
+    def inc(self, amount=1):
+        """Increments the gauge by ``amount``.
+        """
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """Decrements the gauge by ``amount``.
+        """
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        """Sets the gauge to ``value``.
+        """
+        self._value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        """Context manager incrementing the gauge while inside of it.
+        """
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    @property
+    def value(self):
+        """(float): The current value.
+        """
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (usually durations in seconds) on cumulative buckets.
+
+    Args:
+        name (str): Name of the metric
+        documentation (str, optional): Description of the metric. Defaults to ''.
+        buckets (tuple, optional): Sorted upper bounds of the buckets. Defaults to :obj:`DEFAULT_BUCKETS`.
+        labelnames (tuple, optional): Names of the labels of the metric. Defaults to ().
+    """
+    _type = 'histogram'
+
+    def __init__(self, name, documentation='', buckets=DEFAULT_BUCKETS, labelnames=()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, self.buckets)
+
+    def observe(self, value):
+        """Records ``value``.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """Context manager observing the amount of seconds spent inside of it.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        """Returns a consistent copy of the histogram.
+
+        Returns:
+            tuple: ``(cumulative_counts, sum, count)`` where ``cumulative_counts`` has one element per bucket plus ``+Inf``.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            _sum, count = self._sum, self._count
+
+        cumulative = []
+        total = 0
+        for value in counts:
+            total += value
+            cumulative.append(total)
+        return cumulative, _sum, count
+
+    def _child_samples(self):
+        cumulative, _sum, count = self.snapshot()
+        samples = [('_bucket', ('le', _format_value(bound)), value) for bound, value in zip(self.buckets + (math.inf,), cumulative)]
+        return samples + [('_sum', _sum), ('_count', count)]
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    return ','.join('{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def _get_or_create(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, *args, **kwargs)
+            _registry[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError('Metric "{}" already registered as {}'.format(name, type(metric).__name__))
+        return metric
+
+
+def counter(name: str, documentation: str = '', labelnames: tuple = ()) -> Counter:
+    """Returns the process wide :class:`Counter` named ``name``, creating it if needed.
+    """
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str = '', labelnames: tuple = ()) -> Gauge:
+    """Returns the process wide :class:`Gauge` named ``name``, creating it if needed.
+    """
+    return _get_or_create(Gauge, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str = '', buckets: tuple = DEFAULT_BUCKETS, labelnames: tuple = ()) -> Histogram:
+    """Returns the process wide :class:`Histogram` named ``name``, creating it if needed.
+    """
+    return _get_or_create(Histogram, name, documentation, buckets, labelnames)
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # Peak RSS (in KB on Linux) when /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+gauge('process_resident_memory_bytes', 'Resident memory size in bytes').set_function(_rss_bytes)
+gauge('process_threads', 'Amount of threads of the process').set_function(threading.active_count)
+
+
+def render() -> str:
+    """Renders all the registered metrics using the Prometheus text exposition format (version 0.0.4).
+
+    Returns:
+        str: The metrics.
+    """
+    with _registry_lock:
+        registered = sorted(_registry.values(), key=lambda metric: metric.name)
+
+    lines = []
+    for metric in registered:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+        lines.append('# TYPE {} {}'.format(metric.name, metric._type))
+        for labels, samples in metric._samples():
+            for sample in samples:
+                if len(sample) == 3:
+                    suffix, (extra_name, extra_value), value = sample
+                    extra = '{}="{}"'.format(extra_name, extra_value)
+                    sample_labels = '{},{}'.format(labels, extra) if labels else extra
+                else:
+                    suffix, value = sample
+                    sample_labels = labels
+                lines.append('{}{}{} {}'.format(metric.name, suffix, '{' + sample_labels + '}' if sample_labels else '', _format_value(value)))
+    return '\n'.join(lines) + '\n'
@@ -1,7 +1,27 @@
 from ._generic import wait_for_port, find_free_port
+from ._rpc import json_rpc, JSONRPCError
+from ._ready import Probe, tcp_probe, unix_probe, http_probe, rpc_probe, wait_ready
 from . import filters
 
 __all__ = [
     'wait_for_port',
-    'find_free_port'
+    'find_free_port',
+    'json_rpc',
+    'JSONRPCError',
+    'Probe',
+    'tcp_probe',
+    'unix_probe',
+    'http_probe',
+    'rpc_probe',
+    'wait_ready',
+    'socket_path',
+    'UnixAdapter'
 ]
+
+
+def __getattr__(name):
+    # The Unix domain socket helpers import requests and urllib3, they are only loaded when used
+    if name in ('socket_path', 'UnixAdapter'):
+        from . import _unix
+        return getattr(_unix, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
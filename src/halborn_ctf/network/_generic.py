@@ -2,6 +2,8 @@ import socket
 import logging
 import time
 
+from ._ready import wait_ready, tcp_probe
+
 _logger = logging.getLogger(__name__)
 
 __all__ = [
@@ -11,6 +13,8 @@ __all__ = [
 def wait_for_port(port: int, host: str = 'localhost', timeout: float = 5.0):
     """Wait until a port starts accepting TCP connections.
 
+    The port is checked with an exponential backoff (see :obj:`wait_ready` to wait for several endpoints at the same time).
+
     Args:
         port (int): The port to wait for
         host (str, optional): The host where the port should be waited for. Defaults to 'localhost'.
@@ -20,16 +24,11 @@ def wait_for_port(port: int, host: str = 'localhost', timeout: float = 5.0):
         TimeoutError: The port isn't accepting connection after time specified in ``timeout``.
     """
     _logger.info('Waiting for port on "{}:{}"'.format(host, port))
-    start_time = time.perf_counter()
-    while True:
-        try:
-            with socket.create_connection((host, port), timeout=timeout):
-                _logger.info('Port "{}" found'.format(port))
-                break
-        except OSError as ex:
-            time.sleep(0.01)
-            if time.perf_counter() - start_time >= timeout:
-                TimeoutError('Waited too long for port "{}" on host "{}" to start accepting connections.'.format(port, host))
+    try:
+        wait_ready(tcp_probe(port, host), timeout=timeout)
+    except TimeoutError:
+        raise TimeoutError('Waited too long for port "{}" on host "{}" to start accepting connections.'.format(port, host)) from None
+    _logger.info('Port "{}" found'.format(port))
 
 from contextlib import closing
 
@@ -0,0 +1,174 @@
+import logging
+import socket
+import threading
+import time
+
+from ._rpc import json_rpc, JSONRPCError
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'Probe',
+    'tcp_probe',
+    'unix_probe',
+    'http_probe',
+    'rpc_probe',
+    'wait_ready'
+]
+
+_INITIAL_DELAY = 0.01
+_MAX_DELAY = 0.25
+_ATTEMPT_TIMEOUT = 1.0
+
+
+def _backoff():
+    """Delays between readiness attempts: exponential starting at 10ms up to 0.25s.
+    """
+    delay = _INITIAL_DELAY
+    while True:
+        yield delay
+        delay = min(_MAX_DELAY, delay * 2)
+
+
+class Probe():
+    """A readiness check. Calling it executes a single attempt and returns if the endpoint is ready.
+
+    Probes can be used as the ``ready`` argument of :class:`halborn_ctf.services.Service` or waited for
+    with :obj:`wait_ready`.
+
+    Args:
+        name (str): Name of the endpoint used on the logs and reports.
+        check (Callable): Function executing a single attempt. It should return ``True`` or raise if not ready.
+    """
+    def __init__(self, name: str, check) -> None:
+        self.name = name
+        self._check = check
+
+    def __call__(self) -> bool:
+        try:
+            return bool(self._check())
+        # requests.RequestException is an OSError. Nodes answer with errors while starting (or forking)
+        except (OSError, ValueError, JSONRPCError) as e:
+            _logger.debug('Probe "{}" not ready: {}'.format(self.name, e))
+            return False
+
+    def __repr__(self) -> str:
+        return 'Probe({})'.format(self.name)
+
+
+def tcp_probe(port: int, host: str = 'localhost') -> Probe:
+    """Probe ready once the port accepts TCP connections.
+
+    Args:
+        port (int): The port to check
+        host (str, optional): The host of the port. Defaults to 'localhost'.
+    """
+    def check():
+        with socket.create_connection((host, port), timeout=_ATTEMPT_TIMEOUT):
+            return True
+    return Probe('tcp://{}:{}'.format(host, port), check)
+
+
+def unix_probe(path: str) -> Probe:
+    """Probe ready once the Unix domain socket accepts connections.
+
+    Args:
+        path (str): The path of the socket (see :obj:`socket_path`)
+    """
+    def check():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_ATTEMPT_TIMEOUT)
+            sock.connect(path)
+            return True
+    return Probe('unix://{}'.format(path), check)
+
+
+def http_probe(url: str, status: int = None) -> Probe:
+    """Probe ready once the URL answers a ``GET`` request.
+
+    Args:
+        url (str): The URL to request
+        status (int, optional): The expected status code. Defaults to None (any status lower than 500).
+    """
+    import requests
+
+    def check():
+        resp = requests.get(url, timeout=_ATTEMPT_TIMEOUT)
+        return resp.status_code == status if status is not None else resp.status_code < 500
+    return Probe(url, check)
+
+
+def rpc_probe(url: str = 'http://127.0.0.1:8545', method: str = 'eth_chainId', params: list = None) -> Probe:
+    """Probe ready once a JSON-RPC call succeeds. By default it checks that a chain node answers ``eth_chainId``.
+
+    Example:
+
+        .. code::
+
+            Service('anvil', 'anvil -p 8545', ready=network.rpc_probe('http://127.0.0.1:8545'))
+
+    Args:
+        url (str, optional): The JSON-RPC server URL. Defaults to 'http://127.0.0.1:8545'.
+        method (str, optional): The method to call. Defaults to 'eth_chainId'.
+        params (list, optional): The method parameters. Defaults to [].
+    """
+    def check():
+        json_rpc(url, method, params, timeout=_ATTEMPT_TIMEOUT)
+        return True
+    return Probe('{} {}'.format(url, method), check)
+
+
+def _wait(probe, deadline):
+    for delay in _backoff():
+        if probe():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+
+
+def wait_ready(*probes: Probe, timeout: float = 30.0) -> dict:
+    """Waits for all the probes at the same time, retrying each of them with an exponential backoff.
+
+    Example:
+
+        .. code::
+
+            shell.run('anvil -p 8545', background=True)
+            shell.run('python api.py', background=True)
+
+            network.wait_ready(network.rpc_probe('http://127.0.0.1:8545'), network.http_probe('http://127.0.0.1:9000/health'))
+
+    Args:
+        *probes (Probe): The probes to wait for.
+        timeout (float, optional): The amount in seconds to wait for all the probes. Defaults to 30.0.
+
+    Raises:
+        TimeoutError: Any of the probes isn't ready after the time specified in ``timeout``.
+
+    Returns:
+        dict: The amount of seconds each endpoint (by name) took to be ready.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    ready = {}
+
+    def worker(probe):
+        if _wait(probe, deadline):
+            ready[probe.name] = time.monotonic() - start
+            _logger.info('"{}" ready in {:.2f}s'.format(probe.name, ready[probe.name]))
+
+    threads = [threading.Thread(target=worker, args=(probe,), name='ready', daemon=True) for probe in probes[1:]]
+    for thread in threads:
+        thread.start()
+    # The first probe is checked on the calling thread
+    if probes:
+        worker(probes[0])
+    for thread in threads:
+        thread.join()
+
+    missing = [probe.name for probe in probes if probe.name not in ready]
+    if missing:
+        raise TimeoutError('Waited too long ({}s) for {} to be ready.'.format(timeout, ', '.join(missing)))
+    return ready
@@ -0,0 +1,63 @@
+import itertools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'json_rpc',
+    'JSONRPCError'
+]
+
+_ids = itertools.count(1)
+
+
+class JSONRPCError(Exception):
+    """Error returned by a JSON-RPC server.
+
+    Attributes:
+        code (int): The JSON-RPC error code
+        message (str): The JSON-RPC error message
+    """
+    def __init__(self, code, message) -> None:
+        super().__init__('JSON-RPC error {}: {}'.format(code, message))
+        self.code = code
+        self.message = message
+
+
+def json_rpc(url: str, method: str, params: list = None, *, timeout: float = 5.0, session: 'requests.Session' = None):
+    """Executes a JSON-RPC call and returns its result.
+
+    Example:
+        Reading the current block number from ``anvil``::
+
+            block = int(json_rpc('http://127.0.0.1:8545', 'eth_blockNumber'), 16)
+
+    Args:
+        url (str): The JSON-RPC server URL
+        method (str): The method to call
+        params (list, optional): The method parameters. Defaults to [].
+        timeout (float, optional): The amount of seconds to wait for the response. Defaults to 5.0.
+        session (requests.Session, optional): Session used to reuse connections between calls. Defaults to None.
+
+    Raises:
+        JSONRPCError: If the server returns an error.
+        requests.RequestException: If the server can not be reached.
+
+    Returns:
+        Any: The ``result`` of the call
+    """
+    # requests is only imported when a call is made
+    import requests
+
+    payload = {
+        'jsonrpc': '2.0',
+        'id': next(_ids),
+        'method': method,
+        'params': params if params is not None else []
+    }
+    resp = (session or requests).post(url, json=payload, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get('error'):
+        raise JSONRPCError(data['error'].get('code'), data['error'].get('message'))
+    return data.get('result')
@@ -0,0 +1,116 @@
+import logging
+import os
+import socket
+import tempfile
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'socket_path',
+    'UnixAdapter'
+]
+
+_lock = threading.Lock()
+_run_dir = None
+
+
+def socket_path(name: str) -> str:
+    """Returns the path of a Unix domain socket that a local service can listen on.
+
+    Sockets are created on a private directory of the challenge process (``HALBORN_CTF_RUN_DIR`` if set) so several
+    instances can start at the same time without racing for free ports. Any stale socket with the same name is removed.
+
+    Example:
+        Exposing a ``gunicorn`` API through a Unix domain socket::
+
+            API_SOCKET = network.socket_path('api')
+
+            PATH_MAPPING = {
+                '/api/<path:path>': {
+                    'socket': API_SOCKET,
+                    'methods': ['GET', 'POST']
+                }
+            }
+
+            def run(self):
+                shell.run('gunicorn --bind unix:{} api:app'.format(API_SOCKET), background=True)
+
+    Args:
+        name (str): Name of the socket (unique on the challenge).
+
+    Returns:
+        str: The path of the socket.
+    """
+    global _run_dir
+    with _lock:
+        if _run_dir is None:
+            _run_dir = os.environ.get('HALBORN_CTF_RUN_DIR') or tempfile.mkdtemp(prefix='halborn_ctf-')
+            os.makedirs(_run_dir, exist_ok=True)
+
+    path = os.path.join(_run_dir, '{}.sock'.format(name))
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    return path
+
+
+class _UnixConnection(HTTPConnection):
+    def __init__(self, socket_path, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout not in (None, socket._GLOBAL_DEFAULT_TIMEOUT):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class _UnixConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _UnixConnection
+
+    def __init__(self, socket_path, **kwargs) -> None:
+        super().__init__('localhost', **kwargs)
+        self.conn_kw['socket_path'] = socket_path
+
+
+class UnixAdapter(HTTPAdapter):
+    """``requests`` transport adapter sending all the requests to a Unix domain socket. The host of the URL is ignored.
+
+    Example:
+
+        .. code::
+
+            session = requests.Session()
+            session.mount('http://', UnixAdapter(network.socket_path('api')))
+            session.get('http://localhost/health')
+
+    Args:
+        socket_path (str): Path of the Unix domain socket.
+        pool_maxsize (int, optional): Maximum amount of connections kept open. Defaults to 10.
+    """
+    def __init__(self, socket_path: str, pool_maxsize: int = 10) -> None:
+        self._socket_path = socket_path
+        self._pool = _UnixConnectionPool(socket_path, maxsize=pool_maxsize)
+        super().__init__(pool_maxsize=pool_maxsize)
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def close(self):
+        super().close()
+        self._pool.close()
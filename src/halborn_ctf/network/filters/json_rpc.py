@@ -1,8 +1,10 @@
-from ._json_rpc import whitelist_json_rpc_method
-from ._json_rpc import filter_json_rpc_method
+import os
 
 from  ._utils import generic_filter
 
+# The filter scripts are executed by mitmdump, referencing them by path avoids importing mitmproxy on the challenge process
+_SCRIPTS = os.path.join(os.path.dirname(__file__), '_json_rpc')
+
 def whitelist_methods(methods=[]):
     """Proxy filter that allows whitelisting JSON RPC methods
 
@@ -29,7 +31,7 @@ def whitelist_methods(methods=[]):
         methods (list, optional): A list of methods to whitelist. Each element of the 
             list does support regex expressions to match multiple patterns. Example: ``["eth_.*"]``. Defaults to [].
     """
-    return generic_filter(whitelist_json_rpc_method.__file__, **locals())
+    return generic_filter(os.path.join(_SCRIPTS, 'whitelist_json_rpc_method.py'), **locals())
 
 def filter_methods(methods=[]):
     """Proxy filter that allows filtering JSON RPC method
@@ -57,7 +59,7 @@ def filter_methods(methods=[]):
         methods (list, optional): A list of methods to filter. Each element of the 
             list does support regex expressions to match multiple patterns. Example: ``["evm_.*"]``. Defaults to [].
     """
-    return generic_filter(filter_json_rpc_method.__file__, **locals())
+    return generic_filter(os.path.join(_SCRIPTS, 'filter_json_rpc_method.py'), **locals())
 
 __all__ = [
     'whitelist_methods',
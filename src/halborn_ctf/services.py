@@ -0,0 +1,545 @@
+"""Supervision of the background services of a challenge (chains, APIs, helpers...).
+
+Instead of starting services with :obj:`halborn_ctf.shell.run` and ``background=True``, services can be declared
+with :class:`Service` and started through the challenge :obj:`halborn_ctf.templates.GenericChallenge.services` supervisor.
+The supervisor waits for each service to be ready, restarts it if it crashes and stops every service (in the reverse
+dependency order) when the challenge exits.
+
+Services and setup steps (:class:`Step`) form a startup graph: independent nodes start at the same time on a pool of
+worker threads, so the challenge is ready in the time of its longest dependency chain instead of the sum of all of them.
+
+Example:
+
+    .. code::
+
+        from halborn_ctf.services import Service, Step
+
+        def run(self):
+            self.services.start(
+                Service('anvil', 'anvil -p 8545', ready=8545),
+                Service('redis', 'redis-server', ready=6379),
+                Step('deploy', self.deploy, depends_on=['anvil']),
+                Service('api', 'python api.py', ready=9000, depends_on=['deploy', 'redis'], restart='always'),
+            )
+"""
+import contextvars
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Union
+
+from . import shell
+from .network import wait_for_port
+from .network._ready import _backoff
+
+_logger = logging.getLogger(__name__)
+
+__all__ = [
+    'Service',
+    'Step',
+    'Supervisor',
+    'terminate',
+    'terminate_group'
+]
+
+_RESTART_POLICIES = ('never', 'on-failure', 'always')
+_SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGKILL)
+_MONITOR_INTERVAL = 0.2
+_MAX_BACKOFF = 30.0
+_STARTUP_WORKERS = 8
+_STABLE_TIME = 10.0
+
+
+def _signal(proc, sig, group):
+    try:
+        if group:
+            os.killpg(proc.pid, sig)
+        else:
+            proc.send_signal(sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _alive(proc, group):
+    if proc.poll() is None:
+        return True
+    if not group:
+        return False
+    # The shell may have exited while other processes of its group are still running
+    try:
+        os.killpg(proc.pid, 0)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+def terminate(procs: list, timeout: float = 5.0, group: bool = False):
+    """Stops the processes escalating from ``SIGINT`` to ``SIGTERM`` and ``SIGKILL``. After each signal, the processes are
+    given up to ``timeout`` seconds to exit before sending the next one.
+
+    Args:
+        procs (list[subprocess.Popen]): The processes to stop. They are signaled at the same time.
+        timeout (float, optional): Seconds to wait after each signal. Defaults to 5.0.
+        group (bool, optional): Signal the whole process group of each process (processes started with
+            ``start_new_session=True``). Defaults to False.
+    """
+    alive = [proc for proc in procs if _alive(proc, group)]
+    for sig in _SHUTDOWN_SIGNALS:
+        if not alive:
+            return
+        if sig != signal.SIGINT:
+            _logger.warning('Processes {} did not exit, sending {}'.format([proc.pid for proc in alive], sig.name))
+        for proc in alive:
+            _signal(proc, sig, group)
+
+        deadline = time.monotonic() + timeout
+        while alive and time.monotonic() < deadline:
+            alive = [proc for proc in alive if _alive(proc, group)]
+            if alive:
+                time.sleep(0.02)
+
+
+def _group_members():
+    """PIDs of the processes on the current process group (except the current process). Only available on Linux.
+    """
+    pgid = os.getpgid(0)
+    members = []
+    try:
+        pids = [int(pid) for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return members
+
+    for pid in pids:
+        if pid == os.getpid():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                # The command name is between parenthesis and can contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        # fields[0] is the state and fields[2] the process group
+        if fields[0] != 'Z' and int(fields[2]) == pgid:
+            members.append(pid)
+    return members
+
+
+def terminate_group(timeout: float = 5.0):
+    """Stops every other process on the current process group escalating from ``SIGINT`` to ``SIGTERM`` and ``SIGKILL``.
+
+    Note:
+        The current process must ignore ``SIGINT`` while calling this function (it is also sent the signal).
+
+    Args:
+        timeout (float, optional): Seconds to wait after each signal. Defaults to 5.0.
+    """
+    os.killpg(0, signal.SIGINT)
+
+    for sig in _SHUTDOWN_SIGNALS[1:]:
+        deadline = time.monotonic() + timeout
+        members = _group_members()
+        while members and time.monotonic() < deadline:
+            time.sleep(0.02)
+            members = _group_members()
+        if not members:
+            return
+
+        _logger.warning('Processes {} did not exit, sending {}'.format(members, sig.name))
+        for pid in members:
+            try:
+                os.kill(pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+
+class _Node():
+    """Common readiness handling of the nodes of the startup graph (:class:`Service` and :class:`Step`).
+    """
+    def __init__(self, name, ready, ready_timeout, depends_on) -> None:
+        self.name = name
+        self.ready = ready
+        self.ready_timeout = ready_timeout
+        self.depends_on = list(depends_on)
+
+        self.status = 'stopped'
+        self.started_at = None
+        self.ready_at = None
+
+    def _exited(self):
+        return None
+
+    def _wait_ready(self):
+        if self.ready is None:
+            pass
+        elif isinstance(self.ready, int):
+            wait_for_port(self.ready, timeout=self.ready_timeout)
+        else:
+            deadline = time.monotonic() + self.ready_timeout
+            for delay in _backoff():
+                if self.ready():
+                    break
+                returncode = self._exited()
+                if returncode is not None:
+                    raise RuntimeError('Service "{}" exited with code {} before being ready'.format(self.name, returncode))
+                if time.monotonic() >= deadline:
+                    raise TimeoutError('Service "{}" not ready after {}s'.format(self.name, self.ready_timeout))
+                time.sleep(delay)
+        self.status = 'ready'
+        self.ready_at = time.monotonic()
+
+
+class Service(_Node):
+    """A background service managed by a :class:`Supervisor`.
+
+    Args:
+        name (str): Unique name of the service. It is also used to tag its output on the logs.
+        cmd (str): The command to execute. Refer to :obj:`halborn_ctf.shell.run`.
+        ready (Union[int, Callable], optional): Readiness probe. Either a port that should accept connections or a function
+            returning ``True`` once the service is ready, such as :obj:`halborn_ctf.network.rpc_probe`. Defaults to None (ready
+            as soon as it starts).
+        ready_timeout (float, optional): Seconds to wait for the service to be ready. Defaults to 30.0.
+        restart (str, optional): Restart policy, one of ``'never'``, ``'on-failure'`` (non zero exit code) or ``'always'``. Defaults to ``'on-failure'``.
+        max_restarts (int, optional): Maximum consecutive restarts before giving up. Defaults to 5.
+        shutdown_timeout (float, optional): Seconds to wait after each shutdown signal before escalating. Defaults to 5.0.
+        depends_on (list[str], optional): Names of the services or steps that must be ready before this one starts. Defaults to [].
+        **kwargs: Extra arguments for :class:`subprocess.Popen` (for example ``env`` or ``cwd``).
+    """
+    def __init__(self, name: str, cmd: str, *, ready: Union[int, Callable] = None, ready_timeout: float = 30.0,
+                 restart: str = 'on-failure', max_restarts: int = 5, shutdown_timeout: float = 5.0,
+                 depends_on: list = [], **kwargs) -> None:
+        if restart not in _RESTART_POLICIES:
+            raise ValueError('Restart policy must be one of {}'.format(_RESTART_POLICIES))
+
+        super().__init__(name, ready, ready_timeout, depends_on)
+
+        self.cmd = cmd
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.shutdown_timeout = shutdown_timeout
+        self.kwargs = kwargs
+
+        self.proc = None
+        """ (subprocess.Popen): The running process of the service.
+        """
+        self.restarts = 0
+        """ (int): Amount of consecutive restarts. It is reset once the service runs for 10 seconds without exiting.
+        """
+        self.status = 'stopped'
+        """ (str): One of ``stopped``, ``starting``, ``ready``, ``restarting`` or ``failed``.
+        """
+        # When to start the service again while ``restarting`` and the readiness check of the last restart
+        self._restart_at = None
+        self._checking = None
+
+    def _config(self):
+        return (self.cmd, self.ready if isinstance(self.ready, int) else None, self.restart, repr(sorted(self.kwargs.items())))
+
+    def _start(self):
+        self.status = 'starting'
+        self.started_at = time.monotonic()
+        self.proc, _, _ = shell.run(self.cmd, background=True, name=self.name, start_new_session=True, **self.kwargs)
+
+    def _exited(self):
+        return self.proc.poll()
+
+    def _should_restart(self):
+        if self.restart == 'always':
+            return True
+        return self.restart == 'on-failure' and self.proc.returncode != 0
+
+
+class Step(_Node):
+    """A setup function (deploying contracts, seeding a database...) executed once as part of the startup graph of a
+    :class:`Supervisor`.
+
+    Example:
+
+        .. code::
+
+            self.services.start(
+                Service('anvil', 'anvil -p 8545', ready=8545),
+                Step('deploy', self.deploy, depends_on=['anvil']),
+                Service('api', 'python api.py', ready=9000, depends_on=['deploy']),
+            )
+
+    Args:
+        name (str): Unique name of the step.
+        function (Callable): The function to execute.
+        ready (Union[int, Callable], optional): Readiness probe checked after ``function`` returns. Refer to :class:`Service`.
+            Defaults to None.
+        ready_timeout (float, optional): Seconds to wait for the step to be ready. Defaults to 30.0.
+        depends_on (list[str], optional): Names of the services or steps that must be ready before this one starts. Defaults to [].
+    """
+    def __init__(self, name: str, function: Callable, *, ready: Union[int, Callable] = None, ready_timeout: float = 30.0,
+                 depends_on: list = []) -> None:
+        super().__init__(name, ready, ready_timeout, depends_on)
+        self.function = function
+        self.result = None
+        """ (Any): The value returned by ``function``.
+        """
+        self.status = 'stopped'
+        """ (str): One of ``stopped``, ``running``, ``ready`` or ``failed``.
+        """
+
+    def _start(self):
+        self.status = 'running'
+        self.started_at = time.monotonic()
+        self.result = self.function()
+
+
+class Supervisor():
+    """Starts, monitors and stops :class:`Service` objects and runs the startup :class:`Step` functions.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._services = {}
+        self._stopping = False
+        self._monitor = None
+        self._reloading = None
+        # Readiness checks of the restarted services, the monitor keeps watching the others meanwhile
+        self._checks = ThreadPoolExecutor(max_workers=_STARTUP_WORKERS, thread_name_prefix='supervisor-ready')
+
+    def __getitem__(self, name) -> Service:
+        return self._services[name]
+
+    def _order(self, services):
+        """Topological order of ``services`` (dependencies first).
+        """
+        ordered = []
+        visiting = set()
+
+        def visit(service):
+            if service in ordered:
+                return
+            if service.name in visiting:
+                raise ValueError('Circular dependency on service "{}"'.format(service.name))
+            visiting.add(service.name)
+            for dependency in service.depends_on:
+                if dependency not in self._services:
+                    raise ValueError('Service "{}" depends on unknown service "{}"'.format(service.name, dependency))
+                visit(self._services[dependency])
+            visiting.discard(service.name)
+            ordered.append(service)
+
+        for service in services:
+            visit(service)
+        return ordered
+
+    def start(self, *nodes: _Node):
+        """Starts the services and steps as soon as their dependencies are ready, running independent ones at the same
+        time. It returns once all of them are ready and logs the critical path of the startup (the chain of nodes that
+        determined its duration).
+
+        Args:
+            *nodes (Union[Service, Step]): The services and steps to start. Dependencies must be added before or on the same call.
+
+        Raises:
+            TimeoutError: If a node is not ready on time.
+            RuntimeError: If a service exits before being ready.
+            Exception: Any exception raised by a step. Nodes not started yet are left stopped.
+        """
+        with self._lock:
+            for node in nodes:
+                if node.name in self._services:
+                    if self._reloading is None or node.name not in self._reloading:
+                        raise ValueError('Service "{}" already exists'.format(node.name))
+                    self._reloading.discard(node.name)
+                    if self._reuse(self._services[node.name], node):
+                        continue
+                self._services[node.name] = node
+
+            # Reused services are already ready
+            pending = [node for node in self._order([self._services[node.name] for node in nodes]) if node.status == 'stopped']
+
+        names = {node.name for node in pending}
+        started = time.monotonic()
+        error = None
+
+        with ThreadPoolExecutor(max_workers=_STARTUP_WORKERS, thread_name_prefix='startup') as executor:
+            running = {}
+            while (pending and error is None) or running:
+                if error is None:
+                    for node in list(pending):
+                        if all(dependency not in names or self._services[dependency].status == 'ready' for dependency in node.depends_on):
+                            pending.remove(node)
+                            # The nodes run with the context of the caller (processes tracked by an instance)
+                            running[executor.submit(contextvars.copy_context().run, self._start_node, node)] = node
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    node = running.pop(future)
+                    if future.exception() is not None:
+                        node.status = 'failed'
+                        error = error or future.exception()
+
+        if error is not None:
+            raise error
+
+        if names:
+            self._log_critical_path(names, started)
+
+        with self._lock:
+            if self._monitor is None:
+                # Restarted processes are started with the context of the caller too
+                self._monitor = threading.Thread(target=contextvars.copy_context().run, args=(self._monitor_loop,),
+                                                 name='supervisor', daemon=True)
+                self._monitor.start()
+
+    def _reuse(self, existing, node):
+        """Keeps the running ``existing`` service if ``node`` declares it with the same configuration. Otherwise
+        ``existing`` is stopped to be replaced.
+        """
+        if isinstance(existing, Service) and isinstance(node, Service) and existing._config() == node._config() and \
+                existing.status == 'ready' and existing.proc.poll() is None:
+            _logger.info('Keeping service "{}"'.format(existing.name))
+            return True
+
+        if isinstance(existing, Service) and existing.proc:
+            existing.status = 'stopped'
+            terminate([existing.proc], timeout=existing.shutdown_timeout, group=True)
+        return False
+
+    def _begin_reload(self):
+        """Allows the current services and steps to be declared again (hot reload of the challenge). Services declared
+        with the same configuration keep running.
+        """
+        with self._lock:
+            self._reloading = set(self._services)
+
+    def _end_reload(self):
+        """Stops the services that were not declared again since :obj:`_begin_reload` and forgets the steps.
+        """
+        with self._lock:
+            removed = [self._services.pop(name) for name in self._reloading]
+            self._reloading = None
+
+        services = [node for node in removed if isinstance(node, Service) and node.proc]
+        for service in services:
+            service.status = 'stopped'
+        terminate([service.proc for service in services], timeout=max((service.shutdown_timeout for service in services), default=0), group=True)
+
+    def _start_node(self, node):
+        _logger.info('Starting "{}"'.format(node.name))
+        node._start()
+        node._wait_ready()
+        _logger.debug('"{}" ready in {:.2f}s'.format(node.name, node.ready_at - node.started_at))
+
+    def _log_critical_path(self, names, started):
+        nodes = [self._services[name] for name in names]
+        node = max(nodes, key=lambda node: node.ready_at)
+
+        path = []
+        while node:
+            path.append(node)
+            # The dependency that was ready the latest is the one that delayed the node
+            dependencies = [self._services[dependency] for dependency in node.depends_on if dependency in names]
+            node = max(dependencies, key=lambda node: node.ready_at, default=None)
+
+        _logger.info('Startup ready in {:.2f}s. Critical path: {}'.format(
+            path[0].ready_at - started,
+            ' -> '.join('{} ({:.2f}s)'.format(node.name, node.ready_at - node.started_at) for node in reversed(path))))
+
+    @property
+    def status(self):
+        """(dict): The status of each service.
+        """
+        return {name: service.status for name, service in self._services.items()}
+
+    def _schedule_restart(self, service):
+        """Sets ``service`` as ``restarting`` after an exponential backoff, or ``failed`` after ``max_restarts``.
+        """
+        if service.restarts >= service.max_restarts:
+            service.status = 'failed'
+            return
+        service.restarts += 1
+        service.status = 'restarting'
+        service._restart_at = time.monotonic() + min(_MAX_BACKOFF, 0.5 * 2 ** (service.restarts - 1))
+
+    def _restart(self, service):
+        _logger.warning('Restarting service "{}" ({}/{})'.format(service.name, service.restarts, service.max_restarts))
+        with self._lock:
+            if self._stopping:
+                return
+            try:
+                service._start()
+            except Exception as e:
+                _logger.error('Service "{}" failed to restart: {}'.format(service.name, e))
+                self._schedule_restart(service)
+                return
+            service._checking = self._checks.submit(self._check_restarted, service)
+
+    def _check_restarted(self, service):
+        """Waits for a restarted service to be ready. If it is not, it is stopped and restarted again.
+        """
+        try:
+            service._wait_ready()
+        except Exception as e:
+            if self._stopping:
+                return
+            _logger.error('Service "{}" failed to restart: {}'.format(service.name, e))
+            terminate([service.proc], timeout=service.shutdown_timeout, group=True)
+            with self._lock:
+                if not self._stopping:
+                    self._schedule_restart(service)
+
+    def _monitor_loop(self):
+        while not self._stopping:
+            time.sleep(_MONITOR_INTERVAL)
+            with self._lock:
+                services = [service for service in self._services.values() if isinstance(service, Service)]
+
+            for service in services:
+                if self._stopping:
+                    return
+
+                # Restarts are scheduled by deadline so a backoff does not delay the other services
+                if service.status == 'restarting':
+                    if time.monotonic() >= service._restart_at:
+                        self._restart(service)
+                    continue
+
+                if service.status not in ('starting', 'ready') or service.proc.poll() is None:
+                    continue
+                if service._checking is not None and not service._checking.done():
+                    # Handled by the readiness check of the restart
+                    continue
+
+                _logger.error('Service "{}" exited with code {}. Last output:\n{}'.format(
+                    service.name, service.proc.returncode, '\n'.join(shell.recent_output(service.proc)[-20:])))
+
+                if time.monotonic() - service.started_at >= _STABLE_TIME:
+                    service.restarts = 0
+
+                with self._lock:
+                    if self._stopping:
+                        return
+                    if not service._should_restart():
+                        service.status = 'failed'
+                    else:
+                        self._schedule_restart(service)
+
+    def stop(self):
+        """Stops all services in reverse dependency order. Services on the same dependency level are stopped at the same time
+        escalating from ``SIGINT`` to ``SIGTERM`` and ``SIGKILL`` (see :obj:`terminate`).
+        """
+        with self._lock:
+            self._stopping = True
+
+            # Group services by dependency depth so independent services stop together
+            depth = {}
+            for service in self._order(self._services.values()):
+                depth[service.name] = 1 + max((depth[dependency] for dependency in service.depends_on), default=-1)
+
+            for level in sorted(set(depth.values()), reverse=True):
+                services = [self._services[name] for name, _depth in depth.items() if _depth == level]
+                services = [service for service in services if isinstance(service, Service)]
+                procs = [service.proc for service in services if service.proc]
+                terminate(procs, timeout=max((service.shutdown_timeout for service in services), default=0), group=True)
+                for service in services:
+                    service.status = 'stopped'
+
+        self._checks.shutdown(wait=False, cancel_futures=True)
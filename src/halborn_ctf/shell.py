@@ -1,10 +1,259 @@
 import subprocess
 import logging
 import threading
+import os
+import contextlib
+import contextvars
+import selectors
+import tempfile
+import weakref
+from collections import deque
 
 _logger = logging.getLogger(__name__)
+# The output of the commands has its own logger so it can be filtered or rate limited
+_output_logger = logging.getLogger(__name__ + '.output')
 
-def run(cmd: str, *, background=False, capture_output=False, **kwargs):
+_HISTORY_LINES = 200
+_READ_SIZE = 65536
+# Output without new lines is emitted once its partial line reaches this size
+_MAX_LINE = 65536
+
+
+_CAPTURE_MODES = ('headtail', 'file')
+
+# List receiving the processes started on the current context (see :obj:`_track`)
+_tracked = contextvars.ContextVar('halborn_ctf_shell_tracked', default=None)
+
+
+@contextlib.contextmanager
+def _track(procs):
+    """Appends every process started with :obj:`run` or :obj:`stream` within the context (and the threads started with
+    a copy of it) to ``procs``. Each process is started on its own session so its whole tree can be signaled.
+    """
+    token = _tracked.set(procs)
+    try:
+        yield procs
+    finally:
+        _tracked.reset(token)
+
+
+def _popen(**kwargs):
+    procs = _tracked.get()
+    if procs is not None:
+        kwargs.setdefault('start_new_session', True)
+    proc = subprocess.Popen(**kwargs)
+    if procs is not None:
+        procs.append(proc)
+    return proc
+
+
+class _CaptureBuffer():
+    """Stores captured output with an optional memory limit.
+
+    Args:
+        limit (int, optional): Maximum amount of bytes kept in memory. Defaults to None (unlimited).
+        mode (str, optional): What to do once the limit is reached. ``'headtail'`` keeps the first and last ``limit / 2``
+            bytes. ``'file'`` moves the output to a temporary file. Defaults to 'headtail'.
+    """
+    def __init__(self, limit=None, mode='headtail') -> None:
+        self._limit = limit
+        self._mode = mode
+        self._head = bytearray()
+        self._tail = deque()
+        self._tail_size = 0
+        self._truncated = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=limit) if limit and mode == 'file' else None
+
+    def write(self, data):
+        if self._file:
+            self._file.write(data)
+            return
+
+        if self._limit is None:
+            self._head += data
+            return
+
+        half = self._limit // 2
+        if len(self._head) < half:
+            taken = half - len(self._head)
+            self._head += data[:taken]
+            data = data[taken:]
+
+        if data:
+            self._tail.append(data)
+            self._tail_size += len(data)
+            while self._tail_size > half:
+                first = self._tail.popleft()
+                excess = min(len(first), self._tail_size - half)
+                if excess < len(first):
+                    self._tail.appendleft(first[excess:])
+                self._truncated += excess
+                self._tail_size -= excess
+
+    def result(self):
+        """Returns the captured output as a decoded string or, in ``'file'`` mode, a binary file object positioned at the start.
+        """
+        if self._file:
+            self._file.seek(0)
+            return self._file
+
+        data = bytes(self._head)
+        if self._truncated:
+            data += '\n... [{} bytes truncated] ...\n'.format(self._truncated).encode()
+        data += b''.join(self._tail)
+        return data.rstrip().decode('utf-8', errors='replace')
+
+
+class _Stream():
+    def __init__(self, fd, name, log, history, capture=None) -> None:
+        self.fd = fd
+        self.name = name
+        self.log = log
+        self.history = history
+        self.capture = capture
+        self.buffer = bytearray()
+        self.done = threading.Event()
+
+    def emit(self, line):
+        text = line.rstrip().decode('utf-8', errors='replace')
+        self.history.append(text)
+        self.log('[%s] %s', self.name, text)
+
+    def feed(self, data):
+        if self.capture:
+            self.capture.write(data)
+            return
+
+        self.buffer += data
+        *lines, rest = self.buffer.split(b'\n')
+        for line in lines:
+            self.emit(line)
+        if len(rest) >= _MAX_LINE:
+            self.emit(rest)
+            rest = b''
+        self.buffer = bytearray(rest)
+
+    def close(self):
+        if self.buffer:
+            self.emit(bytes(self.buffer))
+
+
+class _OutputPump():
+    """Single thread draining the output pipes of every child process.
+
+    Pipes are set as non-blocking and watched with a selector (epoll on Linux). Output is split on lines,
+    logged with the process name and kept on a bounded history per process (see :obj:`recent_output`).
+    """
+    def __init__(self) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self.history = weakref.WeakKeyDictionary()
+
+    def register(self, proc, name, captures=(None, None)):
+        """Starts draining ``proc`` stdout and stderr.
+
+        Args:
+            proc (subprocess.Popen): The process to drain
+            name (str): Name used to tag the output
+            captures (tuple, optional): A :class:`_CaptureBuffer` for stdout and stderr to store the output
+                instead of logging it. Defaults to (None, None).
+
+        Returns:
+            list[threading.Event]: Events set once each of the pipes is closed.
+        """
+        history = deque(maxlen=_HISTORY_LINES)
+        self.history[proc] = history
+
+        streams = []
+        for pipe, log, capture in zip((proc.stdout, proc.stderr), (_output_logger.info, _output_logger.error), captures):
+            fd = os.dup(pipe.fileno())
+            pipe.close()
+            os.set_blocking(fd, False)
+            streams.append(_Stream(fd, name, log, history, capture))
+
+        with self._lock:
+            self._pending.extend(streams)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='shell-output', daemon=True)
+                self._thread.start()
+        self._wakeup()
+
+        return [stream.done for stream in streams]
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for stream in pending:
+                self._selector.register(stream.fd, selectors.EVENT_READ, stream)
+
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    try:
+                        while os.read(self._wakeup_r, _READ_SIZE):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                # The thread drains every process, an error (capture, logging handler...) only drops its stream
+                try:
+                    self._read(key.data)
+                except Exception:
+                    _logger.exception('Stopped reading the output of "{}"'.format(key.data.name))
+                    self._unregister(key.data)
+
+    def _read(self, stream):
+        try:
+            data = os.read(stream.fd, _READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            stream.close()
+            self._unregister(stream)
+            return
+
+        stream.feed(data)
+
+    def _unregister(self, stream):
+        try:
+            self._selector.unregister(stream.fd)
+        except KeyError:
+            return
+        os.close(stream.fd)
+        stream.done.set()
+
+
+_pump = _OutputPump()
+
+
+def recent_output(proc: subprocess.Popen) -> list:
+    """Returns the last lines (up to 200) written to stdout and stderr by a process started with :obj:`run`
+    without ``capture_output``. Useful to diagnose why a background service stopped.
+
+    Args:
+        proc (subprocess.Popen): The process returned by :obj:`run`
+
+    Returns:
+        list[str]: The lines, oldest first.
+    """
+    return list(_pump.history.get(proc, []))
+
+def run(cmd: str, *, background=False, capture_output=False, capture_limit=None, capture_mode='headtail', name=None, **kwargs):
     """This is a function used to execute a given ``cmd`` on as a subprocess on a shell.
 
     An exam
@@ -17,6 +266,10 @@ def run(cmd: str, *, background=False, capture_output=False, **kwargs):
             print(stdout)
             print(stderr)
 
+        Example of building with a verbose output keeping only the first and last 64KB of each stream::
+
+            process, stdout, stderr = run("forge build", capture_output=True, capture_limit=64 * 1024)
+
         Example of installing ``forge`` in the ``/usr`` directory::
 
             run('curl -L https://foundry.paradigm.xyz | bash', env={"FOUNDRY_DIR": '/usr'})
@@ -38,6 +291,12 @@ def run(cmd: str, *, background=False, capture_output=False, **kwargs):
             execution to finish. Defaults to False.
         capture_output (bool, optional): If set it will capture the command output and return it from the function
             as a decoded string. This flag can not be set at the same time as ``background``. Defaults to False.
+        capture_limit (int, optional): Maximum amount of bytes of each stream kept in memory when using ``capture_output``.
+            Defaults to None (unlimited).
+        capture_mode (str, optional): What to do with the output exceeding ``capture_limit``. ``'headtail'`` keeps only
+            the first and last ``capture_limit / 2`` bytes. ``'file'`` stores it on a temporary file and returns the
+            file objects instead of strings. Defaults to ``'headtail'``.
+        name (str, optional): The name used to tag the process output on the logs. Defaults to the executed program name.
 
     Raises:
         ValueError: If both ``background`` and ``capture_output`` are set this error is raised.
@@ -51,15 +310,20 @@ def run(cmd: str, *, background=False, capture_output=False, **kwargs):
         - process: (:class:`subprocess.Popen`)
             The process opened, you can use all methods of the ``popen-objects``.
         - stdout: (str or None)
-            A decoded string of the ``stdout`` of the executed process. Only if ``capture_output`` is set to ``True``. Otherwise ``None`` is returned
+            A decoded string of the ``stdout`` of the executed process. Only if ``capture_output`` is set to ``True``. Otherwise ``None`` is returned.
+            A binary file object if ``capture_mode`` is ``'file'``.
         - stderr: (str or None)
-            A decoded string of the ``stderr`` of the executed process. Only if ``capture_output`` is set to ``True``. Otherwise ``None`` is returned
+            A decoded string of the ``stderr`` of the executed process. Only if ``capture_output`` is set to ``True``. Otherwise ``None`` is returned.
+            A binary file object if ``capture_mode`` is ``'file'``.
     """
 
 
     if background and capture_output:
         raise ValueError("Not possible to run process on the background and capture output")
 
+    if capture_mode not in _CAPTURE_MODES:
+        raise ValueError("Capture mode must be one of {}".format(_CAPTURE_MODES))
+
     _invalid_kwargs = ['shell', 'args', 'stdout', 'stderr']
     for _tag in _invalid_kwargs:
         if _tag in kwargs:
@@ -67,11 +331,7 @@ def run(cmd: str, *, background=False, capture_output=False, **kwargs):
 
     _logger.info('Running CMD "{}" (background: {})'.format(cmd, background))
 
-    def shell_run_pipe(pipe, log):
-        for line in pipe:
-            log(line.rstrip().decode("utf-8"))
-
-    proc = subprocess.Popen(
+    proc = _popen(
         args=cmd,
         shell=True,
         stdout=subprocess.PIPE,
@@ -79,22 +339,76 @@ def run(cmd: str, *, background=False, capture_output=False, **kwargs):
         **kwargs
     )
 
-    # If we don't capture the output, we will have 2 threads printing
-    # stdout and stderr
-    if not capture_output:
-        out_thread = threading.Thread(target=shell_run_pipe, args=(proc.stdout, _logger.info), daemon=True)
-        err_thread = threading.Thread(target=shell_run_pipe, args=(proc.stderr, _logger.error), daemon=True)
-        out_thread.start()
-        err_thread.start()
+    if name is None:
+        name = os.path.basename(cmd.split(maxsplit=1)[0]) if cmd.strip() else 'sh'
+
+    # A single shared thread drains stdout and stderr, logging them or storing them if captured. As the
+    # pipes are drained while the process runs, it can never block on a full pipe
+    captures = (None, None)
+    if capture_output:
+        captures = (_CaptureBuffer(capture_limit, capture_mode), _CaptureBuffer(capture_limit, capture_mode))
+    pipes_done = _pump.register(proc, name, captures)
 
     # If its a background process, return process
     if background:
         return proc, None, None
     else:
-        # If its not a background process, we always wait for the process to finish
-        # If we capture the output, return it. Otherwise, wait for pipe threads
+        # If its not a background process, we always wait for the process and its output to finish
         proc.wait()
+        for done in pipes_done:
+            done.wait()
         if not capture_output:
-            out_thread.join()
-            err_thread.join()
-        return (proc, proc.stdout.read().rstrip().decode("utf-8"), proc.stderr.read().rstrip().decode("utf-8"))
\ No newline at end of file
+            return (proc, None, None)
+        return (proc, captures[0].result(), captures[1].result())
+
+
+def stream(cmd: str, **kwargs):
+    """Executes ``cmd`` like :obj:`run` and allows iterating over its output lines while it runs (``stderr`` is merged into ``stdout``).
+    The output is not logged nor stored so the memory used is constant.
+
+    Example:
+        Showing the progress of a long build::
+
+            process, lines = stream("forge build")
+            for line in lines:
+                print(line)
+
+            print(process.returncode)
+
+    Args:
+        cmd (str): The command to be executed. Refer to :obj:`run`.
+
+    Raises:
+        AttributeError: If any argument that is internally used to spawn :class:`subprocess.Popen`
+            is specified on the ``kwargs``, this error is raised.
+
+    Returns:
+        tuple:
+
+        - process: (:class:`subprocess.Popen`)
+            The process opened. Once all the lines are consumed the process has finished and ``returncode`` is set.
+        - lines: (Iterator[str])
+            The decoded output lines without the trailing new line.
+    """
+    _invalid_kwargs = ['shell', 'args', 'stdout', 'stderr']
+    for _tag in _invalid_kwargs:
+        if _tag in kwargs:
+            raise AttributeError(f"You cannot use kwarg named: {_tag}")
+
+    _logger.info('Streaming CMD "{}"'.format(cmd))
+
+    proc = _popen(
+        args=cmd,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        **kwargs
+    )
+
+    def _lines():
+        with proc.stdout:
+            for line in proc.stdout:
+                yield line.rstrip(b'\r\n').decode('utf-8', errors='replace')
+        proc.wait()
+
+    return proc, _lines()
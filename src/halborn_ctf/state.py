@@ -77,8 +77,8 @@ class State(dict):
     def _setattr(self, key, value):
         super().__setitem__(key, value)
 
-    # def _merge(self, source):
-    #     _merge(source, self, exists_only=False)
+    def _merge(self, source):
+        _merge(source, self, exists_only=False)
 
     # def udpate(self, source):
     #     """ Does allow updating an state recursively with another dictionary
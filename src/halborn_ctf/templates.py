@@ -20,30 +20,58 @@ Creating a challenge consists on the following steps:
 """
 from dataclasses import dataclass
 import logging
-import flask
-from flask_cors import CORS
-from flask import Response, request
-import requests
 import os
-import zipfile
 import sys
-from io import BytesIO
-import glob
+import threading
 import pickle
+import functools
+import cProfile
+import hmac
+import math
+import time
 import signal
 from urllib.parse import urljoin
+from http.cookiejar import DefaultCookiePolicy
 from typing import TypedDict, NotRequired, Callable
 from enum import Enum
 from textwrap import dedent
 
 from .state import State
+from . import metrics
+from ._archive import _FilesArchive
+from ._solver import _SolverWorker
+from ._relay import _TCPRelay
+from .functions import _PeriodicFunction
+from ._logging import ACCESS_LOGGER
+from . import _profiling
 
 from abc import ABC, abstractmethod
 
-from .network import find_free_port
+from .network import find_free_port, json_rpc, JSONRPCError
+from .services import Supervisor, Step, terminate_group
+
+# flask, flask_cors, requests and werkzeug are imported by the methods serving the challenge, loading and building a
+# challenge does not pay for them
+
+# Directory next to the challenge file where the build stores the state of each challenge class
+_STATE_DIR = '.halborn_ctf'
+
+# Bounds of the /_debug/profile parameters, sampling blocks a server thread
+_PROFILE_MAX_SECONDS = 60.0
+_PROFILE_INTERVALS = (0.001, 1.0)
+
+_REQUEST_DURATION = metrics.histogram('http_request_duration_seconds', 'Duration of the requests to the challenge server', labelnames=('route', 'method'))
+_RESPONSES = metrics.counter('http_responses_total', 'Responses of the challenge server by status code', labelnames=('route', 'code'))
+_IN_FLIGHT = metrics.gauge('http_requests_in_flight', 'Requests being handled by the challenge server', labelnames=('route',))
+_UPSTREAM_DURATION = metrics.histogram('upstream_response_seconds', 'Time until the upstream of a mapping returned the response headers (including the connection)', labelnames=('mapping',))
+_UPSTREAM_ERRORS = metrics.counter('upstream_errors_total', 'Requests of a mapping that could not reach its upstream', labelnames=('mapping',))
 
 # https://stackoverflow.com/questions/320232/ensuring-subprocesses-are-dead-on-exiting-python-program
 class _CleanChildProcesses:
+  def __init__(self, supervisor=None, shutdown_timeout=5.0):
+    self._supervisor = supervisor
+    self._shutdown_timeout = shutdown_timeout
+
   def __enter__(self):
     logging.info("pid=%d  pgid=%d" % (os.getpid(), os.getpgid(0)))
 
@@ -59,20 +87,54 @@ class _CleanChildProcesses:
   def __exit__(self, type, value, traceback):
     logging.info('Killing all processes')
 
+    # Supervised services are stopped first in reverse dependency order
+    if self._supervisor:
+      self._supervisor.stop()
+
     try:
-      os.killpg(0, signal.SIGINT) # kill all processes in my group
+      # Ignore SIGINT while the group is signaled so the escalation below is not interrupted
+      previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    except ValueError:
+      # Not on the main thread
+      previous_handler = None
+
+    try:
+      # kill all processes in my group, escalating to SIGTERM and SIGKILL if they do not exit
+      terminate_group(timeout=self._shutdown_timeout)
     except KeyboardInterrupt:
       # SIGINT is delievered to this process as well as the child processes.
       # Ignore it so that the existing exception, if any, is returned. This
       # leaves us with a clean exit code if there was no exception.
       pass
+    finally:
+      if previous_handler is not None:
+        signal.signal(signal.SIGINT, previous_handler)
+
+class _AppSwitch():
+    """WSGI application forwarding the requests to :attr:`app`. Replacing :attr:`app` is atomic, the requests in progress
+    finish on the previous application and the next ones are served by the new one. Until an application is set, the
+    requests are answered with a ``503``.
+    """
+    def __init__(self, app=None) -> None:
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        app = self.app
+        if app is None:
+            start_response('503 SERVICE UNAVAILABLE', [('Content-Type', 'text/plain; charset=utf-8'), ('Retry-After', '1')])
+            return [b'Challenge not ready (starting)']
+        return app(environ, start_response)
 
 class MappingInfo(TypedDict):
     """Dictionary data type to store the details for a path mapping
     """
 
-    port: int
-    """ (int): The port to redirect to.
+    port: NotRequired[int]
+    """ (int): The port to redirect to. Required unless ``socket`` is set.
+    """
+    socket: NotRequired[str]
+    """ (str, optional): Path of the Unix domain socket to redirect to instead of ``host`` and ``port`` (see
+    :obj:`halborn_ctf.network.socket_path`). It avoids the TCP overhead on the internal hop. It can not be used with ``filter``.
     """
     host: NotRequired[str]
     """ (str, optional): The host to redirect to. Defaults to ``'127.0.0.1'``.
@@ -87,6 +149,23 @@ class MappingInfo(TypedDict):
     """ (Callable, optional): One of the valid built-in filters or a generic_filter function.
     """
 
+class TCPMappingInfo(TypedDict):
+    """Dictionary data type to store the details for a raw TCP port mapping
+    """
+
+    port: NotRequired[int]
+    """ (int): The port to relay to. Required unless ``socket`` is set.
+    """
+    host: NotRequired[str]
+    """ (str, optional): The host to relay to. Defaults to ``'127.0.0.1'``.
+    """
+    socket: NotRequired[str]
+    """ (str, optional): Path of the Unix domain socket to relay to instead of ``host`` and ``port``.
+    """
+    max_connections: NotRequired[int]
+    """ (int, optional): Maximum amount of connections relayed at the same time. Extra connections are closed. Defaults to ``100``.
+    """
+
 class FlagType(Enum):
     NONE = 0
     """If no flag is present
@@ -95,7 +174,8 @@ class FlagType(Enum):
     """If the flag is statically defined or embedded into the challenge somewhere.
     """
     DYNAMIC = 2
-    """When the challenge is deployed a ``FLAG`` environment variable will be set.
+    """When the challenge is deployed a ``FLAG`` environment variable will be set. It is returned by ``/solved`` once solved
+    (see :obj:`GenericChallenge.flag`).
     """
 
 @dataclass
@@ -119,7 +199,8 @@ class StrFile():
 class GenericChallenge(ABC):
     """Generic CTF challenge template
 
-    Each created/deployed challenge does have a single steps named :obj:`run`. The ``run`` step is always executed for each player request
+    Each created/deployed challenge does have two steps named :obj:`build` and :obj:`run`. The ``build`` step is executed once while
+    building the challenge image (``halborn_ctf build``) and the ``run`` step is always executed for each player request
     to deploy a new challenge.
 
     This template does also expose the challenge by using an HTTP server. The server does allow registering routes to it by using
@@ -131,8 +212,11 @@ class GenericChallenge(ABC):
 
     The following routes will be exposed under ``localhost:8080``:
 
-    - ``/info``: Does contain general info of the challenge such as :obj:`ready` and :obj:`state_public`.
-    - ``/solved``: Does execute the "solver" function and display if the challenge was solved together with a solved message or hint to the player.
+    - ``/info``: Does contain general info of the challenge such as :obj:`ready`, the deployment ``phase`` (``starting``,
+      ``deploying``, ``filters``, ``files``, ``ready`` or ``failed``) and :obj:`state_public`.
+    - ``/healthz``: Does return ``200`` while the server is alive.
+    - ``/readyz``: Does return ``200`` once the challenge is ready to be played and ``503`` before.
+    - ``/solved``: Does request the "solver" function to run and display if the challenge was solved together with a solved message or hint to the player.
 
     Note:
         Only if :attr:`HAS_SOLVER` == ``True``.
@@ -142,6 +226,23 @@ class GenericChallenge(ABC):
     Note:
         Only if :attr:`HAS_FILES` == ``True``.
 
+    - ``/metrics``: Does export the server, mappings, solver and process metrics in the Prometheus text format (see :obj:`halborn_ctf.metrics`).
+    - ``/_debug/profile?seconds=10``: Does sample the stacks of all the threads for the given seconds (up to 60) and return
+      them in the collapsed stacks format (input of ``flamegraph.pl`` or speedscope). The sampling ``interval`` (in
+      seconds, between ``0.001`` and ``1``) defaults to ``0.005``.
+    - ``/_debug/threads``: Does return the current stack of every thread.
+    - ``/_debug/requests/<id>``: Does return the profile of a request sent with the ``X-Debug-Profile: 1`` header. The id
+      is returned on the ``X-Debug-Profile-Id`` response header.
+
+    Note:
+        The ``/_debug`` routes (and the request profiling) only exist if the ``DEBUG_TOKEN`` environment variable is set. The
+        token must be sent on the ``X-Debug-Token`` header or the ``token`` query parameter. Requests with the
+        ``X-Debug-Profile`` header but without a valid token are served as usual, without profiling them.
+
+    The server starts listening before :obj:`run` is executed. Until the challenge is ready only ``/info``, ``/healthz``,
+    ``/readyz`` and ``/metrics`` are served and any other path returns ``503``. Once ready, all the routes (including the
+    :obj:`PATH_MAPPING` ones) are swapped in at once.
+
     """
 
     CHALLENGE_NAME = 'challenge'
@@ -168,7 +269,15 @@ class GenericChallenge(ABC):
         You can also create virtual files from strings using :obj:`StrFile`.
 
     Note:
-        Each time the user request the `/files` route a zip archive with all of the listed files will be downloaded.
+        The zip archive is built once when the challenge is ready and cached. It is only rebuilt when any of the
+        listed files (or :obj:`StrFile` content) changes. Downloads support ``ETag`` and ``Range`` requests.
+        Use :obj:`STREAM_FILES` if the content is different on each request.
+    """
+
+    STREAM_FILES = False
+    """ (bool): If set, the ``/files`` archive is not cached but generated and streamed on each request. It should be used when the
+    "files" function returns content that changes for each request (for example :obj:`StrFile` with per-player data).
+    Files on disk are still compressed only once, so only the :obj:`StrFile` entries are compressed for each download.
     """
 
     HAS_SOLVER = False
@@ -181,7 +290,23 @@ class GenericChallenge(ABC):
             pass
 
     Note:
-        This function will be executed each time the user requests the ``/solved`` route.
+        This function is executed on a single background thread when the user requests the ``/solved`` route, at most once
+        every :obj:`SOLVER_MIN_INTERVAL` seconds. The route returns the last result straight away without waiting for the
+        solver. Use ``/solved?refresh=0`` to only read the last result or ``/solved?wait=1`` to wait (up to :obj:`SOLVER_TIMEOUT`)
+        for the solver to finish.
+
+    Tip:
+        Solvers exceeding :obj:`SOLVER_TIMEOUT` are reported as pending. Long solvers can check :obj:`solver_cancelled` to return early.
+        The amount of solvers running at the same time on the process is capped by the ``SOLVER_CONCURRENCY`` environment
+        variable (defaults to 4).
+    """
+
+    SOLVER_MIN_INTERVAL = 2.0
+    """ (float): Minimum amount of seconds between two executions of the "solver" function.
+    """
+
+    SOLVER_TIMEOUT = 10.0
+    """ (float): Deadline in seconds for each execution of the "solver" function.
     """
 
     HAS_DETAILS = False
@@ -286,11 +411,43 @@ class GenericChallenge(ABC):
                 }
             }
 
+        Expose a service listening on a Unix domain socket::
+
+            PATH_MAPPING = {
+                '/<path:path>': {
+                        'socket': network.socket_path('api'),
+                        'methods': ['GET', 'POST']
+                }
+            }
+
     Note:
         There is no need to specify any of the required field for the filter such as ``listen_port``, ``to_port``, ``to_host`` as those will
         be extracted from the mapping itself and a random listening port used and remapped.
     """
 
+    TCP_MAPPING: dict[int, TCPMappingInfo] = {}
+    """
+    (dict[int, TCPMappingInfo]): Raw TCP ports exposed by the challenge. It does contain a mapping of the listening
+    port to the ``TCPMappingInfo`` details of the upstream service.
+
+    Connections are relayed byte by byte to the upstream without going through the HTTP server, so it can expose
+    non-HTTP services or heavy traffic that does not need to be inspected.
+
+    Example:
+        Expose the anvil service running internally on port ``8545`` on the port ``8546``::
+
+            TCP_MAPPING = {
+                8546: {
+                        'port': 8545,
+                        'max_connections': 50 # optional. Defaults to 100
+                }
+            }
+
+    Note:
+        The listening ports must be exposed by the challenge deployment. Statistics of each mapping (connections and
+        bytes relayed) are available on ``/info``.
+    """
+
     def _check_feature_enabled(self, feature_name, required_function):
         if getattr(self, feature_name):
             try:
@@ -312,12 +469,13 @@ class GenericChallenge(ABC):
     def __init__(self) -> None:
         super().__init__()
 
-        self._app = flask.Flask('Challenge')
+        # Created when deploying (see _deploy)
+        self._app = None
         self.log = logging.getLogger(self.CHALLENGE_NAME)
-
-        CORS(self._app)
+        self._access_log = logging.getLogger(ACCESS_LOGGER)
 
         self._ready = False
+        self._phase = 'starting'
         self._state_set = False
         self._state = State({})
         self._state_public_set = False
@@ -329,6 +487,7 @@ class GenericChallenge(ABC):
         if self.HAS_SOLVER:
             self._solved = False
             self._solved_msg = None
+            self._solver_worker = _SolverWorker(self._run_solver, min_interval=self.SOLVER_MIN_INTERVAL, timeout=self.SOLVER_TIMEOUT)
             # self._state._setattr('solved', False)
             # self._state._setattr('solved_msg', None)
 
@@ -336,6 +495,30 @@ class GenericChallenge(ABC):
         self._check_feature_enabled('HAS_SOLVER', 'solver')
         self._check_feature_enabled('HAS_DETAILS', 'details')
 
+        self._files_archive = _FilesArchive(self._files_list) if self.HAS_FILES else None
+
+        self._tcp_relays = {}
+        self._filter_ports = {}
+        self._custom_paths = []
+
+        # Served application, the boot one while deploying and the challenge one once ready (see _set_ready)
+        self._app_switch = _AppSwitch()
+
+        self.flag = os.environ.get('FLAG', 'HAL{PLACEHOLDER}')
+        """ (str): The flag returned once solved if :obj:`FLAG_TYPE` is :obj:`FlagType.DYNAMIC`. Read from the ``FLAG``
+        environment variable and replaced per player when claiming a pre-deployed instance (see :obj:`halborn_ctf.instances.WarmPool`).
+        """
+
+        self.instance_id = None
+        """ (str): Id of the instance when running with other instances on the same process (see
+        :obj:`halborn_ctf.instances`). ``None`` otherwise.
+        """
+
+        self.services = Supervisor()
+        """ (Supervisor): Supervisor used to start the challenge background services (see :obj:`halborn_ctf.services`). All of
+        them are stopped, in reverse dependency order, when the challenge exits.
+        """
+
         if not self.HAS_SOLVER and self.FLAG_TYPE == FlagType.NONE:
             raise ValueError("HAS_SOLVER == False and FLAG_TYPE == NONE")
 
@@ -403,6 +586,24 @@ class GenericChallenge(ABC):
             raise ValueError('Challenge !HAS_SOLVER')
         self._solved_msg = value
 
+    @property
+    def solver_cancelled(self):
+        """(bool): If the current "solver" execution exceeded :obj:`SOLVER_TIMEOUT` or the challenge is stopping (or reloading). The result
+        of the solver is not waited for anymore and it should return as soon as possible. Only functional if :obj:`HAS_SOLVER` is set.
+
+            Example::
+
+                def solver(self):
+                    for player in self.state.players:
+                        if self.solver_cancelled:
+                            return
+                        ...
+
+        """
+        if not self.HAS_SOLVER:
+            raise ValueError('Challenge !HAS_SOLVER')
+        return self._solver_worker.cancelled
+
     @property
     def state(self):
         """(State): Extended dictionary to store variables that can be accessed during challenge execution.
@@ -466,82 +667,134 @@ class GenericChallenge(ABC):
                 # 'filter': _filter
             }
 
+        _tcp_mapping = {}
+        for k,v in self.TCP_MAPPING.items():
+            _tcp_mapping[k] = {
+                'port': v.get('port'),
+                'host': v.get('host', '127.0.0.1'),
+                'stats': self._tcp_relays[k].stats if k in self._tcp_relays else None
+            }
+
         _return = {
             'ready': self._ready,
+            'phase': self._phase,
             'state': self._state_public,
             'config': self._challenge_config,
-            'mapping': _mapping
+            'mapping': _mapping,
+            'tcp_mapping': _tcp_mapping
         }
 
-        if self.HAS_DETAILS:
+        # The details may depend on the deployment (addresses, state...), ``/info`` is also served while deploying
+        if self.HAS_DETAILS and self._ready:
             _return['details'] = dedent(self.details()).strip()
         else:
             _return['details'] = None
 
         return _return
 
+    def _files_list(self):
+        return self.files() + ['challenge.py', 'Dockerfile']
+
     def _app_files_handler(self):
+        import flask
+        from flask import Response
+
         if not self._ready:
             return Response("Challenge not ready", status=503)
 
         name = self.CHALLENGE_NAME.replace(' ','_')
 
         fileName = f"{name}.zip"
-        files = self.files() + ['challenge.py', 'Dockerfile']
 
-        memory_file = BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for _added in files:
-                if type(_added) == StrFile:
-                    zipf.writestr(_added.filepath, _added.content)
-                else:
-                    for result in glob.glob(_added):
-                        zipf.write(result)
+        if self.STREAM_FILES:
+            return Response(self._files_archive.stream(), mimetype='application/zip', headers={
+                'Content-Disposition': f'attachment; filename="{fileName}"',
+                'Cache-Control': 'no-cache'
+            })
+
+        archive = self._files_archive.get()
 
-        memory_file.seek(0)
-        return flask.send_file(memory_file,
+        # Serving from a path allows werkzeug to handle conditional and range requests and
+        # the WSGI server to use its file wrapper (sendfile) if available
+        return flask.send_file(archive.path,
                         download_name=fileName,
-                        as_attachment=True)
+                        as_attachment=True,
+                        etag=archive.etag,
+                        last_modified=archive.mtime,
+                        conditional=True,
+                        max_age=0)
+
+    def _run_solver(self):
+        # The solver is not executed anymore once the challenge is solved
+        if not self.solved:
+            self.solver()
 
     def _app_solved_handler(self):
+        from flask import Response, request
+
         if not self._ready:
             return Response("Challenge not ready", status=503)
 
-        # If not solved, we check on the solver
-        if not self.solved:
-            try:
-                self.solver()
-            except Exception as e:
-                self.log.exception(e)
+        # If not solved, we request the solver to check it on the background
+        if not self.solved and request.args.get('refresh', '1') != '0':
+            self._solver_worker.refresh()
+            if request.args.get('wait', '0') != '0':
+                self._solver_worker.wait(self.SOLVER_TIMEOUT)
+
+        pending = self._solver_worker.pending
 
         response = {
-            'solved': self.solved
+            'solved': self.solved,
+            'pending': pending,
+            'checked_at': self._solver_worker.checked_at
         }
 
         if self._solved_msg:
             response['msg'] = self._solved_msg
+        elif not self.solved and (pending or self._solver_worker.timed_out):
+            response['msg'] = 'Check pending'
         else:
             response['msg'] = 'Solved' if self.solved else 'Not solved'
 
         if self.solved and self.FLAG_TYPE == FlagType.DYNAMIC:
-            response['flag'] = os.environ.get('FLAG', 'HAL{PLACEHOLDER}')
+            response['flag'] = self.flag
 
         return response
 
-    def _generic_path_handler(self, port, host, path):
+    def _generic_path_handler(self, port, host, path, socket=None):
 
         # port = path_data['port']
         # host = path_data.get('host', '127.0.0.1')
         # proxy_path = path_data.get('path', '/')
 
+        import requests
+        from flask import Response, request
+
+        # A session per mapping keeps the upstream connections open between requests
+        session = requests.Session()
+        # The session is shared by all the players so it must never store cookies
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        upstream_duration = _UPSTREAM_DURATION.labels(path)
+        upstream_errors = _UPSTREAM_ERRORS.labels(path)
+
+        if socket:
+            from .network import UnixAdapter
+
+            session.trust_env = False
+            session.mount('http://', UnixAdapter(socket))
+            base_url = 'http://localhost'
+        else:
+            base_url = f'http://{host}:{port}'
+
         def _handler(**kwargs):
 
             # Important to add the final '/'
             full_path = urljoin(path, '/' + kwargs.get('path', ''))
-            full_url = f'http://{host}:{port}{full_path}'
+            full_url = f'{base_url}{full_path}'
 
+            start = time.perf_counter()
             try:
-                resp = requests.request(
+                resp = session.request(
                     method=request.method,
                     url=full_url,
                     headers={key: value for (key, value)
@@ -550,6 +803,7 @@ class GenericChallenge(ABC):
                     cookies=request.cookies,
                     allow_redirects=False,
                     stream=True)
+                upstream_duration.observe(time.perf_counter() - start)
 
                 excluded_headers = ['content-encoding',
                             'content-length', 'transfer-encoding', 'connection']
@@ -557,29 +811,60 @@ class GenericChallenge(ABC):
                 if name.lower() not in excluded_headers]
 
                 return Response(resp, resp.status_code, headers)
-            except ConnectionError:
-                return Response("Could not connect with server on port {}".format(None), 503)
+            except requests.ConnectionError:
+                upstream_errors.inc()
+                return Response("Could not connect with server on {}".format(socket or port), 503)
 
         return _handler
 
     def _register_challenge_paths(self):
+        filters = []
+        self._filter_ports = {}
         for i, values in enumerate(self.PATH_MAPPING.items()):
             path, path_data = values
-            methods = path_data.get('methods', ['GET'])
             host = path_data.get('host', '127.0.0.1')
-            port = path_data['port']
+            port = path_data.get('port')
+            socket = path_data.get('socket')
             # TODO: Verify methods and path_data
             _filter = path_data.get('filter', None)
+            if _filter and socket:
+                # mitmdump can only forward to TCP upstreams
+                raise ValueError('Mapping "{}": filters can not be used with a "socket" upstream'.format(path))
             if _filter:
 
                 random_port = find_free_port()
+                self._filter_ports[i] = random_port
+
+                # All filters start at the same time and the path is only served once the filter is listening
+                filters.append(Step('filter-{}'.format(i), functools.partial(_filter, listen_port=random_port, to_port=port, to_host=host), ready=random_port))
+
+        self._register_mapping_paths()
+
+        if filters:
+            self.services.start(*filters)
 
-                _filter(listen_port=random_port, to_port=port, to_host=host)
+        for listen_port, mapping in self.TCP_MAPPING.items():
+            relay = _TCPRelay(listen_port, port=mapping.get('port'), host=mapping.get('host', '127.0.0.1'),
+                              socket=mapping.get('socket'), max_connections=mapping.get('max_connections', 100))
+            relay.start()
+            self._tcp_relays[listen_port] = relay
 
+            metrics.gauge('tcp_relay_connections_active', 'Connections being relayed by a TCP mapping', labelnames=('port',)).labels(listen_port).set_function(lambda relay=relay: relay.active)
+            metrics.counter('tcp_relay_connections_total', 'Connections accepted by a TCP mapping', labelnames=('port',)).labels(listen_port).set_function(lambda relay=relay: relay.connections)
+            metrics.counter('tcp_relay_rejected_total', 'Connections closed by a TCP mapping over its max_connections', labelnames=('port',)).labels(listen_port).set_function(lambda relay=relay: relay.rejected)
+            relay_bytes = metrics.counter('tcp_relay_bytes_total', 'Bytes relayed by a TCP mapping', labelnames=('port', 'direction'))
+            relay_bytes.labels(listen_port, 'in').set_function(lambda relay=relay: relay.bytes_in)
+            relay_bytes.labels(listen_port, 'out').set_function(lambda relay=relay: relay.bytes_out)
+
+    def _register_mapping_paths(self):
+        for i, values in enumerate(self.PATH_MAPPING.items()):
+            path, path_data = values
+            methods = path_data.get('methods', ['GET'])
+            if i in self._filter_ports:
                 # The path mapping should redirect to 127.0.0.1:random_port
-                self._app.add_url_rule(path, 'mapping-{}'.format(i), self._generic_path_handler(port=random_port, host='127.0.0.1', path=path), methods=methods)
+                self._app.add_url_rule(path, 'mapping-{}'.format(i), self._generic_path_handler(port=self._filter_ports[i], host='127.0.0.1', path=path), methods=methods)
             else:
-                self._app.add_url_rule(path, 'mapping-{}'.format(i), self._generic_path_handler(port=port, host=host, path=path), methods=methods)
+                self._app.add_url_rule(path, 'mapping-{}'.format(i), self._generic_path_handler(port=path_data.get('port'), host=path_data.get('host', '127.0.0.1'), path=path, socket=path_data.get('socket')), methods=methods)
 
     def register_path(self, path, handler, methods=['GET']):
         """ It does allow to define a custom flask endpoint for your challenge without a service to redirect to using the
@@ -616,11 +901,33 @@ class GenericChallenge(ABC):
         Tip:
             You can access the request body by importing ``from flask import request``.
         """
-        self._app.add_url_rule(path, 'mapping-{}'.format(handler.__name__), handler, methods)
+        self._custom_paths.append((path, handler, methods))
+        # Paths registered before deploying are added with the challenge application
+        if self._app is not None:
+            self._app.add_url_rule(path, 'mapping-{}'.format(handler.__name__), handler, methods)
+
+    def _register_custom_paths(self):
+        for path, handler, methods in self._custom_paths:
+            # Bound methods are taken again from the class, which is replaced on hot reloads
+            handler = getattr(self, handler.__name__, handler) if hasattr(handler, '__self__') else handler
+            self._app.add_url_rule(path, 'mapping-{}'.format(handler.__name__), handler, methods)
+
+    def _new_app(self, name):
+        import flask
+        from flask_cors import CORS
+
+        app = flask.Flask(name)
+        CORS(app)
+        return app
 
     def _server(self):
-        cli = sys.modules['flask.cli']
-        cli.show_server_banner = lambda *x: None
+        """Starts serving the boot application on a background thread. The challenge application is served once
+        :obj:`_set_ready` is called.
+
+        Returns:
+            threading.Thread: The thread running the server.
+        """
+        from werkzeug.serving import make_server
 
         log = logging.getLogger('werkzeug')
         log.level = logging.WARNING
@@ -629,92 +936,349 @@ class GenericChallenge(ABC):
         logging.getLogger("requests").setLevel(logging.WARNING)
         logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-        self._app.after_request(self.on_request)
-
-        _port = os.environ.get('PORT', 8080)
+        _port = int(os.environ.get('PORT', 8080))
         self.log.warning('===========================================')
         self.log.warning('Starting challenge server on 0.0.0.0:{}'.format(_port))
         self.log.warning('===========================================')
-        self._app.run(host='0.0.0.0', port=_port, use_reloader=False, debug=False)
+        if self._app_switch.app is None:
+            self._app_switch.app = self._boot_app()
+        self._http_server = make_server('0.0.0.0', _port, self._app_switch, threaded=True)
+
+        thread = threading.Thread(target=self._http_server.serve_forever, name='http-server', daemon=True)
+        thread.start()
+        return thread
+
+    def _set_ready(self):
+        # Routes can not be added to a flask application once it served a request, the challenge application is only
+        # served from here on
+        self._app.after_request(self.on_request)
+        self._app_switch.app = self._app
+        self._phase = 'ready'
+        self._ready = True
+
+    def _rebuild_app(self):
+        """Registers all the routes again on a new challenge application and serves it. Used after replacing the class of
+        the challenge (hot reload) so the routes use its current methods. Services, filters and TCP mappings are kept.
+        """
+        self._app = self._new_app('Challenge')
+
+        self._register_flask_paths()
+        self._register_custom_paths()
+        self._register_mapping_paths()
+
+        previous = None
+        if self.HAS_FILES:
+            previous, self._files_archive = self._files_archive, _FilesArchive(self._files_list)
+            if not self.STREAM_FILES:
+                try:
+                    self._files_archive.get(force=True)
+                except Exception as e:
+                    self.log.exception(e)
+
+        self._app.after_request(self.on_request)
+        self._app_switch.app = self._app
+
+        # The previous archive is no longer served, remove its files from disk
+        if previous is not None:
+            previous.close()
 
     def on_request(self, response):
+        from flask import request
+
         if '200' in response.status:
-            self.log.info('%s %s %s %s %s', request.remote_addr, request.method, request.scheme, request.full_path, response.status)
+            self._access_log.info('%s %s %s %s %s', request.remote_addr, request.method, request.scheme, request.full_path, response.status)
         else:
-            self.log.error('%s %s %s %s %s', request.remote_addr, request.method, request.scheme, request.full_path, response.status)
+            self._access_log.error('%s %s %s %s %s', request.remote_addr, request.method, request.scheme, request.full_path, response.status)
         return response
 
     #######################################
 
+    def _metrics_before_request(self):
+        import flask
+        from flask import request
+
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        flask.g.metrics_start = time.perf_counter()
+        flask.g.metrics_in_flight = _IN_FLIGHT.labels(route)
+        flask.g.metrics_in_flight.inc()
+
+    def _metrics_after_request(self, response):
+        import flask
+        from flask import request
+
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        _REQUEST_DURATION.labels(route, request.method).observe(time.perf_counter() - flask.g.metrics_start)
+        _RESPONSES.labels(route, response.status_code).inc()
+        return response
+
+    def _metrics_teardown_request(self, exception):
+        import flask
+
+        in_flight = flask.g.pop('metrics_in_flight', None)
+        if in_flight:
+            in_flight.dec()
+
+    def _debug_authorized(self):
+        from flask import request
+
+        token = request.headers.get('X-Debug-Token') or request.args.get('token') or ''
+        return hmac.compare_digest(token.encode(), self._debug_token.encode())
+
+    def _debug_route(self, handler):
+        from flask import Response
+
+        @functools.wraps(handler)
+        def _handler(**kwargs):
+            if not self._debug_authorized():
+                return Response('Forbidden', 403)
+            return handler(**kwargs)
+        return _handler
+
+    def _app_debug_profile_handler(self):
+        from flask import Response, request
+
+        try:
+            seconds = float(request.args.get('seconds', 10))
+            interval = float(request.args.get('interval', 0.005))
+        except ValueError:
+            return Response('"seconds" and "interval" must be numbers', 400)
+        if not (math.isfinite(seconds) and math.isfinite(interval)) or seconds <= 0 or interval <= 0:
+            return Response('"seconds" and "interval" must be positive numbers', 400)
+
+        seconds = min(seconds, _PROFILE_MAX_SECONDS)
+        interval = min(max(interval, _PROFILE_INTERVALS[0]), _PROFILE_INTERVALS[1])
+        return Response(_profiling.sample(seconds, interval), mimetype='text/plain')
+
+    def _app_debug_threads_handler(self):
+        from flask import Response
+
+        return Response(_profiling.thread_dump(), mimetype='text/plain')
+
+    def _app_debug_request_handler(self, profile_id):
+        from flask import Response
+
+        profile = self._request_profiles.get(profile_id)
+        if profile is None:
+            return Response('Profile not found', 404)
+        return Response(profile, mimetype='text/plain')
+
+    def _debug_before_request(self):
+        import flask
+        from flask import request
+
+        # The header is set by players too, without the token the request is served as usual (not profiled)
+        if 'X-Debug-Profile' not in request.headers or not self._debug_authorized():
+            return None
+        flask.g.debug_profile = cProfile.Profile()
+        flask.g.debug_profile.enable()
+
+    def _debug_after_request(self, response):
+        import flask
+        from flask import request
+
+        profile = flask.g.pop('debug_profile', None)
+        if profile is not None:
+            profile.disable()
+            profile_id = self._request_profiles.add('{} {} {}'.format(request.method, request.full_path, response.status), profile)
+            response.headers['X-Debug-Profile-Id'] = str(profile_id)
+        return response
+
+    def _register_debug_paths(self):
+        self._request_profiles = _profiling._RequestProfiles()
+
+        self._app.before_request(self._debug_before_request)
+        self._app.after_request(self._debug_after_request)
+
+        self._app.add_url_rule('/_debug/profile', 'debug-profile', self._debug_route(self._app_debug_profile_handler), methods=['GET'])
+        self._app.add_url_rule('/_debug/threads', 'debug-threads', self._debug_route(self._app_debug_threads_handler), methods=['GET'])
+        self._app.add_url_rule('/_debug/requests/<int:profile_id>', 'debug-request', self._debug_route(self._app_debug_request_handler), methods=['GET'])
+
+    def _app_healthz_handler(self):
+        from flask import Response
+
+        return Response('ok', mimetype='text/plain')
+
+    def _app_readyz_handler(self):
+        from flask import Response
+
+        if not self._ready:
+            return Response(self._phase, 503, mimetype='text/plain')
+        return Response('ready', mimetype='text/plain')
+
+    def _app_not_ready_handler(self, path=''):
+        from flask import Response
+
+        return Response('Challenge not ready ({})'.format(self._phase), 503, headers={'Retry-After': '1'})
+
+    def _boot_app(self):
+        """Application served while the challenge is being deployed.
+        """
+        app = self._new_app('ChallengeBoot')
+
+        app.before_request(self._metrics_before_request)
+        app.after_request(self._metrics_after_request)
+        app.teardown_request(self._metrics_teardown_request)
+        app.after_request(self.on_request)
+
+        app.add_url_rule('/healthz', 'healthz', self._app_healthz_handler, methods=['GET'])
+        app.add_url_rule('/readyz', 'readyz', self._app_readyz_handler, methods=['GET'])
+        app.add_url_rule('/metrics', 'metrics', self._app_metrics_handler, methods=['GET'])
+        app.add_url_rule('/info', 'info', self._app_info_handler, methods=['GET'])
+        app.add_url_rule('/', 'not-ready', self._app_not_ready_handler)
+        app.add_url_rule('/<path:path>', 'not-ready', self._app_not_ready_handler)
+        return app
+
+    def _app_metrics_handler(self):
+        from flask import Response
+
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     def _register_flask_paths(self):
+        self._app.before_request(self._metrics_before_request)
+        self._app.after_request(self._metrics_after_request)
+        self._app.teardown_request(self._metrics_teardown_request)
+
+        # Nothing is registered unless enabled so the debug routes have no cost by default
+        self._debug_token = os.environ.get('DEBUG_TOKEN')
+        if self._debug_token:
+            self._register_debug_paths()
+
+        self._app.add_url_rule('/healthz', 'healthz', self._app_healthz_handler, methods=['GET'])
+        self._app.add_url_rule('/readyz', 'readyz', self._app_readyz_handler, methods=['GET'])
+        self._app.add_url_rule('/metrics', 'metrics', self._app_metrics_handler, methods=['GET'])
         self._app.add_url_rule('/info', 'info', self._app_info_handler, methods=['GET'])
         if self.HAS_FILES:
             self._app.add_url_rule('/files', 'files', self._app_files_handler, methods=['GET'])
         if self.HAS_SOLVER:
             self._app.add_url_rule('/solved', 'solved', self._app_solved_handler, methods=['GET'])
 
-    # def _build(self):
-    #     with _CleanChildProcesses():
-    #         self.build()
+    def _state_dumps(self):
+        """Paths of the ``state`` and ``state_public`` dumps of the build, stored next to the challenge file and named
+        after the challenge class so each challenge only loads its own.
+        """
+        path = getattr(sys.modules.get(type(self).__module__), '__file__', None)
+        directory = os.path.dirname(os.path.abspath(path)) if path else os.getcwd()
+        prefix = os.path.join(directory, _STATE_DIR, type(self).__qualname__)
+        return prefix + '.state.dump', prefix + '.state_public.dump'
+
+    def _build(self):
+        with _CleanChildProcesses(self.services):
+            self.build()
+
+            # The state set during the build is stored on the image and loaded before each ``run``. Dumps of a
+            # previous build that did not set the state are removed so they are not loaded
+            state_dump, state_public_dump = self._state_dumps()
+            os.makedirs(os.path.dirname(state_dump), exist_ok=True)
+            for path, state, is_set in ((state_dump, self._state, self._state_set),
+                                        (state_public_dump, self._state_public, self._state_public_set)):
+                if is_set:
+                    with open(path, 'bw') as f:
+                        pickle.dump(state, f)
+                else:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+
+    def _load_build_state(self):
+        state_dump, state_public_dump = self._state_dumps()
+        try:
+            with open(state_dump, 'br') as f:
+                self._state._merge(pickle.load(f))
+                self._state_set = True
+        except FileNotFoundError:
+            pass
 
-    #         try:
-    #             f = open('/tmp/state.dump', 'bw')
-    #             pickle.dump(self._state, f)
-    #         except:
-    #             pass
+        try:
+            with open(state_public_dump, 'br') as f:
+                self._state_public._merge(pickle.load(f))
+                self._state_public_set = True
+        except FileNotFoundError:
+            pass
 
-    #         try:
-    #             f = open('/tmp/state_public.dump', 'bw')
-    #             pickle.dump(self._state_public, f)
-    #         except:
-    #             pass
+    def _deploy(self):
+        try:
+            self._load_build_state()
 
-    def _run(self):
-        with _CleanChildProcesses():
-
-            # try:
-            #     f = open('/tmp/state.dump', 'br')
-            #     tmp = pickle.load(f)
-            #     self._state._merge(tmp)
-            # except:
-            #     pass
-
-            # try:
-            #     f = open('/tmp/state_public.dump', 'br')
-            #     # TODO: Do a merge instead of replace
-            #     tmp = pickle.load(f)
-            #     self._state_public._merge(tmp)
-            # except:
-            #     pass
+            # Served until the challenge application is ready. Instances get requests routed before deploying
+            if self._app_switch.app is None:
+                self._app_switch.app = self._boot_app()
 
+            self._app = self._new_app('Challenge')
             self._register_flask_paths()
+            self._register_custom_paths()
 
+            self._phase = 'deploying'
             self.run()
 
+            self._phase = 'filters'
             self._register_challenge_paths()
 
-            self._ready = True
+            if self.HAS_FILES and not self.STREAM_FILES:
+                self._phase = 'files'
+                try:
+                    self._files_archive.get(force=True)
+                except Exception as e:
+                    self.log.exception(e)
+        except BaseException:
+            self._phase = 'failed'
+            raise
+
+        self._set_ready()
+        self.log.info('Challenge ready')
+
+    def _stop(self, services=True):
+        """Stops the background work of the challenge: the services (unless ``services`` is ``False``), the TCP mappings,
+        the :obj:`~halborn_ctf.functions.periodic` methods started by the challenge and the solver, and removes the files
+        archive from disk. The processes started with :obj:`halborn_ctf.shell.run` are not stopped here.
+        """
+        self._ready = False
+        self._phase = 'stopped'
+        if services:
+            self.services.stop()
+        for relay in self._tcp_relays.values():
+            relay.stop()
+        # Periodic methods are bound to each challenge once accessed, other challenges keep running theirs
+        for value in list(vars(self).values()):
+            if isinstance(value, _PeriodicFunction):
+                value.stop()
+        if self.HAS_SOLVER:
+            self._solver_worker.stop()
+        if self._files_archive is not None:
+            self._files_archive.close()
 
-            # TODO: Try to run in on a thread and start it before the self.run function. This will allow to notify the ready state
-            # in case a backgroun process is not specified as background.
-            self._server()
+    def _run(self):
+        with _CleanChildProcesses(self.services):
 
+            # Health checks and players get an answer (``/info`` with the phase) while the challenge is deployed
+            server_thread = self._server()
 
-    # def build(self):
-    #     """All the static funtionality that should be executed during the build phase of the challenge container. The running container will
-    #     have everything executed here pre-bundled as this funcionality is only executed once for all running instances.
+            self._deploy()
 
-    #     NOTE:
-    #         At the end of the execution of this function all processes will be killed. Any dynamic funcionality or any code that should be depended to each deployment, dynamic keys, dynamic accounts... should be inserted into
-    #         :obj:`run` instead.
-    #     """
-    #     pass
+            server_thread.join()
+
+    def build(self):
+        """All the static funtionality that should be executed during the build phase of the challenge container (``halborn_ctf build``).
+        The running container will have everything executed here pre-bundled as this funcionality is only executed once for all running instances.
+
+        Any file created in the challenge folder is kept on the image. Expensive steps can be cached across builds
+        using :obj:`halborn_ctf.build.cached_step`. The :obj:`state` and :obj:`state_public` set here are available on :obj:`run`.
+
+        Note:
+            At the end of the execution of this function all processes will be killed. Any dynamic funcionality or any code that should be depended to each deployment, dynamic keys, dynamic accounts... should be inserted into
+            :obj:`run` instead.
+        """
+        pass
 
     @abstractmethod
     def run(self):
         """All the dynamic funtionallity that should be executed during the creation of a challenge for each player.
 
         The ``run`` function should be used to start the actual challenge for the player. Such as running the chain, deploying the contracts (if they have to be done dynamically), starting the services and execute any :obj:`halborn_ctf.network.filters`.
+
+        Tip:
+            Declare independent services and setup steps together on :obj:`services` (see :obj:`halborn_ctf.services.Step`) so
+            they start at the same time instead of one after another.
         """
         pass
 
@@ -723,12 +1287,172 @@ class Web3Challenge(GenericChallenge):
 
     Class extending the GenericChallenge with :obj:`GenericChallenge.HAS_SOLVER` and :obj:`GenericChallenge.HAS_FILES` both set to ``True``.
 
+    Besides the :obj:`GenericChallenge` routes, it exposes:
+
+    - ``/reset`` (``POST``): Does revert the chain (``evm_revert``) to the snapshot taken right after :obj:`run`, restore
+      :obj:`state` and :obj:`state_public` to their values at that point and set the challenge as not solved. It allows
+      players to retry without deploying the challenge again.
+
+    Note:
+        The chain at :obj:`RPC_URL` must support ``evm_snapshot`` and ``evm_revert`` (anvil, hardhat, ganache). Otherwise
+        ``/reset`` returns ``501``. If the chain can not be snapshotted again after a reset, it returns ``500`` and
+        ``501`` from then on.
+
     """
 
     FLAG_TYPE = FlagType.NONE
     HAS_SOLVER = True
     HAS_FILES = True
 
+    RPC_URL = 'http://127.0.0.1:8545'
+    """ (str): The JSON-RPC endpoint of the challenge chain used by :obj:`solve_when` and ``/reset``. With multiple
+    instances (see :obj:`halborn_ctf.instances`) each instance must set ``self.RPC_URL`` to its own chain on :obj:`run`.
+    """
+
+    CHAIN_WATCH_INTERVAL = 0.5
+    """ (float): Seconds between checks for new blocks and logs done by :obj:`solve_when`.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chain_watcher = None
+        self._chain_snapshot = None
+        self._state_snapshot = None
+        self._reset_lock = threading.Lock()
+
+    def _snapshot(self):
+        import requests
+
+        # Pickle as the build state does, the State attribute access does not support copy.deepcopy
+        self._state_snapshot = (pickle.dumps(self._state), pickle.dumps(self._state_public))
+        try:
+            self._chain_snapshot = json_rpc(self.RPC_URL, 'evm_snapshot')
+        except (JSONRPCError, requests.RequestException) as e:
+            self._chain_snapshot = None
+            self.log.warning('Could not snapshot the chain, /reset is disabled: {}'.format(e))
+
+    def _set_ready(self):
+        self._snapshot()
+        super()._set_ready()
+
+    def _reset(self):
+        """Reverts the chain and the state to the snapshot taken after :obj:`run`.
+
+        Raises:
+            RuntimeError: If the chain could not be reverted, or could not be snapshotted again after reverting it (the
+                challenge is reset but ``/reset`` is disabled from then on).
+
+        Returns:
+            bool: ``False`` if there is no snapshot to revert to.
+        """
+        import requests
+
+        with self._reset_lock:
+            # Reverting consumes the snapshot, it must not be used again if the new one can not be taken
+            snapshot, self._chain_snapshot = self._chain_snapshot, None
+            if snapshot is None:
+                return False
+            if not json_rpc(self.RPC_URL, 'evm_revert', [snapshot]):
+                raise RuntimeError('Snapshot {} not found'.format(snapshot))
+
+            # Restored in place as the handlers may keep references to them
+            state, state_public = self._state_snapshot
+            self._state.clear()
+            self._state.update(pickle.loads(state))
+            self._state_public.clear()
+            self._state_public.update(pickle.loads(state_public))
+
+            self._solved = False
+            self._solved_msg = None
+            if self._chain_watcher is not None:
+                self._chain_watcher.reset()
+
+            try:
+                self._chain_snapshot = json_rpc(self.RPC_URL, 'evm_snapshot')
+            except (JSONRPCError, requests.RequestException) as e:
+                raise RuntimeError('Could not snapshot the chain again, /reset is disabled: {}'.format(e)) from e
+        return True
+
+    def _app_reset_handler(self):
+        import requests
+        from flask import Response
+
+        if not self._ready:
+            return Response("Challenge not ready", status=503)
+
+        start = time.perf_counter()
+        try:
+            # The snapshot is checked under the reset lock, a concurrent reset may consume it
+            if not self._reset():
+                return Response("Reset not available", status=501)
+        except RuntimeError as e:
+            self.log.error('Reset failed: {}'.format(e))
+            return Response("Could not reset the challenge: {}".format(e), status=500)
+        except (JSONRPCError, requests.RequestException) as e:
+            self.log.error('Reset failed: {}'.format(e))
+            return Response("Could not reset the challenge", status=500)
+
+        return {
+            'reset': True,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+
+    def _register_flask_paths(self):
+        super()._register_flask_paths()
+        self._app.add_url_rule('/reset', 'reset', self._app_reset_handler, methods=['POST'])
+
+    def _stop(self, services=True):
+        super()._stop(services)
+        if self._chain_watcher is not None:
+            self._chain_watcher.stop()
+
+    def _chain_solved(self, msg):
+        self.solved = True
+        if msg:
+            self.solved_msg = msg
+
+    def solve_when(self, condition: Callable, *, logs: dict = None, storage: list = None, msg: str = None):
+        """Evaluates ``condition`` only when the chain changes and sets the challenge as :obj:`solved` once it returns a truthy value.
+
+        The condition is evaluated:
+
+        - On each new block (receiving the list of new block hashes) if neither ``logs`` nor ``storage`` are given.
+        - When new logs matching the ``logs`` filter are emitted (receiving the list of logs).
+        - When any of the ``storage`` slots changes its value (receiving a dictionary of every watched ``(address, slot)``
+          to its current value, not only the changed ones).
+
+        The logs filter is created when calling this method, logs emitted from then on are not missed.
+
+        If the condition returns a string it is used as :obj:`solved_msg`.
+
+        Example:
+            Setting the challenge as solved once the ``Solved()`` event is emitted or the storage slot ``0`` of the target changes::
+
+                def run(self):
+                    ...
+                    self.solve_when(lambda logs: True, logs={
+                        'address': target,
+                        'topics': ['0x...'] # keccak('Solved()')
+                    }, msg='Well done!')
+
+                    self.solve_when(lambda changes: int(changes[(target, 0)], 16) == 0, storage=[(target, 0)])
+
+        Note:
+            Conditions are evaluated on a single background thread which stops once the challenge is solved. The
+            chain is checked every :obj:`CHAIN_WATCH_INTERVAL` seconds using ``eth_getFilterChanges``.
+
+        Args:
+            condition (Callable): Function returning if the challenge is solved (or the solved message).
+            logs (dict, optional): A ``eth_newFilter`` filter (``address`` and ``topics``). Defaults to None.
+            storage (list, optional): List of ``(address, slot)`` tuples to watch. Defaults to None.
+            msg (str, optional): The :obj:`solved_msg` to set when solved. Defaults to None.
+        """
+        from ._chain import _ChainWatcher, _Subscription
+
+        if self._chain_watcher is None:
+            self._chain_watcher = _ChainWatcher(self.RPC_URL, self._chain_solved, interval=self.CHAIN_WATCH_INTERVAL)
+        self._chain_watcher.add(_Subscription(condition, logs=logs, storage=storage, msg=msg))
+
     @abstractmethod
     def run(self):
         pass
@@ -742,5 +1466,8 @@ class Web3Challenge(GenericChallenge):
     @abstractmethod
     def solver(self):
         """Refer to :obj:`HAS_SOLVER`
+
+        Tip:
+            Use :obj:`solve_when` to detect the solution from chain events instead of polling the chain.
         """
         pass
@@ -0,0 +1,157 @@
+import io
+import os
+import zipfile
+
+from halborn_ctf import _archive
+from halborn_ctf._archive import _CompressedFileCache, _ZipStream
+
+
+def _zip(chunks):
+    return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+
+def _stream_file(cache, arcname, path):
+    stream = _ZipStream()
+    yield from cache.add_to(stream, arcname, path)
+    yield from stream.close()
+
+
+def test_cached_file_recompressed_while_streaming(tmp_path):
+    path = tmp_path / 'data.txt'
+    path.write_bytes(b'first ' * 100000)
+    cache = _CompressedFileCache()
+    # Compresses the file and caches it
+    b''.join(_stream_file(cache, 'data.txt', str(path)))
+
+    chunks = _stream_file(cache, 'data.txt', str(path))
+    header = next(chunks)
+
+    # The file changes and a concurrent stream compresses it again, removing the previous compressed data
+    path.write_bytes(b'second ' * 100000)
+    os.utime(path, ns=(0, 1))
+    second = b''.join(_stream_file(cache, 'data.txt', str(path)))
+
+    with _zip([header, *chunks]) as archive:
+        assert archive.testzip() is None
+        assert archive.read('data.txt') == b'first ' * 100000
+    with _zip([second]) as archive:
+        assert archive.read('data.txt') == b'second ' * 100000
+
+    cache.clear()
+
+
+def test_zip_stream_entries():
+    stream = _ZipStream()
+    chunks = [
+        *stream.add_bytes('text.txt', 'text ' * 1000),
+        *stream.add_bytes('stored.bin', b'\x00\x01' * 100, method=_archive._ZIP_STORED),
+        *stream.add_stream('streamed.txt', [b'a' * 5000, b'b' * 5000]),
+        *stream.add_bytes('ünicode.txt', b'content', mode=0o755),
+        *stream.close(),
+    ]
+
+    with _zip(chunks) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['text.txt', 'stored.bin', 'streamed.txt', 'ünicode.txt']
+        assert archive.read('text.txt') == b'text ' * 1000
+        assert archive.read('stored.bin') == b'\x00\x01' * 100
+        assert archive.read('streamed.txt') == b'a' * 5000 + b'b' * 5000
+        assert archive.getinfo('stored.bin').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('text.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo('ünicode.txt').external_attr >> 16 == 0o100755
+
+
+def test_zip_stream_zip64_sizes(monkeypatch, tmp_path):
+    # Entries, offsets and the central directory over the limit use the ZIP64 extensions like files over 4GB
+    monkeypatch.setattr(_archive, '_ZIP64_LIMIT', 1000)
+    path = tmp_path / 'large.bin'
+    path.write_bytes(os.urandom(3000))
+
+    stream = _ZipStream()
+    chunks = [
+        *stream.add_bytes('first.bin', os.urandom(2000), method=_archive._ZIP_STORED),
+        *stream.add_stream('streamed.bin', [path.read_bytes()], size_hint=3000),
+        *stream.add_bytes('small.txt', b'small'),
+        *stream.close(),
+    ]
+
+    with _zip(chunks) as archive:
+        assert archive.testzip() is None
+        assert archive.getinfo('first.bin').file_size == 2000
+        assert archive.read('streamed.bin') == path.read_bytes()
+        assert archive.read('small.txt') == b'small'
+        assert archive.getinfo('small.txt').header_offset > 1000
+
+
+def test_zip_stream_zip64_entry_count():
+    stream = _ZipStream()
+    chunks = []
+    for i in range(_archive._ZIP_FILECOUNT_LIMIT + 10):
+        chunks.extend(stream.add_bytes('{}.txt'.format(i), b'', method=_archive._ZIP_STORED))
+    chunks.extend(stream.close())
+
+    with _zip(chunks) as archive:
+        names = archive.namelist()
+        assert len(names) == _archive._ZIP_FILECOUNT_LIMIT + 10
+        assert names[-1] == '{}.txt'.format(_archive._ZIP_FILECOUNT_LIMIT + 9)
+
+
+def test_compressed_file_cache_hits(monkeypatch, tmp_path):
+    path = tmp_path / 'data.txt'
+    path.write_bytes(b'data ' * 10000)
+    cache = _CompressedFileCache()
+
+    compressed = []
+    add_stream = _ZipStream.add_stream
+
+    def counting_add_stream(self, arcname, *args, **kwargs):
+        compressed.append(arcname)
+        return (yield from add_stream(self, arcname, *args, **kwargs))
+
+    monkeypatch.setattr(_ZipStream, 'add_stream', counting_add_stream)
+
+    archives = [b''.join(_stream_file(cache, 'data.txt', str(path))) for _ in range(3)]
+    assert compressed == ['data.txt']
+    for content in archives:
+        with _zip([content]) as archive:
+            assert archive.read('data.txt') == b'data ' * 10000
+
+    # A modified file is compressed again and the previous data removed
+    data_path = cache._files[str(path)].data_path
+    path.write_bytes(b'changed')
+    os.utime(path, ns=(0, 1))
+    with _zip(_stream_file(cache, 'data.txt', str(path))) as archive:
+        assert archive.read('data.txt') == b'changed'
+    assert compressed == ['data.txt', 'data.txt']
+    assert not os.path.exists(data_path)
+
+    cache.clear()
+    assert cache._files == {}
+
+
+def test_files_archive_cache(tmp_path):
+    from halborn_ctf.templates import StrFile
+
+    path = tmp_path / 'data.txt'
+    path.write_bytes(b'data')
+    files = [str(tmp_path / '*.txt'), StrFile('generated.txt', 'generated')]
+    files_archive = _archive._FilesArchive(lambda: files, check_interval=0)
+
+    first = files_archive.get()
+    assert files_archive.get() is first
+    with zipfile.ZipFile(first.path) as archive:
+        assert archive.read(str(path)) == b'data'
+        assert archive.read('generated.txt') == b'generated'
+
+    files[1] = StrFile('generated.txt', 'changed')
+    second = files_archive.get()
+    assert second.etag != first.etag
+    with zipfile.ZipFile(second.path) as archive:
+        assert archive.read('generated.txt') == b'changed'
+
+    with _zip(files_archive.stream()) as archive:
+        assert archive.read('generated.txt') == b'changed'
+
+    files_archive.close()
+    assert not os.path.exists(first.path)
+    assert not os.path.exists(second.path)
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from halborn_ctf._chain import _ChainWatcher, _Subscription
+
+
+class _FakeChain():
+    def __init__(self):
+        self.calls = []
+        self.storage = {}
+        self.blocks = []
+        self.logs = []
+        self.block_filter = None
+
+    def __call__(self, method, params=None):
+        self.calls.append(method)
+        if method == 'eth_newBlockFilter':
+            self.block_filter = '0x{}'.format(len(self.calls))
+            return self.block_filter
+        if method == 'eth_newFilter':
+            return '0x{}'.format(len(self.calls))
+        if method == 'eth_getBlockByNumber':
+            return {'hash': '0x0'}
+        if method == 'eth_getStorageAt':
+            return self.storage.get((params[0], int(params[1], 16)), '0x0')
+        if method == 'eth_getFilterChanges':
+            pending = self.blocks if params[0] == self.block_filter else self.logs
+            changes = list(pending)
+            pending.clear()
+            return changes
+        raise AssertionError(method)
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out waiting for the condition'
+        time.sleep(0.01)
+
+
+def _watcher(chain, solved):
+    watcher = _ChainWatcher('http://chain', lambda msg: solved.set(), interval=0.01)
+    watcher._rpc = chain
+    return watcher
+
+
+def test_storage_condition_gets_every_slot():
+    chain = _FakeChain()
+    received = []
+    solved = threading.Event()
+
+    def condition(values):
+        received.append(values)
+        return int(values[('0xa', 0)], 16) == 1 and int(values[('0xa', 1)], 16) == 2
+
+    watcher = _watcher(chain, solved)
+    watcher.add(_Subscription(condition, storage=[('0xa', 0), ('0xa', 1)]))
+    try:
+        _wait(lambda: len(received) == 1)
+        chain.storage[('0xa', 0)] = '0x1'
+        chain.blocks.append('0x1')
+        _wait(lambda: len(received) == 2)
+        chain.storage[('0xa', 1)] = '0x2'
+        chain.blocks.append('0x2')
+        assert solved.wait(5)
+    finally:
+        watcher.stop()
+
+    assert all(set(values) == {('0xa', 0), ('0xa', 1)} for values in received)
+
+
+def test_log_filter_created_on_add():
+    chain = _FakeChain()
+    solved = threading.Event()
+    watcher = _watcher(chain, solved)
+
+    watcher.add(_Subscription(lambda logs: True, logs={'address': '0xa'}))
+    # Created before the first poll, which starts on the latest block
+    assert chain.calls[0] == 'eth_newFilter'
+
+    try:
+        chain.logs.append({'address': '0xa'})
+        assert solved.wait(5)
+    finally:
+        watcher.stop()
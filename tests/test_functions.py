@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from halborn_ctf.functions import periodic
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for the condition')
+        time.sleep(0.01)
+
+
+def test_periodic_invalid_arguments():
+    with pytest.raises(ValueError):
+        periodic(every=0)(lambda: None)
+    with pytest.raises(ValueError):
+        periodic(every=1, mode='other')(lambda: None)
+    with pytest.raises(ValueError):
+        periodic(every=1, jitter=-1)(lambda: None)
+
+
+def test_periodic_rate_jitter_does_not_drift():
+    every, jitter, tolerance = 0.1, 0.03, 0.03
+    times = []
+
+    @periodic(every=every, jitter=jitter)
+    def tick():
+        times.append(time.monotonic())
+
+    base = time.monotonic()
+    tick()
+    try:
+        _wait(lambda: len(times) >= 12)
+    finally:
+        tick.stop()
+
+    for t in times:
+        # Every tick runs at base + n*every plus at most the jitter, skipped ticks do not matter
+        n = round((t - base - jitter / 2) / every)
+        assert -tolerance <= t - (base + n * every) <= jitter + tolerance
+
+
+def test_periodic_stop():
+    runs = []
+
+    @periodic(every=0.02)
+    def tick():
+        runs.append(1)
+
+    tick()
+    _wait(lambda: len(runs) >= 3)
+    tick.stop()
+    time.sleep(0.05)
+    count = len(runs)
+    time.sleep(0.1)
+
+    assert len(runs) == count
+    assert tick.stats['runs'] == count
+
+
+def test_periodic_skips_while_running():
+    release = threading.Event()
+    runs = []
+
+    @periodic(every=0.02)
+    def slow():
+        runs.append(1)
+        release.wait(5)
+
+    slow()
+    try:
+        _wait(lambda: slow.stats['skipped'] >= 3)
+        assert len(runs) == 1
+    finally:
+        slow.stop()
+        release.set()
+
+
+def test_periodic_delay_mode():
+    times = []
+
+    @periodic(every=0.05, mode='delay')
+    def tick():
+        times.append(time.monotonic())
+        time.sleep(0.05)
+
+    tick()
+    try:
+        _wait(lambda: len(times) >= 3)
+    finally:
+        tick.stop()
+
+    # The delay is counted after each execution finishes
+    assert all(b - a >= 0.1 for a, b in zip(times, times[1:]))
+
+
+def test_periodic_method_per_instance():
+    class Counter():
+        def __init__(self):
+            self.runs = 0
+
+        @periodic(every=0.02)
+        def tick(self):
+            self.runs += 1
+
+    first, second = Counter(), Counter()
+    first.tick()
+    second.tick()
+    try:
+        _wait(lambda: first.runs >= 2 and second.runs >= 2)
+        first.tick.stop()
+        time.sleep(0.05)
+        stopped = first.runs
+        runs = second.runs
+        _wait(lambda: second.runs > runs + 2)
+
+        assert first.runs == stopped
+        assert first.tick is not second.tick
+        assert first.tick.stats['runs'] == stopped
+        assert second.tick.stats['runs'] >= second.runs - 1
+    finally:
+        first.tick.stop()
+        second.tick.stop()
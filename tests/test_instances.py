@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+from werkzeug.test import Client
+from werkzeug.wrappers import Request, Response
+
+from halborn_ctf.functions import periodic
+from halborn_ctf.instances import InstanceHost
+from halborn_ctf.network import json_rpc
+from halborn_ctf.services import Service
+from halborn_ctf.templates import FlagType, GenericChallenge, Web3Challenge
+
+
+class _Challenge(GenericChallenge):
+    FLAG_TYPE = FlagType.DYNAMIC
+    HAS_SOLVER = True
+    SOLVER_MIN_INTERVAL = 0
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.state = {'value': 0}
+        self.ticks = 0
+
+    @periodic(every=0.02)
+    def tick(self):
+        self.ticks += 1
+
+    def value_handler(self):
+        return {'value': self.state.value}
+
+    def solver(self):
+        self.solved = self.state.value == 42
+
+    def run(self):
+        self.services.start(Service('sleep', 'sleep 30', shutdown_timeout=1))
+        self.register_path('/value', self.value_handler)
+        self.tick()
+
+
+class _StubChain():
+    """JSON-RPC chain with a single storage value supporting snapshots.
+    """
+    def __init__(self):
+        self.value = 0
+        self.snapshots = {}
+        self._server = make_server('127.0.0.1', 0, self)
+        self.url = 'http://127.0.0.1:{}'.format(self._server.server_port)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _call(self, method, params):
+        if method == 'evm_snapshot':
+            snapshot_id = hex(len(self.snapshots) + 1)
+            self.snapshots[snapshot_id] = self.value
+            return snapshot_id
+        if method == 'evm_revert':
+            if params[0] not in self.snapshots:
+                return False
+            self.value = self.snapshots.pop(params[0])
+            return True
+        if method == 'eth_getStorageAt':
+            return hex(self.value)
+        raise AssertionError(method)
+
+    def __call__(self, environ, start_response):
+        payload = json.loads(Request(environ).get_data())
+        result = self._call(payload['method'], payload['params'])
+        body = json.dumps({'jsonrpc': '2.0', 'id': payload['id'], 'result': result})
+        return Response(body, mimetype='application/json')(environ, start_response)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Web3Challenge(Web3Challenge):
+    SOLVER_MIN_INTERVAL = 0
+    chains = []
+
+    def files(self):
+        return []
+
+    def solver(self):
+        self.solved = int(json_rpc(self.RPC_URL, 'eth_getStorageAt', ['0xa', '0x0']), 16) == 1
+
+    def run(self):
+        # Every instance runs its own chain
+        self.chain = _StubChain()
+        self.chains.append(self.chain)
+        self.RPC_URL = self.chain.url
+
+
+@pytest.fixture
+def host(monkeypatch, tmp_path):
+    # No build state dumps on the working directory
+    monkeypatch.chdir(tmp_path)
+    host = InstanceHost(_Challenge, token='token', shutdown_timeout=1)
+    yield host
+    host.stop()
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out waiting for the condition'
+        time.sleep(0.01)
+
+
+def _create(host, *instance_ids):
+    instances = [host.create(instance_id) for instance_id in instance_ids]
+    for instance in instances:
+        instance._future.result(10)
+        assert instance.status == 'ready'
+    return instances
+
+
+def test_instances_isolated(host):
+    first, second = _create(host, 'first', 'second')
+    first.challenge.flag = 'HAL{first}'
+    second.challenge.flag = 'HAL{second}'
+    first.challenge.state.value = 42
+
+    client = Client(host)
+    assert client.get('/i/first/value').json == {'value': 42}
+    assert client.get('/i/second/value').json == {'value': 0}
+
+    solved = client.get('/i/first/solved?wait=1').json
+    assert solved['solved'] and solved['flag'] == 'HAL{first}'
+    solved = client.get('/i/second/solved?wait=1').json
+    assert not solved['solved'] and 'flag' not in solved
+
+    assert first.challenge.services is not second.challenge.services
+    assert first.challenge.tick is not second.challenge.tick
+    assert client.get('/i/other/value').status_code == 404
+
+
+def test_destroy_stops_instance(host):
+    first, second = _create(host, 'first', 'second')
+    proc = first.challenge.services['sleep'].proc
+    _wait(lambda: first.challenge.ticks >= 2 and second.challenge.ticks >= 2)
+
+    host.destroy('first')
+
+    assert first.status == 'destroyed'
+    assert proc.poll() is not None
+    assert all(p.poll() is not None for p in first.procs)
+    ticks = first.challenge.ticks
+    running = second.challenge.ticks
+    # The periodic method of the other instance keeps running
+    _wait(lambda: second.challenge.ticks > running + 2)
+    assert first.challenge.ticks == ticks
+    assert second.challenge.services['sleep'].proc.poll() is None
+    assert Client(host).get('/i/first/value').status_code == 404
+    with pytest.raises(KeyError):
+        host.destroy('first')
+
+
+def test_reset_deploys_fresh_challenge(host):
+    previous, = _create(host, 'first')
+    previous.challenge.flag = 'HAL{player}'
+    previous.challenge.state.value = 42
+    proc = previous.challenge.services['sleep'].proc
+
+    instance = host.reset('first')
+    instance._future.result(10)
+
+    assert instance.status == 'ready'
+    assert host['first'] is instance
+    assert instance.challenge is not previous.challenge
+    assert instance.challenge.flag == 'HAL{player}'
+    assert proc.poll() is not None
+    assert Client(host).get('/i/first/value').json == {'value': 0}
+
+
+def test_instances_api_token(host):
+    client = Client(host)
+    assert client.post('/_instances', json={'id': 'first'}).status_code == 403
+
+    response = client.post('/_instances', json={'id': 'first'}, headers={'X-Instances-Token': 'token'})
+    assert response.status_code == 202
+    host['first']._future.result(10)
+    response = client.get('/_instances/first', headers={'X-Instances-Token': 'token'})
+    assert response.json['status'] == 'ready'
+    response = client.delete('/_instances/first', headers={'X-Instances-Token': 'token'})
+    assert response.json == {'id': 'first', 'status': 'destroyed'}
+
+
+def test_web3_instances_own_chains(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    host = InstanceHost(_Web3Challenge, token='token')
+    try:
+        first, second = _create(host, 'first', 'second')
+        assert first.challenge.RPC_URL != second.challenge.RPC_URL
+
+        client = Client(host)
+        first.challenge.chain.value = 1
+        second.challenge.chain.value = 1
+        assert client.get('/i/first/solved?wait=1').json['solved']
+        assert client.get('/i/second/solved?wait=1').json['solved']
+
+        # Only the chain of the instance is reverted
+        assert client.post('/i/first/reset').json['reset']
+        assert first.challenge.chain.value == 0
+        assert second.challenge.chain.value == 1
+        assert not client.get('/i/first/solved?wait=1').json['solved']
+        assert client.get('/i/second/solved?refresh=0').json['solved']
+
+        assert client.post('/i/second/reset').json['reset']
+        assert second.challenge.chain.value == 0
+        assert not client.get('/i/second/solved?wait=1').json['solved']
+    finally:
+        host.stop()
+        while _Web3Challenge.chains:
+            _Web3Challenge.chains.pop().stop()
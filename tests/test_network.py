@@ -0,0 +1,51 @@
+import json
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+from halborn_ctf.network import rpc_probe, wait_ready
+
+
+class _StartingNode():
+    """JSON-RPC node answering with an error to the first ``errors`` calls.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        payload = json.loads(Request(environ).get_data())
+        self.calls += 1
+        if self.calls <= self.errors:
+            body = {'jsonrpc': '2.0', 'id': payload['id'], 'error': {'code': -32000, 'message': 'Node is starting'}}
+        else:
+            body = {'jsonrpc': '2.0', 'id': payload['id'], 'result': '0x7a69'}
+        return Response(json.dumps(body), mimetype='application/json')(environ, start_response)
+
+
+@pytest.fixture
+def node():
+    node = _StartingNode(errors=2)
+    server = make_server('127.0.0.1', 0, node)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    node.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    yield node
+    server.shutdown()
+    server.server_close()
+
+
+def test_rpc_probe_error_not_ready(node):
+    probe = rpc_probe(node.url)
+
+    assert probe() is False
+    assert probe() is False
+    assert probe() is True
+
+
+def test_wait_ready_rpc_error(node):
+    ready = wait_ready(rpc_probe(node.url), timeout=5)
+
+    assert list(ready) == ['{} eth_chainId'.format(node.url)]
+    assert node.calls == 3
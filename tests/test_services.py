@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from halborn_ctf import services
+from halborn_ctf.services import Service, Step, Supervisor
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    monkeypatch.setattr(services, '_MONITOR_INTERVAL', 0.02)
+    supervisor = Supervisor()
+    yield supervisor
+    supervisor.stop()
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out waiting for the condition'
+        time.sleep(0.01)
+
+
+def _ready_once():
+    """Readiness probe only ready on its first check (the restarts are never ready).
+    """
+    calls = []
+    return lambda: calls.append(1) or len(calls) == 1
+
+
+def test_restart_on_failure(supervisor, tmp_path):
+    runs = tmp_path / 'runs'
+    service = Service('crash', 'echo run >> {}; sleep 0.1; exit 1'.format(runs), max_restarts=2)
+    supervisor.start(service)
+
+    _wait(lambda: service.status == 'failed')
+
+    assert service.restarts == 2
+    assert runs.read_text().count('run') == 3
+
+
+def test_no_restart_on_success(supervisor):
+    service = Service('done', 'exit 0')
+    supervisor.start(service)
+
+    _wait(lambda: service.status == 'failed')
+    assert service.restarts == 0
+
+
+def test_restart_not_ready_is_restarted_again(supervisor, tmp_path):
+    marker = tmp_path / 'restarted'
+    # The first run crashes, the restarts keep running but are never ready
+    service = Service('flaky', 'if [ -f {0} ]; then sleep 30; else touch {0}; sleep 0.1; exit 1; fi'.format(marker),
+                      ready=_ready_once(), ready_timeout=0.3, max_restarts=2, shutdown_timeout=0.5)
+    supervisor.start(service)
+
+    _wait(lambda: service.restarts == 1)
+    _wait(lambda: service.restarts == 2)
+    _wait(lambda: service.status == 'failed')
+    assert service.proc.poll() is not None
+
+
+def test_restart_does_not_block_other_services(supervisor, tmp_path):
+    marker = tmp_path / 'restarted'
+    # The restart of "slow" waits 5 seconds for a readiness that never comes
+    slow = Service('slow', 'if [ -f {0} ]; then sleep 30; else touch {0}; sleep 0.1; exit 1; fi'.format(marker),
+                   ready=_ready_once(), ready_timeout=5, shutdown_timeout=0.5)
+    crash = Service('crash', 'sleep 0.8; exit 1', shutdown_timeout=0.5)
+    supervisor.start(slow, crash)
+
+    _wait(lambda: slow.restarts == 1 and slow.status == 'starting')
+    _wait(lambda: crash.restarts == 1 and crash.status == 'ready', timeout=2)
+    assert slow.status == 'starting'
+
+
+def test_stop_escalates_signals(supervisor, tmp_path):
+    trapped = tmp_path / 'trapped'
+    service = Service('stubborn', "trap '' INT TERM; touch {}; sleep 30 & wait".format(trapped), ready=trapped.exists,
+                      shutdown_timeout=0.2)
+    supervisor.start(service)
+
+    start = time.monotonic()
+    supervisor.stop()
+
+    assert time.monotonic() - start < 2
+    assert service.proc.returncode == -9
+    assert service.status == 'stopped'
+
+
+def test_stop_in_reverse_dependency_order(supervisor, tmp_path):
+    stopped = tmp_path / 'stopped'
+    # Background commands of sh ignore SIGINT, the trap stops it
+    command = "trap 'echo {0} >> {1}; kill $!; exit 0' INT; touch {1}.{0}; sleep 30 & wait"
+    supervisor.start(
+        Service('db', command.format('db', stopped), ready=lambda: (tmp_path / 'stopped.db').exists()),
+        Step('seed', lambda: None, depends_on=['db']),
+        Service('api', command.format('api', stopped), ready=lambda: (tmp_path / 'stopped.api').exists(),
+                depends_on=['seed']),
+    )
+
+    supervisor.stop()
+
+    assert stopped.read_text().split() == ['api', 'db']
+    assert supervisor.status == {'db': 'stopped', 'seed': 'ready', 'api': 'stopped'}
@@ -0,0 +1,42 @@
+import logging
+
+import pytest
+
+from halborn_ctf import shell
+
+
+@pytest.fixture
+def failing_output():
+    output_logger = logging.getLogger('halborn_ctf.shell.output')
+    level = output_logger.level
+    output_logger.setLevel(logging.INFO)
+
+    def fail(record):
+        if 'boom' in record.getMessage():
+            raise RuntimeError('Broken handler')
+        return True
+
+    output_logger.addFilter(fail)
+    yield
+    output_logger.removeFilter(fail)
+    output_logger.setLevel(level)
+
+
+def test_output_error_drops_only_its_stream(failing_output):
+    # The failing stream is closed, the process is not blocked on a full pipe and the others are still drained
+    proc, _, _ = shell.run('echo boom; seq 1 100000')
+    assert proc.returncode is not None
+
+    proc, stdout, _ = shell.run('seq 1 100000', capture_output=True)
+    assert stdout.split()[-1] == '100000'
+    proc, _, _ = shell.run('echo done')
+    assert shell.recent_output(proc) == ['done']
+
+
+def test_output_without_new_lines_is_split():
+    proc, _, _ = shell.run("head -c 300000 /dev/zero | tr '\\0' a")
+
+    lines = shell.recent_output(proc)
+    assert len(lines) > 1
+    assert sum(len(line) for line in lines) == 300000
+    assert all(len(line) < shell._MAX_LINE + shell._READ_SIZE for line in lines)
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from halborn_ctf._solver import _SolverWorker
+
+
+def test_solver_timeout_cancels_run():
+    cancelled = threading.Event()
+
+    def solver():
+        while not worker.cancelled:
+            time.sleep(0.01)
+        cancelled.set()
+
+    worker = _SolverWorker(solver, min_interval=0, timeout=0.1)
+    worker.refresh()
+
+    assert cancelled.wait(5)
+    assert worker.wait(5)
+    assert worker.timed_out
+    worker.stop()
+
+
+def test_solver_stop_cancels_run():
+    started = threading.Event()
+    returned = threading.Event()
+
+    def solver():
+        started.set()
+        while not worker.cancelled:
+            time.sleep(0.01)
+        returned.set()
+
+    worker = _SolverWorker(solver, min_interval=0, timeout=30)
+    worker.refresh()
+    assert started.wait(5)
+
+    worker.stop()
+
+    assert returned.wait(5)
+    assert not worker.refresh()
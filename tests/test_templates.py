@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from halborn_ctf import _profiling, templates
+from halborn_ctf.network import JSONRPCError
+from halborn_ctf.templates import Web3Challenge
+
+
+class _Challenge(Web3Challenge):
+    def files(self):
+        return []
+
+    def solver(self):
+        pass
+
+    def run(self):
+        pass
+
+
+class _FakeChain():
+    def __init__(self):
+        self.snapshots = 0
+        self.fail_snapshot = False
+
+    def __call__(self, url, method, params=None):
+        if method == 'evm_snapshot':
+            if self.fail_snapshot:
+                raise JSONRPCError(-32601, 'Method not found')
+            self.snapshots += 1
+            return hex(self.snapshots)
+        if method == 'evm_revert':
+            return params[0] == hex(self.snapshots)
+        raise AssertionError(method)
+
+
+@pytest.fixture
+def challenge(monkeypatch):
+    chain = _FakeChain()
+    monkeypatch.setattr(templates, 'json_rpc', chain)
+    challenge = _Challenge()
+    challenge.state = {'value': 0}
+    challenge._snapshot()
+    challenge._ready = True
+    challenge.chain = chain
+    return challenge
+
+
+def test_reset_restores_state(challenge):
+    challenge.state.value = 1
+    challenge.solved = True
+
+    assert challenge._app_reset_handler()['reset']
+    assert challenge.state.value == 0
+    assert not challenge.solved
+    assert challenge._chain_snapshot == '0x2'
+
+
+def test_reset_snapshot_failure(challenge):
+    challenge.state.value = 1
+    challenge.chain.fail_snapshot = True
+
+    response = challenge._app_reset_handler()
+    assert response.status_code == 500
+    assert 'snapshot the chain again' in response.get_data(as_text=True)
+    # Reverted and restored, but the consumed snapshot is not used again
+    assert challenge.state.value == 0
+    assert challenge._chain_snapshot is None
+    assert challenge._app_reset_handler().status_code == 501
+
+
+def test_debug_profile_parameters(monkeypatch, challenge):
+    sampled = []
+    monkeypatch.setattr(_profiling, 'sample', lambda seconds, interval: sampled.append((seconds, interval)) or '')
+    monkeypatch.setenv('DEBUG_TOKEN', 'token')
+    challenge._app = challenge._new_app('Challenge')
+    challenge._register_flask_paths()
+    client = challenge._app.test_client()
+
+    def get(query):
+        return client.get('/_debug/profile?token=token&' + query).status_code
+
+    assert get('seconds=0.5&interval=0.01') == 200
+    assert get('seconds=3600&interval=0') == 400
+    assert get('seconds=3600&interval=0.000001') == 200
+    assert get('interval=60') == 200
+    assert sampled == [(0.5, 0.01), (60, 0.001), (10, 1)]
+
+    for query in ('seconds=abc', 'interval=abc', 'seconds=nan', 'seconds=inf', 'seconds=-1'):
+        assert get(query) == 400
+    assert len(sampled) == 3
+
+
+def test_reset_concurrent_snapshot_failure(monkeypatch, challenge):
+    challenge.chain.fail_snapshot = True
+    reverted = []
+
+    def chain(url, method, params=None):
+        if method == 'evm_revert':
+            reverted.append(params[0])
+        return challenge.chain(url, method, params)
+
+    monkeypatch.setattr(templates, 'json_rpc', chain)
+    responses = []
+    with challenge._reset_lock:
+        threads = [threading.Thread(target=lambda: responses.append(challenge._app_reset_handler())) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+    for thread in threads:
+        thread.join(5)
+
+    # The second reset does not revert the snapshot consumed by the first one
+    assert sorted(response.status_code for response in responses) == [500, 501]
+    assert reverted == ['0x1']
+
+
+def test_debug_profile_header_without_token(monkeypatch, challenge):
+    monkeypatch.setenv('DEBUG_TOKEN', 'token')
+    challenge._app = challenge._new_app('Challenge')
+    challenge._register_flask_paths()
+    client = challenge._app.test_client()
+
+    for headers in ({'X-Debug-Profile': '1'}, {'X-Debug-Profile': '1', 'X-Debug-Token': 'wrong'}):
+        response = client.get('/healthz', headers=headers)
+        assert response.status_code == 200
+        assert 'X-Debug-Profile-Id' not in response.headers
+        assert client.get('/_debug/threads', headers=headers).status_code == 403
+
+    response = client.get('/healthz', headers={'X-Debug-Profile': '1', 'X-Debug-Token': 'token'})
+    profile_id = response.headers['X-Debug-Profile-Id']
+    assert client.get('/_debug/requests/' + profile_id, headers={'X-Debug-Token': 'token'}).status_code == 200